@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: directory listing benchmark
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+"""Times building the menu for a large directory, with and without the
+directory handler's entry cache.
+
+Run from the top of the source tree:
+
+    python bench/dirlisting.py [numfiles] [runs]
+"""
+
+import sys, os, tempfile, shutil, time
+sys.path.insert(0, '.')
+from pygopherd import testutil, initialization, logger
+from pygopherd.handlers import base, dir, HandlerMultiplexer
+
+def makeroot(numfiles):
+    root = tempfile.mkdtemp()
+    exts = ['.txt', '.html', '.txt.gz', '.jpg', '.c', '']
+    for i in range(numfiles):
+        name = 'file%05d%s' % (i, exts[i % len(exts)])
+        fd = open(os.path.join(root, name), 'w')
+        if name.endswith('.html'):
+            fd.write('<html><title>Page %d</title></html>\n' % i)
+        else:
+            fd.write('Contents of file %d\n' % i)
+        fd.close()
+        if i % 100 == 0:
+            fd = open(os.path.join(root, name + '.abstract'), 'w')
+            fd.write('Abstract for file %d\n' % i)
+            fd.close()
+    return root
+
+def getconfig(root, entrycache):
+    config = testutil.getconfig()
+    config.set("pygopherd", "root", root)
+    config.set("logger", "logmethod", "none")
+    # Measure building the menu, not the whole-menu cache.
+    config.set("handlers.dir.DirHandler", "cachetime", "0")
+    config.set("handlers.dir.DirHandler", "entrycache", entrycache)
+    return config
+
+def listing(config):
+    handler = HandlerMultiplexer.getHandler('/', '', None, config)
+    handler.getentry()
+    handler.prepare()
+    return [(entry.getselector(), entry.gettype(), entry.getname(),
+             entry.geteadict()) for entry in handler.getdirlist()]
+
+def bench(root, entrycache, runs):
+    config = getconfig(root, entrycache)
+    dir.entrycache = None
+    times = []
+    for i in range(runs):
+        start = time.time()
+        result = listing(config)
+        times.append(time.time() - start)
+    return (times, result)
+
+def main():
+    numfiles = 20000
+    runs = 3
+    if len(sys.argv) > 1:
+        numfiles = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        runs = int(sys.argv[2])
+
+    root = makeroot(numfiles)
+    try:
+        config = getconfig(root, 'off')
+        logger.init(config)
+        initialization.initmimetypes(config)
+        base.rootpath = root
+
+        offtimes, offresult = bench(root, 'off', runs)
+        ontimes, onresult = bench(root, 'on', runs + 1)
+        if offresult != onresult:
+            print "MISMATCH: the entry cache changed the menu!"
+            sys.exit(1)
+
+        print "%d files, best of %d runs:" % (numfiles, runs)
+        print "  without entry cache:     %.3fs" % min(offtimes)
+        print "  entry cache, first run:  %.3fs" % ontimes[0]
+        print "  entry cache, later runs: %.3fs (%.1fx)" % \
+              (min(ontimes[1:]), min(offtimes) / min(ontimes[1:]))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: PYG resource pool benchmark
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+"""Times a PYG application that looks words up on a dict server, making
+a new connection for each request versus taking one from its pool.
+
+A stand-in dict server runs in this process.  It answers the greeting,
+STATUS, DEFINE and QUIT, and waits handshake milliseconds before its
+greeting, as a server across a network would.  The application speaks
+just enough of the protocol itself, so dictclient isn't needed.
+
+Run from the top of the source tree:
+
+    python bench/pygpool.py [requests] [handshake in ms]
+"""
+
+import sys, os, tempfile, shutil, time, socket, threading, SocketServer
+from StringIO import StringIO
+sys.path.insert(0, '.')
+from pygopherd import testutil, logger
+from pygopherd.handlers import base, pyg
+
+class DictHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        time.sleep(self.server.handshake)
+        self.wfile.write("220 stand-in dict server <mime> <1@localhost>\r\n")
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                return
+            words = line.split()
+            if words[0] == 'STATUS':
+                self.wfile.write("210 up\r\n")
+            elif words[0] == 'DEFINE':
+                self.wfile.write('150 1 definitions retrieved\r\n'
+                                 '151 "%s" bench "Benchmark"\r\n'
+                                 '%s: a word.\r\n.\r\n250 ok\r\n' % \
+                                 (words[2], words[2]))
+            elif words[0] == 'QUIT':
+                self.wfile.write("221 bye\r\n")
+                return
+
+class DictServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = 1
+    daemon_threads = 1
+
+appsource = """
+import socket
+from pygopherd.handlers.pyg import PYGBase
+from pygopherd.gopherentry import GopherEntry
+
+port = %d
+pooled = %d
+
+class Connection:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(('127.0.0.1', port))
+        self.rfile = self.sock.makefile('rb')
+        self.rfile.readline()
+
+    def command(self, command):
+        self.sock.sendall(command + "\\r\\n")
+        return self.rfile.readline()
+
+    def define(self, word):
+        lines = [self.command('DEFINE * ' + word)]
+        while not lines[-1].startswith('250'):
+            lines.append(self.rfile.readline())
+        return ''.join(lines[2:-2])
+
+    def close(self):
+        self.command('QUIT')
+        self.sock.close()
+
+def check(conn):
+    try:
+        return conn.command('STATUS').startswith('210')
+    except socket.error:
+        return 0
+
+class PYGMain(PYGBase):
+    def canhandlerequest(self):
+        return 1
+
+    def prepare(self):
+        if pooled:
+            conn = self.getresource('dict', Connection, check,
+                                    Connection.close)
+        else:
+            conn = Connection()
+        self.definition = conn.define(self.selectorargs)
+        if not pooled:
+            conn.close()
+
+    def getentry(self):
+        entry = GopherEntry(self.selector, self.config)
+        entry.type = '0'
+        return entry
+
+    def write(self, wfile):
+        wfile.write(self.definition)
+"""
+
+def run(root, config, port, pooled, requests):
+    filename = os.path.join(root, 'dict%d.pyg' % pooled)
+    fd = open(filename, 'w')
+    fd.write(appsource % (port, pooled))
+    fd.close()
+    os.chmod(filename, 0755)
+    when = time.time() - 60
+    os.utime(filename, (when, when))
+
+    selector = '/dict%d.pyg' % pooled
+    start = time.time()
+    for i in range(requests):
+        handler = pyg.PYGHandler(selector + '|word%d' % i, '', None, config,
+                                 None)
+        assert handler.canhandlerequest()
+        handler.prepare()
+        wfile = StringIO()
+        handler.write(wfile)
+        assert wfile.getvalue() == 'word%d: a word.\r\n' % i, wfile.getvalue()
+    return time.time() - start
+
+def main():
+    requests = 500
+    handshake = 1.0
+    if len(sys.argv) > 1:
+        requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        handshake = float(sys.argv[2])
+
+    server = DictServer(('127.0.0.1', 0), DictHandler)
+    server.handshake = handshake / 1000.0
+    thread = threading.Thread(target = server.serve_forever)
+    thread.setDaemon(1)
+    thread.start()
+    port = server.socket.getsockname()[1]
+
+    root = tempfile.mkdtemp()
+    try:
+        config = testutil.getconfig()
+        config.set("pygopherd", "root", root)
+        config.set("logger", "logmethod", "none")
+        logger.init(config)
+        base.rootpath = root
+
+        print "%d requests, %.1fms handshake:" % (requests, handshake)
+        fresh = run(root, config, port, 0, requests)
+        print "  new connection each time: %.3fs" % fresh
+        pooled = run(root, config, port, 1, requests)
+        print "  pooled connection:        %.3fs (%.1fx)" % \
+              (pooled, fresh / pooled)
+        base.finishworker()
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: directory listing benchmark on a slow filesystem
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+"""Times building the menu for a directory on a filesystem that takes
+a while to answer each call, as NFS does, with different numbers of
+metadata threads.
+
+Run from the top of the source tree:
+
+    python bench/slowfs.py [numfiles] [latency in ms] [threads...]
+"""
+
+import sys, os, shutil, time
+sys.path.insert(0, '.')
+sys.path.insert(0, 'bench')
+from pygopherd import testutil, initialization, logger, gopherentry
+from pygopherd.handlers import base, dir, html, HandlerMultiplexer
+from dirlisting import makeroot, getconfig
+
+def listing(config, vfs):
+    handler = HandlerMultiplexer.getHandler('/', '', None, config, vfs = vfs)
+    handler.getentry()
+    handler.prepare()
+    return [(entry.getselector(), entry.gettype(), entry.getname(),
+             entry.geteadict()) for entry in handler.getdirlist()]
+
+def main():
+    numfiles = 500
+    latency = 2.0
+    threadcounts = [1, 4, 8, 16]
+    if len(sys.argv) > 1:
+        numfiles = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        threadcounts = map(int, sys.argv[3:])
+
+    root = makeroot(numfiles)
+    try:
+        # Without the entry cache, every run does all the work.
+        config = getconfig(root, 'off')
+        logger.init(config)
+        initialization.initmimetypes(config)
+        base.rootpath = root
+
+        print "%d files, %.1fms per filesystem call:" % (numfiles, latency)
+        expected = None
+        for threads in threadcounts:
+            config.set("handlers.dir.DirHandler", "metadatathreads",
+                       str(threads))
+            dir.metadatathreads = None
+            # Start each run cold.
+            gopherentry.eacache.clear()
+            html.titlecaches.clear()
+            if os.path.exists(os.path.join(root, '.cache.pygopherd.html')):
+                os.unlink(os.path.join(root, '.cache.pygopherd.html'))
+            vfs = testutil.VFS_Slow(config, latency / 1000.0)
+            start = time.time()
+            result = listing(config, vfs)
+            elapsed = time.time() - start
+            if expected == None:
+                expected = (elapsed, result)
+            elif result != expected[1]:
+                print "MISMATCH: %d threads changed the menu!" % threads
+                sys.exit(1)
+            print "  %2d threads: %.3fs, %d calls (%.1fx)" % \
+                  (threads, elapsed, vfs.calls, expected[0] / elapsed)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
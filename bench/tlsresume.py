@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: TLS session resumption benchmark
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+"""Times fetching a small document over a TLS listener with a full
+handshake for every connection versus resuming the first connection's
+session, with session tickets on and off.
+
+The server runs in this process with a self-signed certificate made by
+the openssl program, whose s_time command is the client: Python's ssl
+module can't resume a session on the client side.  Without tickets,
+sessions can only be resumed from the server's session cache, which
+under the forking server each worker keeps to itself; the reuse count
+shows how many actually were.
+
+Run from the top of the source tree:
+
+    python bench/tlsresume.py [seconds] [servertype]
+
+servertype is ForkingTCPServer (the default) or ThreadingTCPServer.
+"""
+
+import sys, os, re, tempfile, shutil, threading
+sys.path.insert(0, '.')
+from pygopherd import testutil, initialization, logger
+from pygopherd.handlers import base
+
+def makeroot():
+    root = tempfile.mkdtemp()
+    fd = open(os.path.join(root, 'README'), 'w')
+    fd.write('A small document.\n')
+    fd.close()
+    certfile = os.path.join(root, 'cert.pem')
+    if os.system("openssl req -x509 -newkey rsa:2048 -nodes -days 1 "
+                 "-subj /CN=localhost -keyout %s -out %s >/dev/null 2>&1" % \
+                 (certfile, certfile)):
+        shutil.rmtree(root)
+        print "Can't make a certificate with the openssl program."
+        sys.exit(1)
+    return root
+
+def getconfig(root, servertype, sessiontickets):
+    config = testutil.getconfig()
+    config.set("pygopherd", "root", root)
+    config.set("pygopherd", "servertype", servertype)
+    config.set("pygopherd", "interface", "127.0.0.1")
+    config.set("pygopherd", "port", "0")
+    config.set("logger", "logmethod", "none")
+    config.add_section("listener.secure")
+    config.set("listener.secure", "address", "127.0.0.1:0")
+    config.set("listener.secure", "tls", "yes")
+    config.set("listener.secure", "certfile", os.path.join(root, 'cert.pem'))
+    config.set("listener.secure", "sessiontickets", sessiontickets)
+    return config
+
+def stime(address, seconds, reuse):
+    """Runs openssl s_time against address; returns (connections per
+    second, connections made, sessions resumed)."""
+    mode = '-new'
+    if reuse:
+        mode = '-reuse'
+    pipe = os.popen("openssl s_time -connect %s:%d -www /README -time %d "
+                    "%s 2>&1" % (address[0], address[1], seconds, mode))
+    output = pipe.read()
+    pipe.close()
+    match = re.search(r'(\d+) connections in ([\d.]+) real seconds', output)
+    if not match:
+        print output
+        sys.exit(1)
+    connections = int(match.group(1))
+    # With -reuse, s_time prints r for each connection that resumed.
+    resumed = 0
+    if reuse:
+        progress = output[output.find('session id reuse'):].split('\n')[2]
+        resumed = progress.count('r')
+    return (connections / float(match.group(2)), connections, resumed)
+
+def bench(root, servertype, sessiontickets, seconds, reuse):
+    server = initialization.getserverobject(getconfig(root, servertype,
+                                                      sessiontickets))
+    thread = threading.Thread(target = server.serve_forever, args = (0.05,))
+    thread.start()
+    try:
+        return stime(server.listeners[1].socket.getsockname(), seconds,
+                     reuse)
+    finally:
+        server.shutdown()
+        thread.join()
+        for listener in server.listeners:
+            listener.server_close()
+
+def main():
+    seconds = 5
+    servertype = 'ForkingTCPServer'
+    if len(sys.argv) > 1:
+        seconds = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        servertype = sys.argv[2]
+
+    root = makeroot()
+    try:
+        config = getconfig(root, servertype, 'yes')
+        logger.init(config)
+        initialization.initmimetypes(config)
+        base.rootpath = root
+
+        print "%s, %d seconds each:" % (servertype, seconds)
+        full = None
+        for title, sessiontickets, reuse in \
+                [("full handshakes", 'yes', 0),
+                 ("resumed, session tickets", 'yes', 1),
+                 ("resumed, session cache only", 'no', 1)]:
+            rate, connections, resumed = bench(root, servertype,
+                                               sessiontickets, seconds, reuse)
+            line = "  %-28s %7.1f/s" % (title + ':', rate)
+            if full:
+                line += " (%.1fx)" % (rate / full)
+            else:
+                full = rate
+            if reuse:
+                line += ", %d of %d resumed" % (resumed, connections)
+            print line
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,11 @@
 
 __all__ = ['handlers', 'protocols', 'GopherExceptions',
 'GopherExceptionsTest', 'gopherentry', 'gopherentryTest',
-           'logger', 'loggerTest',
-'fileext', 'fileextTest', 'pipe', 'pipeTest', 'initialization',
+           'logger', 'loggerTest', 'admission', 'admissionTest',
+           'deadline', 'deadlineTest', 'listeners', 'listenersTest',
+           'tls', 'tlsTest', 'privatedir', 'contentcache',
+           'contentcacheTest', 'warmup', 'warmupTest',
+'fileext', 'fileextTest', 'pipe', 'pipeTest', 'parallel', 'parallelTest',
+           'scriptworkers', 'scriptworkersTest', 'searchindex',
+           'searchindexTest', 'zipfileTest', 'initialization',
            'initializationTest', 'testutil', 'version']
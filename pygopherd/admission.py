@@ -0,0 +1,257 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: per-client connection and request rate limits
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socket, time
+from pygopherd import logger
+try:
+    import threading
+except ImportError:
+    threading = None
+
+section = "admission"
+
+class Client:
+    """What is known about one address or subnet: its token bucket,
+    how many of its connections are open, and how many it has made and
+    had turned away."""
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.connections = 0
+        self.requests = 0
+        self.rejected = 0
+
+class Admission:
+    """Decides, as each connection is accepted and before anything is
+    read from it, whether its client may have it.  Each address, and
+    each subnet, may have only so many connections open at once, and
+    may open them only so fast: a token bucket per address and per
+    subnet holds up to burst tokens, refilled at rate per second, and
+    each connection takes one.
+
+    The server that accepts connections keeps one of these.  Under the
+    forking server that is the parent process, so the counts cover every
+    worker; under the threading server, it is shared by the threads."""
+
+    def __init__(self, config):
+        self.maxperaddress = self.getint(config, "maxperaddress", 0)
+        self.maxpersubnet = self.getint(config, "maxpersubnet", 0)
+        self.rate = self.getfloat(config, "rate", 0)
+        self.burst = self.getfloat(config, "burst", 0)
+        self.subnetrate = self.getfloat(config, "subnetrate", 0)
+        self.subnetburst = self.getfloat(config, "subnetburst", 0)
+        self.ipv4prefix = self.getint(config, "ipv4prefix", 24)
+        self.ipv6prefix = self.getint(config, "ipv6prefix", 64)
+        self.maxtracked = self.getint(config, "maxtracked", 10000)
+        self.exempt = {}
+        if config.has_option(section, "exempt"):
+            for address in config.get(section, "exempt").split():
+                self.exempt[address] = 1
+        self.message = "Too many requests from your address; " \
+                       "please try again later."
+        if config.has_option(section, "message"):
+            self.message = config.get(section, "message")
+        self.addresses = {}
+        self.subnets = {}
+        self.accepted = 0
+        self.rejected = 0
+        if threading:
+            self.lock = threading.Lock()
+        else:
+            self.lock = None
+
+    def getint(self, config, name, default):
+        if config.has_option(section, name):
+            return config.getint(section, name)
+        return default
+
+    def getfloat(self, config, name, default):
+        if config.has_option(section, name):
+            return config.getfloat(section, name)
+        return default
+
+    def isenabled(self):
+        return self.maxperaddress > 0 or self.maxpersubnet > 0 or \
+               self.rate > 0 or self.subnetrate > 0
+
+    def admit(self, address, now = None):
+        """Returns None if address may have another connection, counting
+        it as open until release() is called, or the reason it may not."""
+        if not self.isenabled() or self.exempt.has_key(address):
+            return None
+        if now == None:
+            now = time.time()
+        if self.lock:
+            self.lock.acquire()
+        try:
+            client = self.getclient(self.addresses, address, self.burst, now)
+            subnet = self.getclient(self.subnets, getsubnet(address,
+                                    self.ipv4prefix, self.ipv6prefix),
+                                    self.subnetburst, now)
+            client.requests += 1
+            subnet.requests += 1
+            reason = None
+            if self.maxperaddress > 0 and \
+               client.connections >= self.maxperaddress:
+                reason = "too many connections from the address"
+            elif self.maxpersubnet > 0 and \
+                 subnet.connections >= self.maxpersubnet:
+                reason = "too many connections from the subnet"
+            elif not self.refill(client, self.rate, self.burst, now):
+                reason = "request rate of the address"
+            elif not self.refill(subnet, self.subnetrate, self.subnetburst,
+                                 now):
+                reason = "request rate of the subnet"
+            if reason:
+                client.rejected += 1
+                subnet.rejected += 1
+                self.rejected += 1
+                # Log when a client starts being turned away, and now and
+                # then while it carries on, rather than for every one.
+                if client.rejected % 100 == 1:
+                    logger.log("%s: turned away (%s); %d so far" % \
+                               (address, reason, client.rejected))
+                return reason
+            if self.rate > 0:
+                client.tokens -= 1
+            if self.subnetrate > 0:
+                subnet.tokens -= 1
+            client.connections += 1
+            subnet.connections += 1
+            self.accepted += 1
+            return None
+        finally:
+            if self.lock:
+                self.lock.release()
+
+    def release(self, address):
+        """Counts a connection that admit() let in as closed."""
+        if not self.isenabled() or self.exempt.has_key(address):
+            return
+        if self.lock:
+            self.lock.acquire()
+        try:
+            subnet = getsubnet(address, self.ipv4prefix, self.ipv6prefix)
+            for clients, key in [(self.addresses, address),
+                                 (self.subnets, subnet)]:
+                if clients.has_key(key) and clients[key].connections > 0:
+                    clients[key].connections -= 1
+        finally:
+            if self.lock:
+                self.lock.release()
+
+    def refill(self, client, rate, burst, now):
+        """Adds the tokens earned since the bucket was last looked at.
+        Returns true if there is one to spend."""
+        if rate <= 0:
+            return 1
+        client.tokens = min(burst, client.tokens + \
+                            (now - client.updated) * rate)
+        client.updated = now
+        return client.tokens >= 1
+
+    def getclient(self, clients, key, burst, now):
+        if not clients.has_key(key):
+            if len(clients) >= self.maxtracked:
+                self.forget(clients, now)
+            clients[key] = Client(burst, now)
+        return clients[key]
+
+    def forget(self, clients, now):
+        """Makes room in clients by dropping those with no connections
+        open that were heard from least recently.  They are dropped in a
+        batch so this is seldom needed."""
+        idle = [(client.updated, key) for key, client in clients.items() \
+                if not client.connections]
+        idle.sort()
+        for updated, key in idle[:max(len(clients) / 10, 1)]:
+            del clients[key]
+
+    def gettop(self, count = 10):
+        """Returns the count addresses and subnets that made the most
+        requests, each as a list of (key, client), busiest first."""
+        if self.lock:
+            self.lock.acquire()
+        try:
+            retval = []
+            for clients in [self.addresses, self.subnets]:
+                busiest = [(-client.requests, key, client) \
+                           for key, client in clients.items()]
+                busiest.sort()
+                retval.append([(key, client) for requests, key, client \
+                               in busiest[:count]])
+            return retval
+        finally:
+            if self.lock:
+                self.lock.release()
+
+    def getstats(self, count = 10):
+        """Returns the limits, totals, and top talkers as lines of text."""
+        lines = []
+        if not self.isenabled():
+            lines.append("Admission control is disabled.")
+        else:
+            lines.append("Connections per address: %s; per subnet: %s" % \
+                         (self.maxperaddress or "unlimited",
+                          self.maxpersubnet or "unlimited"))
+            lines.append("Requests per second per address: %s, burst %s; " \
+                         "per subnet: %s, burst %s" % \
+                         (self.rate or "unlimited", self.burst,
+                          self.subnetrate or "unlimited", self.subnetburst))
+        lines.append("Accepted: %d; turned away: %d" % \
+                     (self.accepted, self.rejected))
+        addresses, subnets = self.gettop(count)
+        for title, clients in [("address", addresses), ("subnet", subnets)]:
+            lines.append("")
+            lines.append("%-40s %6s %10s %10s" % ("Top clients by " + title,
+                                                 "open", "requests",
+                                                 "rejected"))
+            for key, client in clients:
+                lines.append("%-40s %6d %10d %10d" % \
+                             (key, client.connections, client.requests,
+                              client.rejected))
+        return lines
+
+def getsubnet(address, ipv4prefix, ipv6prefix):
+    """Returns the subnet address belongs to, as address/prefix, with
+    ipv4prefix bits for IPv4 addresses, including those mapped into
+    IPv6, and ipv6prefix bits for other IPv6 ones.  Anything else, such
+    as a Unix socket path, is its own subnet."""
+    if address.lower().startswith('::ffff:') and '.' in address:
+        address = address[7:]
+    try:
+        packed = socket.inet_aton(address)
+        if address.count('.') != 3:
+            raise socket.error
+        prefix = ipv4prefix
+        family = socket.AF_INET
+    except socket.error:
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, address)
+        except (socket.error, ValueError, AttributeError):
+            return address
+        prefix = ipv6prefix
+        family = socket.AF_INET6
+    prefix = max(0, min(prefix, len(packed) * 8))
+    masked = ''
+    for i in range(len(packed)):
+        bits = max(0, min(8, prefix - i * 8))
+        masked += chr(ord(packed[i]) & (0xff00 >> bits) & 0xff)
+    if family == socket.AF_INET:
+        return "%s/%d" % (socket.inet_ntoa(masked), prefix)
+    return "%s/%d" % (socket.inet_ntop(family, masked), prefix)
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of admission control
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socket, threading, time
+from pygopherd import admission, initialization, testutil
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = testutil.getconfig()
+        for option in self.config.options("admission"):
+            self.config.remove_option("admission", option)
+        self.config.set("logger", "logmethod", "none")
+        initialization.initlogger(self.config, 'TESTING')
+
+    def getadmission(self, **options):
+        for name, value in options.items():
+            self.config.set("admission", name, str(value))
+        return admission.Admission(self.config)
+
+    def testdisabled(self):
+        a = self.getadmission()
+        for i in range(100):
+            self.assertEquals(a.admit('192.0.2.1'), None)
+        self.assertEquals(a.addresses, {})
+
+    def testconnections(self):
+        a = self.getadmission(maxperaddress = 2, maxpersubnet = 3,
+                              exempt = '192.0.2.9')
+        self.assertEquals(a.admit('192.0.2.1'), None)
+        self.assertEquals(a.admit('192.0.2.1'), None)
+        self.assertEquals(a.admit('192.0.2.1'),
+                          'too many connections from the address')
+        self.assertEquals(a.admit('192.0.2.2'), None)
+        self.assertEquals(a.admit('192.0.2.3'),
+                          'too many connections from the subnet')
+        self.assertEquals(a.admit('198.51.100.1'), None)
+        self.assertEquals(a.admit('192.0.2.9'), None)
+        a.release('192.0.2.1')
+        self.assertEquals(a.admit('192.0.2.3'), None)
+        self.assertEquals(a.accepted, 5)
+        self.assertEquals(a.rejected, 2)
+
+    def testrate(self):
+        a = self.getadmission(rate = 1, burst = 2, subnetrate = 0.5,
+                              subnetburst = 3)
+        for now in [0, 0.1]:
+            self.assertEquals(a.admit('192.0.2.1', now), None)
+            a.release('192.0.2.1')
+        self.assertEquals(a.admit('192.0.2.1', 0.2),
+                          'request rate of the address')
+        self.assertEquals(a.admit('192.0.2.1', 1.2), None)
+        self.assertEquals(a.admit('192.0.2.2', 1.2),
+                          'request rate of the subnet')
+        self.assertEquals(a.admit('192.0.2.2', 3.2), None)
+
+    def testforget(self):
+        a = self.getadmission(maxperaddress = 1, maxtracked = 10)
+        self.assertEquals(a.admit('192.0.2.0', 0), None)
+        for i in range(1, 20):
+            a.admit('192.0.2.%d' % i, i)
+            a.release('192.0.2.%d' % i)
+        # Those with connections open are remembered.
+        assert len(a.addresses) <= 10
+        self.assertEquals(a.admit('192.0.2.0', 30),
+                          'too many connections from the address')
+
+    def testgetsubnet(self):
+        self.assertEquals(admission.getsubnet('192.0.2.77', 24, 64),
+                          '192.0.2.0/24')
+        self.assertEquals(admission.getsubnet('192.0.2.77', 20, 64),
+                          '192.0.0.0/20')
+        self.assertEquals(admission.getsubnet('::ffff:192.0.2.77', 24, 64),
+                          '192.0.2.0/24')
+        self.assertEquals(admission.getsubnet('2001:db8:1:2:3::4', 24, 48),
+                          '2001:db8:1::/48')
+        self.assertEquals(admission.getsubnet('/tmp/socket', 24, 64),
+                          '/tmp/socket')
+
+    def testgettop(self):
+        a = self.getadmission(maxperaddress = 5)
+        for address in ['192.0.2.1', '192.0.2.2', '192.0.2.2',
+                        '198.51.100.1']:
+            a.admit(address)
+        addresses, subnets = a.gettop(2)
+        self.assertEquals([(key, client.requests) \
+                           for key, client in addresses],
+                          [('192.0.2.2', 2), ('192.0.2.1', 1)])
+        self.assertEquals([(key, client.connections) \
+                           for key, client in subnets],
+                          [('192.0.2.0/24', 3), ('198.51.100.0/24', 1)])
+
+class ServerTestCase(unittest.TestCase):
+    servertype = "ThreadingTCPServer"
+
+    def setUp(self):
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "servertype", self.servertype)
+        self.config.set("pygopherd", "interface", "127.0.0.1")
+        self.config.set("pygopherd", "port", "0")
+        self.config.set("admission", "maxperaddress", "1")
+        self.config.set("admission", "exempt", "")
+        self.config.set("logger", "logmethod", "none")
+        self.config.add_section("listener.proxy")
+        self.config.set("listener.proxy", "address", "127.0.0.1:0")
+        self.config.set("listener.proxy", "proxyprotocol", "yes")
+        self.config.add_section("listener.other")
+        self.config.set("listener.other", "address", "127.0.0.1:0")
+        initialization.initlogger(self.config, 'TESTING')
+        self.server = initialization.getserverobject(self.config)
+        self.thread = threading.Thread(target = self.server.serve_forever,
+                                       args = (0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        for server in self.server.listeners:
+            server.server_close()
+
+    def connect(self, listener = 'main'):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        for server in self.server.listeners:
+            if server.listener.name == listener:
+                sock.connect(server.socket.getsockname())
+        return sock
+
+    def connectfrom(self, address):
+        sock = self.connect('proxy')
+        sock.sendall("PROXY TCP4 %s 127.0.0.1 5555 70\r\n" % address)
+        return sock
+
+    def readall(self, sock):
+        data = ''
+        while 1:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def request(self, listener = 'main'):
+        sock = self.connect(listener)
+        sock.sendall("/missing\r\n")
+        return self.readall(sock)
+
+    def waitforclose(self, address):
+        client = self.server.admission.addresses[address]
+        for i in range(100):
+            if not client.connections:
+                break
+            time.sleep(0.01)
+        return client.connections
+
+    def waitforopen(self, address):
+        # A proxy's client is admitted once its worker has the header.
+        addresses = self.server.admission.addresses
+        for i in range(100):
+            if addresses.has_key(address) and \
+               addresses[address].connections:
+                break
+            time.sleep(0.01)
+        return addresses[address].connections
+
+    def checkproxy(self):
+        # Limited by the client the proxy names, not the proxy.
+        first = self.connectfrom("192.0.2.5")
+        self.assertEquals(self.waitforopen("192.0.2.5"), 1)
+        second = self.connectfrom("192.0.2.5")
+        assert self.readall(second).startswith('3Too many requests')
+        other = self.connectfrom("192.0.2.6")
+        other.sendall("/missing\r\n")
+        assert self.readall(other).startswith("3'/missing' does not exist")
+        first.sendall("/missing\r\n")
+        assert self.readall(first).startswith("3'/missing' does not exist")
+        admission = self.server.admission
+        self.assertEquals((admission.accepted, admission.rejected), (2, 1))
+        self.assertEquals(admission.addresses['192.0.2.5'].rejected, 1)
+        assert not admission.addresses.has_key('127.0.0.1')
+        self.assertEquals(self.waitforclose('192.0.2.5'), 0)
+
+    def checkslowproxy(self):
+        # A proxy yet to send its header holds up no other connection.
+        slow = self.connect('proxy')
+        start = time.time()
+        assert self.request().startswith("3'/missing' does not exist")
+        assert time.time() - start < 1
+        slow.close()
+
+class ServerAdmissionTestCase(ServerTestCase):
+    def testlimits(self):
+        first = self.connect()
+        second = self.connect()
+        self.assertEquals(self.readall(second),
+                          '3Too many requests from your address; please ' \
+                          'try again later.\t\terror.host\t1\r\n')
+        first.sendall("/server-stats\r\n")
+        stats = self.readall(first)
+        assert stats.find("Accepted: 1; turned away: 1") != -1
+        assert stats.find("127.0.0.1 ") != -1
+        # Once the first has finished, another may connect.
+        self.waitforclose('127.0.0.1')
+        third = self.connect()
+        third.sendall("/server-stats\r\n")
+        assert self.readall(third).find("Accepted: 2;") != -1
+
+    def testproxy(self):
+        self.checkproxy()
+
+    def testslowproxy(self):
+        self.checkslowproxy()
+
+class SerialAdmissionTestCase(ServerTestCase):
+    servertype = "TCPServer"
+
+    def testrelease(self):
+        # One request at a time, each counted as closed once answered.
+        for i in range(3):
+            assert self.request().startswith("3'/missing' does not exist")
+        self.assertEquals(self.server.admission.rejected, 0)
+
+class ForkingAdmissionTestCase(ServerTestCase):
+    servertype = "ForkingTCPServer"
+
+    def testrelease(self):
+        # A worker that has finished is reaped whichever listener is used
+        # next, so its client may connect to any of them.
+        assert self.request().startswith("3'/missing' does not exist")
+        self.assertEquals(self.waitforclose('127.0.0.1'), 0)
+        assert self.request('other').startswith("3'/missing' does not exist")
+        self.assertEquals(self.server.admission.rejected, 0)
+
+    def testproxy(self):
+        # Admitted by the server process, on the worker's behalf.
+        self.checkproxy()
+        for i in range(100):
+            if not self.server.channels:
+                break
+            time.sleep(0.01)
+        self.assertEquals(self.server.channels, {})
+
+    def testslowproxy(self):
+        self.checkslowproxy()
@@ -0,0 +1,300 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: in-memory cache of small, often requested files
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Keeps the contents of small files that are requested again and again
+in memory, so that they can be sent without opening and reading them.
+Files up to maxfilesize bytes are read into strings; bigger ones, up to
+maxmapsize, are mapped with mmap instead, if that is enabled.
+
+The cache holds at most maxsize bytes, split in two segments.  A file
+enters the probation segment the second time it is asked for in a while,
+and moves to the protected segment if it is asked for again while there.
+Room is made by dropping files from probation first.  So a crawler
+reading every file once fills neither segment, and files that were
+popular before it came are still there after it leaves.
+
+Every file is checked with stat() before it is sent from the cache, and
+read again if its size, modification time or inode has changed."""
+
+import os, stat, mmap
+from collections import OrderedDict
+try:
+    import threading
+except ImportError:
+    threading = None
+
+section = "contentcache"
+
+# The share of maxsize the protected segment may take.
+protectedshare = 0.8
+
+# Bytes sent from a mapped file at once.
+blocksize = 65536
+
+class Entry:
+    def __init__(self, data, key):
+        self.data = data
+        self.key = key
+        self.size = len(data)
+
+class ContentCache:
+    """A cache of file contents, by filesystem path.  Under the threading
+    server all threads share one.  Under the forking server each request
+    gets a copy of the one in the server process at the time it forked,
+    which it only reads: what it loaded or counted would be thrown away
+    when it exits."""
+
+    def __init__(self, maxsize, maxfilesize, maxmapsize, maxghosts = 4096):
+        self.maxsize = maxsize
+        self.maxfilesize = maxfilesize
+        self.maxmapsize = maxmapsize
+        self.maxghosts = maxghosts
+        # Oldest first.
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        # Files asked for once, not yet loaded: path -> 1.
+        self.ghosts = OrderedDict()
+        self.probationsize = 0
+        self.protectedsize = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        # The process that owns the cache; its children only read it.
+        self.pid = os.getpid()
+        if threading:
+            self.lock = threading.Lock()
+        else:
+            self.lock = None
+
+    def getkey(self, statresult):
+        # To within the filesystem's resolution, not whole seconds.
+        mtime = getattr(statresult, 'st_mtime', statresult[stat.ST_MTIME])
+        return (statresult[stat.ST_SIZE], mtime, statresult[stat.ST_INO],
+                statresult[stat.ST_DEV])
+
+    def iscacheable(self, statresult):
+        return stat.S_ISREG(statresult[stat.ST_MODE]) and \
+               statresult[stat.ST_SIZE] <= max(self.maxfilesize,
+                                                self.maxmapsize) and \
+               statresult[stat.ST_SIZE] <= self.maxsize
+
+    def get(self, path, statresult = None):
+        """Returns the contents of the file at path, as a string or an
+        mmap object, or None if it is not cached and should be read the
+        usual way.  statresult, if given, must be fresh."""
+        if statresult == None:
+            try:
+                statresult = os.stat(path)
+            except OSError:
+                return None
+        if not self.iscacheable(statresult):
+            return None
+        key = self.getkey(statresult)
+        if os.getpid() != self.pid:
+            return self.lookup(path, key)
+        self.acquire()
+        try:
+            for segment in [self.protected, self.probation]:
+                if segment.has_key(path):
+                    entry = segment[path]
+                    if entry.key != key:
+                        # Changed since it was loaded; load it again.
+                        self.remove(path)
+                        break
+                    self.hits += 1
+                    if segment is self.probation:
+                        self.promote(path)
+                    else:
+                        segment[path] = segment.pop(path)
+                    return entry.data
+            else:
+                self.misses += 1
+                if not self.ghosts.has_key(path):
+                    self.remember(path)
+                    return None
+            if self.ghosts.has_key(path):
+                del self.ghosts[path]
+        finally:
+            self.release()
+
+        entry = self.load(path, key)
+        if entry == None:
+            return None
+        self.add(path, entry)
+        return entry.data
+
+    def lookup(self, path, key):
+        """Returns the contents of path if they are cached and still
+        match key, changing nothing."""
+        for segment in [self.protected, self.probation]:
+            entry = segment.get(path)
+            if entry and entry.key == key:
+                return entry.data
+        return None
+
+    def preload(self, path):
+        """Loads the file at path, if there is room for it without
+        dropping anything, into the protected segment if there is room
+        there, else on probation.  Returns true if it was loaded."""
+        try:
+            statresult = os.stat(path)
+        except OSError:
+            return 0
+        if not self.iscacheable(statresult):
+            return 0
+        entry = self.load(path, self.getkey(statresult))
+        if entry == None or \
+           self.probationsize + self.protectedsize + entry.size > self.maxsize:
+            return 0
+        protect = self.protectedsize + entry.size <= \
+                  self.maxsize * protectedshare
+        return self.add(path, entry, protect)
+
+    def add(self, path, entry, protect = 0):
+        self.acquire()
+        try:
+            if self.probation.has_key(path) or self.protected.has_key(path):
+                return 0
+            if protect:
+                self.protected[path] = entry
+                self.protectedsize += entry.size
+            else:
+                self.probation[path] = entry
+                self.probationsize += entry.size
+            self.loads += 1
+            self.shrink()
+            return 1
+        finally:
+            self.release()
+
+    def load(self, path, key):
+        """Reads or maps the file at path, returning an Entry, or None if
+        it is not what key says it is any more."""
+        try:
+            fd = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            statresult = os.fstat(fd.fileno())
+            if self.getkey(statresult) != key:
+                return None
+            size = statresult[stat.ST_SIZE]
+            if size <= self.maxfilesize or size == 0:
+                data = fd.read(size + 1)
+                if len(data) != size:
+                    return None
+            else:
+                # Mapped, the file's pages are shared with the kernel's
+                # cache, and with all processes forked after this.
+                data = mmap.mmap(fd.fileno(), size, access = mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        return Entry(data, key)
+
+    def promote(self, path):
+        entry = self.probation.pop(path)
+        self.probationsize -= entry.size
+        self.protected[path] = entry
+        self.protectedsize += entry.size
+        while self.protectedsize > self.maxsize * protectedshare and \
+              len(self.protected) > 1:
+            # Back to probation, as the newest there.
+            oldpath, oldentry = self.protected.popitem(0)
+            self.protectedsize -= oldentry.size
+            self.probation[oldpath] = oldentry
+            self.probationsize += oldentry.size
+        self.shrink()
+
+    def shrink(self):
+        while self.probationsize + self.protectedsize > self.maxsize:
+            if self.probation:
+                path, entry = self.probation.popitem(0)
+                self.probationsize -= entry.size
+            else:
+                path, entry = self.protected.popitem(0)
+                self.protectedsize -= entry.size
+            self.evictions += 1
+            # A mapping still being sent by another thread stays valid
+            # until it is done with it.
+            self.remember(path)
+
+    def remember(self, path):
+        """Notes that path was asked for, so that it is loaded if it is
+        asked for again soon."""
+        self.ghosts[path] = 1
+        while len(self.ghosts) > self.maxghosts:
+            self.ghosts.popitem(0)
+
+    def remove(self, path):
+        if self.probation.has_key(path):
+            self.probationsize -= self.probation.pop(path).size
+        if self.protected.has_key(path):
+            self.protectedsize -= self.protected.pop(path).size
+
+    def acquire(self):
+        if self.lock:
+            self.lock.acquire()
+
+    def release(self):
+        if self.lock:
+            self.lock.release()
+
+    def getstats(self):
+        """Returns the cache's size and hit counts as lines of text."""
+        lines = []
+        lines.append("Content cache: %d files in %d bytes of %d; " \
+                     "%d protected in %d bytes" % \
+                     (len(self.probation) + len(self.protected),
+                      self.probationsize + self.protectedsize, self.maxsize,
+                      len(self.protected), self.protectedsize))
+        lines.append("Hits: %d; misses: %d; loaded: %d; evicted: %d" % \
+                     (self.hits, self.misses, self.loads, self.evictions))
+        if os.getpid() != self.pid:
+            lines.append("(Server process only; requests answered by "
+                         "forked processes are not counted.)")
+        return lines
+
+def writeto(data, fd):
+    """Writes data, as returned by ContentCache.get(), to fd."""
+    if type(data) == type(''):
+        fd.write(data)
+        return
+    for offset in range(0, len(data), blocksize):
+        fd.write(data[offset:offset + blocksize])
+
+cache = None
+
+def getcache(config):
+    """Returns the server's ContentCache, or None if it is disabled."""
+    global cache
+    if cache == None:
+        maxsize = 0
+        maxfilesize = 65536
+        maxmapsize = 0
+        if config.has_option(section, "maxsize"):
+            maxsize = config.getint(section, "maxsize")
+        if config.has_option(section, "maxfilesize"):
+            maxfilesize = config.getint(section, "maxfilesize")
+        if config.has_option(section, "maxmapsize"):
+            maxmapsize = config.getint(section, "maxmapsize")
+        if maxsize <= 0:
+            cache = 0
+        else:
+            cache = ContentCache(maxsize, maxfilesize, maxmapsize)
+    return cache or None
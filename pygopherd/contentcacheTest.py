@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the content cache
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, tempfile, shutil, os, mmap
+from StringIO import StringIO
+from pygopherd import contentcache, testutil
+from pygopherd.handlers import base
+
+class ContentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        contentcache.cache = None
+
+    def makefile(self, name, size, char = 'x'):
+        path = os.path.join(self.dir, name)
+        fd = open(path, 'wb')
+        fd.write(char * size)
+        fd.close()
+        return path
+
+    def testadmission(self):
+        cache = contentcache.ContentCache(1000, 100, 0)
+        path = self.makefile('a', 10)
+        # Loaded only the second time it is asked for.
+        self.assertEquals(cache.get(path), None)
+        self.assertEquals(cache.get(path), 'x' * 10)
+        assert cache.probation.has_key(path)
+        self.assertEquals(cache.get(path), 'x' * 10)
+        assert cache.protected.has_key(path)
+        self.assertEquals((cache.hits, cache.misses, cache.loads),
+                          (1, 2, 1))
+
+        # Too big, or not a file.
+        big = self.makefile('big', 101)
+        for i in range(3):
+            self.assertEquals(cache.get(big), None)
+            self.assertEquals(cache.get(self.dir), None)
+            self.assertEquals(cache.get(path + 'missing'), None)
+
+    def testrevalidate(self):
+        cache = contentcache.ContentCache(1000, 100, 0)
+        path = self.makefile('a', 10)
+        cache.get(path)
+        cache.get(path)
+        self.makefile('a', 20, 'y')
+        self.assertEquals(cache.get(path), 'y' * 20)
+        self.assertEquals(cache.probationsize + cache.protectedsize, 20)
+        # Same size, new modification time.
+        self.makefile('a', 20, 'z')
+        os.utime(path, (1, 1))
+        self.assertEquals(cache.get(path), 'z' * 20)
+
+    def testscanresistance(self):
+        cache = contentcache.ContentCache(100, 100, 0)
+        hot = [self.makefile('hot%d' % i, 10) for i in range(5)]
+        for i in range(3):
+            for path in hot:
+                cache.get(path)
+        self.assertEquals(cache.protectedsize, 50)
+        # A crawl of many files, each asked for twice, can push out no
+        # more than what is on probation.
+        for i in range(50):
+            path = self.makefile('cold%d' % i, 10)
+            cache.get(path)
+            cache.get(path)
+        for path in hot:
+            assert cache.protected.has_key(path)
+        assert cache.probationsize + cache.protectedsize <= 100
+        assert cache.evictions >= 40
+
+        # The protected segment is kept to its share; what it can't hold
+        # goes back on probation.
+        for i in range(5):
+            path = self.makefile('warm%d' % i, 10)
+            for j in range(3):
+                cache.get(path)
+        self.assertEquals(cache.protectedsize, 80)
+        assert cache.probation.has_key(hot[0])
+
+    def testmmap(self):
+        cache = contentcache.ContentCache(10000, 10, 5000)
+        path = self.makefile('mid', 4000)
+        cache.get(path)
+        data = cache.get(path)
+        assert isinstance(data, mmap.mmap)
+        out = StringIO()
+        contentcache.writeto(data, out)
+        self.assertEquals(out.getvalue(), 'x' * 4000)
+        # Empty files can't be mapped.
+        path = self.makefile('empty', 0)
+        cache.get(path)
+        self.assertEquals(cache.get(path), '')
+
+    def testforked(self):
+        cache = contentcache.ContentCache(1000, 100, 0)
+        path = self.makefile('a', 10)
+        other = self.makefile('b', 10)
+        assert cache.preload(path)
+        # A forked child reads what its parent loaded, and nothing else.
+        cache.pid = os.getpid() + 1
+        for i in range(3):
+            self.assertEquals(cache.get(path), 'x' * 10)
+            self.assertEquals(cache.get(other), None)
+        self.assertEquals((cache.hits, cache.misses, len(cache.ghosts)),
+                          (0, 0, 0))
+        assert cache.getstats()[-1].startswith("(Server process only")
+
+    def testcopyto(self):
+        config = testutil.getconfig()
+        config.set("contentcache", "maxsize", "1000")
+        base.rootpath = self.dir
+        try:
+            self.makefile('README', 10)
+            vfs = base.VFS_Real(config)
+            for i in range(3):
+                out = StringIO()
+                vfs.copyto('/README', out)
+                self.assertEquals(out.getvalue(), 'x' * 10)
+            self.assertEquals(contentcache.cache.hits, 1)
+        finally:
+            base.rootpath = None
@@ -0,0 +1,185 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: time and size limits on client connections
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socket, select, struct, time
+
+class ClientError(socket.error):
+    """Raised when a client breaks one of the limits on its connection.
+    The connection is then closed."""
+    pass
+
+class ClientTooSlow(ClientError):
+    pass
+
+class RequestTooLarge(ClientError):
+    pass
+
+# The struct format of a struct timeval on this system, once found.
+timevalformat = None
+
+def settimeouts(sock, seconds):
+    """Makes any one read or write on sock, including those by programs
+    it is passed to, fail if it makes no progress for seconds.  Returns
+    false if the system's struct timeval can't be worked out."""
+    global timevalformat
+    if timevalformat == None:
+        timevalformat = ''
+        size = len(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, 64))
+        old = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, size)
+        for format in ['ll', 'qq', 'ql', 'qi', 'ii']:
+            if struct.calcsize(format) != size:
+                continue
+            # Try it; the right one reads back as written.
+            value = struct.pack(format, 7, 500000)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, value)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                                   size) == value:
+                    timevalformat = format
+                    break
+            except socket.error:
+                pass
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, old)
+    if not timevalformat:
+        return 0
+    value = struct.pack(timevalformat, int(seconds),
+                        int((seconds - int(seconds)) * 1000000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, value)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+    return 1
+
+class RequestReader:
+    """Reads a client's request from sock.  All of it must arrive within
+    timeout seconds of this being made, with no gap longer than
+    idletimeout, and it may be no more than maxsize bytes; otherwise
+    ClientTooSlow or RequestTooLarge is raised.  A limit of 0 is no
+    limit.
+
+    With exact set, no more is received than is asked for, leaving what
+    follows on the socket; otherwise it is read in blocks."""
+
+    def __init__(self, sock, timeout, idletimeout, maxsize, exact = 0):
+        self.sock = sock
+        self.exact = exact
+        self.deadline = None
+        if timeout > 0:
+            self.deadline = time.time() + timeout
+        self.idletimeout = idletimeout
+        self.maxsize = maxsize
+        self.buffer = ''
+        self.received = 0
+        self.eof = 0
+
+    def fill(self, count = 4096):
+        """Receives up to count more bytes of the request into the
+        buffer."""
+        if self.maxsize > 0 and self.received >= self.maxsize:
+            raise RequestTooLarge, "request over %d bytes" % self.maxsize
+        wait = None
+        if self.idletimeout > 0:
+            wait = self.idletimeout
+        if self.deadline:
+            remaining = self.deadline - time.time()
+            if wait == None or remaining < wait:
+                wait = max(remaining, 0)
+        # A TLS socket may have data waiting that it has already read.
+        if wait != None and \
+           not (hasattr(self.sock, 'pending') and self.sock.pending()) and \
+           not select.select([self.sock], [], [], wait)[0]:
+            raise ClientTooSlow, "request not received in time"
+        if self.maxsize > 0:
+            count = min(count, self.maxsize - self.received)
+        data = self.sock.recv(count)
+        if not data:
+            self.eof = 1
+        self.received += len(data)
+        self.buffer += data
+
+    def readline(self, size = -1):
+        while not self.eof and self.buffer.find('\n') == -1 and \
+              (size < 0 or len(self.buffer) < size):
+            if self.exact:
+                self.fill(1)
+            else:
+                self.fill()
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        line = self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return line
+
+    def read(self, size = -1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            if self.exact and size >= 0:
+                self.fill(size - len(self.buffer))
+            else:
+                self.fill()
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def close(self):
+        self.sock = None
+
+class ResponseWriter:
+    """Writes a response to wfile, raising ClientTooSlow if, once the
+    client has kept us waiting to send it data for grace seconds in all,
+    it has been taking it at less than minrate bytes a second.  Time
+    spent preparing the response doesn't count against the client."""
+
+    def __init__(self, wfile, minrate, grace, rawfd = 1):
+        self.wfile = wfile
+        self.minrate = minrate
+        self.grace = grace
+        self.sent = 0
+        self.waited = 0
+        # Whether others may write to wfile's descriptor directly; not
+        # when what is written is encrypted.
+        self.rawfd = rawfd
+
+    def __getattr__(self, name):
+        if name == 'fileno' and not self.rawfd:
+            raise AttributeError, name
+        return getattr(self.wfile, name)
+
+    def timed(self, func, *args):
+        start = time.time()
+        retval = func(*args)
+        self.waited += time.time() - start
+        return retval
+
+    def checkrate(self, count):
+        self.sent += count
+        if self.minrate > 0 and self.waited > self.grace and \
+           self.sent < self.minrate * self.waited:
+            raise ClientTooSlow, "taking %d bytes in %d seconds" % \
+                  (self.sent, self.waited)
+
+    def write(self, data):
+        self.timed(self.wfile.write, data)
+        self.checkrate(len(data))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.timed(self.wfile.flush)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of connection limits
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socket, time, errno
+from StringIO import StringIO
+from pygopherd import deadline, testutil
+
+class RequestReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client, self.server = socket.socketpair()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def testread(self):
+        reader = deadline.RequestReader(self.server, 5, 5, 100)
+        self.client.sendall("GET / HTTP/1.0\r\nHost: x\r\n\r\n")
+        self.assertEquals(reader.readline(), "GET / HTTP/1.0\r\n")
+        self.assertEquals(reader.readline(4), "Host")
+        self.assertEquals(reader.readline(), ": x\r\n")
+        self.client.shutdown(1)
+        self.assertEquals(reader.read(), "\r\n")
+        self.assertEquals(reader.readline(), "")
+
+    def testtoolarge(self):
+        reader = deadline.RequestReader(self.server, 5, 5, 100)
+        self.client.sendall("x" * 150 + "\n")
+        self.assertRaises(deadline.RequestTooLarge, reader.readline)
+
+    def testtooslow(self):
+        reader = deadline.RequestReader(self.server, 0.3, 5, 0)
+        start = time.time()
+        self.client.sendall("/sel")
+        self.assertRaises(deadline.ClientTooSlow, reader.readline)
+        assert time.time() - start < 1
+
+        # A gap longer than the idle timeout is too slow as well.
+        reader = deadline.RequestReader(self.server, 0, 0.1, 0)
+        self.assertRaises(deadline.ClientTooSlow, reader.readline)
+
+    def testsettimeouts(self):
+        assert deadline.settimeouts(self.server, 0.2)
+        start = time.time()
+        try:
+            self.server.recv(10)
+        except socket.error, e:
+            assert e[0] in [errno.EAGAIN, errno.EWOULDBLOCK]
+        else:
+            self.fail("recv did not time out")
+        assert 0.1 < time.time() - start < 1
+
+class SlowFile(StringIO):
+    def write(self, data):
+        time.sleep(0.05)
+        StringIO.write(self, data)
+
+class ResponseWriterTestCase(unittest.TestCase):
+    def testrate(self):
+        writer = deadline.ResponseWriter(SlowFile(), 100, 0.2)
+        # Slow, but within the grace period.
+        for i in range(3):
+            writer.write('x')
+        self.assertRaises(deadline.ClientTooSlow, writer.write, 'x')
+
+        writer = deadline.ResponseWriter(SlowFile(), 100, 0.2)
+        for i in range(10):
+            writer.write('x' * 100)
+        self.assertEquals(len(writer.getvalue()), 1000)
+
+    def testpreparing(self):
+        # Time between writes is the server's, not the client's.
+        writer = deadline.ResponseWriter(StringIO(), 1000, 0.05)
+        writer.write('x')
+        time.sleep(0.1)
+        writer.write('x')
+        writer.flush()
+
+class HTTPHeaderTestCase(unittest.TestCase):
+    def testmaxheaders(self):
+        config = testutil.getconfig()
+        config.set("protocols.http.HTTPProtocol", "maxheaders", "3")
+        request = "GET / HTTP/1.0\r\n" + "X-Header: x\r\n" * 3 + "\r\n"
+        testutil.gettestingprotocol(request, config).headerslurp()
+        request = "GET / HTTP/1.0\r\n" + "X-Header: x\r\n" * 4 + "\r\n"
+        self.assertRaises(deadline.RequestTooLarge,
+                          testutil.gettestingprotocol, request, config)
@@ -19,6 +19,7 @@
 import mimetypes
 
 typemap = {}
+typeranks = {}
 
 def extcmp(x, y):
     if x.count('.') > y.count('.'):
@@ -36,11 +37,26 @@ def extstrip(file, filetype):
     Returns file unmodified if no action is possible."""
     if not (filetype and typemap.has_key(filetype)):
         return file
-    for possible in typemap[filetype]:
-        if file.endswith(possible):
-            extindex = file.rfind(possible)
-            return file[0:extindex]
-    return file
+    ranks = typeranks.get(filetype)
+    if ranks == None:
+        for possible in typemap[filetype]:
+            if file.endswith(possible):
+                extindex = file.rfind(possible)
+                return file[0:extindex]
+        return file
+
+    # Look up each of the file's own extensions instead, and take the one
+    # that comes first in typemap.
+    best = None
+    index = file.find('.')
+    while index != -1:
+        rank = ranks.get(file[index:])
+        if rank != None and (best == None or rank < best):
+            best = rank
+        index = file.find('.', index + 1)
+    if best == None:
+        return file
+    return file[0:file.rfind(typemap[filetype][best])]
 
 def init():
     for fileext, filetype in mimetypes.types_map.items():
@@ -64,5 +80,16 @@ def init():
         extlist.reverse()
         typemap[filetype] = extlist
 
+    typeranks.clear()
+    for filetype, extlist in typemap.items():
+        ranks = {}
+        for i in range(len(extlist) - 1, -1, -1):
+            if extlist[i][0:1] != '.':
+                # Can't be found by looking at the file's extensions.
+                ranks = None
+                break
+            ranks[extlist[i]] = i
+        typeranks[filetype] = ranks
+
 
         
@@ -18,7 +18,8 @@
 
 import SocketServer
 import re
-import os, stat, os.path, mimetypes, urllib
+import os, stat, os.path, mimetypes, urllib, threading
+from collections import OrderedDict
 
 mapping = None
 eaexts = None
@@ -177,12 +178,9 @@ class GopherEntry:
         for extension, blockname in eaexts.items():
             if self.ea.has_key(blockname):
                 continue
-            try:
-                rfile = vfs.open(selector + extension, "rt")
-                self.setea(blockname, "\n".join(
-                           [x.rstrip() for x in rfile.readlines(20480)]))
-            except IOError:
-                pass
+            value = readeafile(vfs, selector + extension)
+            if value != None:
+                self.setea(blockname, value)
                          
 
     def getselector(self, default = None):
@@ -313,6 +311,63 @@ class GopherEntry:
     def setea(self, name, value):
         self.ea[name] = value
 
+def getentrystate(entry):
+    """Returns the fields of entry as plain data that can be marshalled."""
+    state = entry.__dict__.copy()
+    del state['config']
+    state['ea'] = entry.ea.copy()
+    return state
+
+def setentrystate(entry, state):
+    """Sets the fields of entry from the result of getentrystate."""
+    entry.__dict__.update(state)
+    entry.ea = state['ea'].copy()
+    return entry
+
+# Contents of extended attribute files, by selector: (mtime, size, value),
+# least recently used first.
+eacache = OrderedDict()
+eacachelock = threading.Lock()
+maxeafiles = 4096
+
+def readeafile(vfs, selector):
+    """Returns the contents of the extended attribute file selector, or
+    None if there is no such file."""
+    (dir, file) = os.path.split(selector)
+    listing = vfs.getlistinghint(dir)
+    if listing != None and not listing.has_key(file):
+        return None
+    try:
+        statval = vfs.stat(selector)
+    except OSError:
+        return None
+    cacheable = vfs.iswritable(selector)
+    key = (statval[stat.ST_MTIME], statval[stat.ST_SIZE])
+    if cacheable:
+        eacachelock.acquire()
+        try:
+            cached = eacache.pop(selector, None)
+            if cached != None and cached[0:2] == key:
+                eacache[selector] = cached
+                return cached[2]
+        finally:
+            eacachelock.release()
+    try:
+        rfile = vfs.open(selector, "rt")
+        value = "\n".join([x.rstrip() for x in rfile.readlines(20480)])
+        rfile.close()
+    except IOError:
+        return None
+    if cacheable:
+        eacachelock.acquire()
+        try:
+            eacache[selector] = key + (value,)
+            while len(eacache) > maxeafiles:
+                eacache.popitem(0)
+        finally:
+            eacachelock.release()
+    return value
+
 def getinfoentry(text, config):
     entry = GopherEntry('fake', config)
     entry.name = text
@@ -21,7 +21,9 @@
 
 import unittest, os, stat, re
 from pygopherd import testutil
+from pygopherd import gopherentry
 from pygopherd.gopherentry import GopherEntry
+from pygopherd.handlers.base import VFS_Real
 
 fields = ['selector', 'config', 'fspath', 'type', 'name', 'host', 'port',
           'mimetype', 'encodedmimetype', 'size', 'encoding',
@@ -103,6 +105,44 @@ class GopherEntryTestCase(unittest.TestCase):
         self.assertEquals(entry.geteadict(),
                           {'ABSTRACT': "This is the abstract\nfor testfile.txt.gz"})
 
+    def testpopulate_listinghint(self):
+        vfs = VFS_Real(self.config)
+        vfs.setlistinghint('/', os.listdir(self.root))
+        opened = []
+        realopen = vfs.open
+        def open(selector, *args):
+            opened.append(selector)
+            return realopen(selector, *args)
+        vfs.open = open
+        gopherentry.eacache.clear()
+
+        # Only sidecars that are in the listing are opened...
+        entry = GopherEntry('/testfile.txt.gz', self.config)
+        entry.populatefromfs('/testfile.txt.gz', vfs = vfs)
+        self.assertEquals(entry.getea('ABSTRACT'),
+                          "This is the abstract\nfor testfile.txt.gz")
+        entry = GopherEntry('/testfile.txt', self.config)
+        entry.populatefromfs('/testfile.txt', vfs = vfs)
+        self.assertEquals(entry.geteadict(), {})
+        self.assertEquals(opened, ['/testfile.txt.gz.abstract'])
+
+        # ...and only once while they are unchanged.
+        entry = GopherEntry('/testfile.txt.gz', self.config)
+        entry.populatefromfs('/testfile.txt.gz', vfs = vfs)
+        self.assertEquals(entry.getea('ABSTRACT'),
+                          "This is the abstract\nfor testfile.txt.gz")
+        self.assertEquals(opened, ['/testfile.txt.gz.abstract'])
+
+        # Only so many are kept.
+        gopherentry.maxeafiles = 0
+        try:
+            gopherentry.eacache.clear()
+            entry = GopherEntry('/testfile.txt.gz', self.config)
+            entry.populatefromfs('/testfile.txt.gz', vfs = vfs)
+            self.assertEquals(len(gopherentry.eacache), 0)
+        finally:
+            gopherentry.maxeafiles = 4096
+
     def testpopulate_dir(self):
         fspath = self.root + '/'
         entry = GopherEntry('/', self.config)
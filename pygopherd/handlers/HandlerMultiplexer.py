@@ -24,9 +24,10 @@ handlers = None
 rootpath = None
 
 def getHandler(selector, searchrequest, protocol, config, handlerlist = None,
-               vfs = None):
+               vfs = None, statresult = None):
     """Called without handlerlist specified, uses the default as listed
-    in config."""
+    in config.  statresult, if given, is used instead of calling stat()
+    on the selector."""
     global handlers, rootpath
 
     if vfs == None:
@@ -49,11 +50,11 @@ def getHandler(selector, searchrequest, protocol, config, handlerlist = None,
     #          [selector, "Requested document is outside the server root",
     #           protocol]
 
-    statresult = None
-    try:
-        statresult = vfs.stat(selector)
-    except OSError:
-        pass
+    if statresult == None:
+        try:
+            statresult = vfs.stat(selector)
+        except OSError:
+            pass
     for handler in handlerlist:
         htry = handler(selector, searchrequest, protocol, config, statresult,
                        vfs)
@@ -62,3 +63,12 @@ def getHandler(selector, searchrequest, protocol, config, handlerlist = None,
     
     raise GopherExceptions.FileNotFound, \
           [selector, "no handler found", protocol]
+
+def getHandlerClass(name):
+    """Returns the configured handler class whose module and name, as in
+    'pygopherd.handlers.file.FileHandler', are name; None if there is none.
+    Valid only once getHandler has been called."""
+    for handler in handlers or []:
+        if handler.__module__ + '.' + handler.__name__ == name:
+            return handler
+    return None
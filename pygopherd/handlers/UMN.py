@@ -17,16 +17,18 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import SocketServer
-import re
+import re, marshal, time
 import os, stat, os.path, mimetypes
 from pygopherd import protocols, gopherentry
 from pygopherd.gopherentry import GopherEntry
+from pygopherd.handlers import base
 from pygopherd.handlers.dir import DirHandler
 from pygopherd.handlers.file import FileHandler
 from stat import *
 import pygopherd.fileext
 
 extstrip = None
+linkfilemaxsize = None
 
 ###########################################################################
 # UMN Directory handler
@@ -47,13 +49,21 @@ class LinkEntry(GopherEntry):
     def setneedsabspath(self, arg):
         self.needsabspath = arg
 
+def makelinkentry(state, config):
+    return gopherentry.setentrystate(LinkEntry(None, config), state)
+
 class UMNDirHandler(DirHandler):
     """This module strives to be bug-compatible with UMN gopherd."""
 
+    umncachename = '.cache.pygopherd.umn'
+    umncacheversion = 1
+
     def prepare(self):
         """Override parent to do a few more things and override sort order."""
         # Initialize.
         self.linkentries = []
+        self.umncache = None
+        self.capfiles = None
 
         # Let the parent do the directory walking for us.  Will call
         # prep_initfiles_canaddfile and prep_entriesappend.
@@ -62,24 +72,138 @@ class UMNDirHandler(DirHandler):
             # Merge and sort.
             self.MergeLinkFiles()
             self.fileentries.sort(self.entrycmp)
+            self.saveumncache()
         
     def prep_initfiles_canaddfile(self, ignorepatt, pattern, file):
         """Override the parent to process dotfiles and keep them out
         of the list."""
+        global linkfilemaxsize
+        if linkfilemaxsize == None:
+            linkfilemaxsize = 65536
+            if self.config.has_option("handlers.UMN.UMNDirHandler",
+                                      "linkfilemaxsize"):
+                linkfilemaxsize = self.config.getint( \
+                    "handlers.UMN.UMNDirHandler", "linkfilemaxsize")
         if DirHandler.prep_initfiles_canaddfile(self, ignorepatt, pattern,
                                                  file):
             # If the parent says it's OK, then let's see if it's
             # a link file.  If yes, process it and return false.
             if file[0] == '.':
-                if not self.vfs.isdir(self.selectorbase + '/' + file):
-                    self.linkentries.extend(self.processLinkFile(self.selectorbase + '/' + file))
+                filename = self.selectorbase + '/' + file
+                try:
+                    statval = self.vfs.stat(filename)
+                except OSError:
                     return 0
-                else:
-                    return 0            # A "dot dir" -- ignore.
+                # Ignore "dot dirs", and files too big to be link files.
+                if S_ISREG(statval[ST_MODE]) and \
+                   statval[ST_SIZE] <= linkfilemaxsize:
+                    self.linkentries.extend( \
+                        self.getcachedlinkfile('links', file, filename,
+                                               statval))
+                return 0
             return 1                    # Not a dot file -- return true
         else:
             return 0                    # Parent returned 0, do the same.
 
+    ## Parsed .Links, .names and .cap files are kept in .cache.pygopherd.umn
+    ## in the directory, and reused for as long as the file's mtime and
+    ## size are unchanged.
+
+    def getumncache(self):
+        if self.umncache != None:
+            return self.umncache
+        self.umncache = {'links': {}, 'caps': {}, 'capdir': None}
+        self.umncachechanged = 0
+        cachename = self.selectorbase + '/' + self.umncachename
+        if not self.vfs.iswritable(cachename):
+            return self.umncache
+        try:
+            fd = self.vfs.open(cachename, 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] == self.umncacheversion:
+                self.umncache = data['cache']
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+        return self.umncache
+
+    def saveumncache(self):
+        if not (self.umncache and self.umncachechanged):
+            return
+        cachename = self.selectorbase + '/' + self.umncachename
+        if not self.vfs.iswritable(cachename):
+            return
+        tempname = base.gettempselector(cachename)
+        try:
+            fd = self.vfs.open(tempname, 'wb')
+            try:
+                marshal.dump({'version': self.umncacheversion,
+                              'cache': self.umncache}, fd)
+            finally:
+                fd.close()
+            self.vfs.rename(tempname, cachename)
+        except (IOError, OSError):
+            try:
+                self.vfs.unlink(tempname)
+            except OSError:
+                pass
+
+    def getcachedlinkfile(self, kind, file, filename, statval,
+                          capfilepath = None):
+        """Returns the entries from link file filename, parsing it only
+        if it has changed since it was last seen."""
+        cache = self.getumncache()[kind]
+        key = (statval[ST_MTIME], statval[ST_SIZE], capfilepath)
+        if cache.has_key(file) and cache[file][0] == key:
+            return [makelinkentry(state, self.config) \
+                    for state in cache[file][1]]
+        entries = self.processLinkFile(filename, capfilepath)
+        cache[file] = (key, [gopherentry.getentrystate(entry) \
+                              for entry in entries])
+        self.umncachechanged = 1
+        return entries
+
+    def getcapfiles(self):
+        """Returns a dictionary of the files in .cap/, listing it only if
+        it has changed."""
+        if self.capfiles != None:
+            return self.capfiles
+        self.capfiles = {}
+        try:
+            mtime = self.vfs.stat(self.selectorbase + '/.cap')[ST_MTIME]
+        except OSError:
+            return self.capfiles
+        cache = self.getumncache()
+        # A listing taken in the same second as a change to .cap/ can't be
+        # told apart from an up-to-date one, so it isn't trusted.
+        if cache['capdir'] and cache['capdir'][0] == mtime and \
+           cache['capdir'][1] > mtime:
+            files = cache['capdir'][2]
+        else:
+            listtime = int(time.time())
+            try:
+                files = self.vfs.listdir(self.selectorbase + '/.cap')
+            except OSError:
+                files = []
+            cache['capdir'] = (mtime, listtime, files)
+            self.umncachechanged = 1
+        for file in files:
+            self.capfiles[file] = 1
+        return self.capfiles
+
+    def getcapentries(self, file, capfilepath):
+        if not self.getcapfiles().has_key(file):
+            return []
+        capfilename = self.selectorbase + '/.cap/' + file
+        try:
+            statval = self.vfs.stat(capfilename)
+            return self.getcachedlinkfile('caps', file, capfilename, statval,
+                                          capfilepath)
+        except (OSError, IOError):      # Removed since the listing
+            return []
+
     def prep_entriesappend(self, file, handler, fileentry):
         """Overridden to process .cap files and modify extensions.
         This is called by the
@@ -100,18 +224,12 @@ class UMNDirHandler(DirHandler):
                                                fileentry.getencodedmimetype() or
                                                fileentry.getmimetype()))
         
-        capfilename = self.selectorbase + '/.cap/' + file
-        
-        try:
-            capinfo = self.processLinkFile(capfilename,
-                                           fileentry.getselector())
-            if len(capinfo) >= 1:       # We handle one and only one entry.
-                if capinfo[0].gettype() == 'X' or capinfo[0].gettype() == '-':
-                    return              # Type X -- don't append.
-                else:
-                    self.mergeentries(fileentry, capinfo[0])
-        except IOError:                 # Ignore no capfile situation
-            pass
+        capinfo = self.getcapentries(file, fileentry.getselector())
+        if len(capinfo) >= 1:           # We handle one and only one entry.
+            if capinfo[0].gettype() == 'X' or capinfo[0].gettype() == '-':
+                return                  # Type X -- don't append.
+            else:
+                self.mergeentries(fileentry, capinfo[0])
         DirHandler.prep_entriesappend(self, file, handler, fileentry)
 
     def MergeLinkFiles(self):
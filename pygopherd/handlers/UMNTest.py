@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the UMN directory handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil
+from pygopherd import testutil
+from pygopherd.handlers import base, UMN
+
+class UMNDirHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.dir.DirHandler", "cachetime", "0")
+        base.rootpath = self.root
+        os.mkdir(os.path.join(self.root, '.cap'))
+        for i in range(10):
+            self.write('file%d.txt' % i, 'File %d\n' % i)
+        self.write('.cap/file3.txt', 'Name=Third file\nNumb=1\n')
+        self.write('.cap/file5.txt', 'Type=X\n')
+        self.write('.Links', 'Name=Elsewhere\nType=1\nPath=/elsewhere\n'
+                   'Host=gopher.example.com\nPort=70\n')
+        self.write('.bigfile', 'Name=Too big\nPath=/big\n' + 'x' * 70000)
+        self.opens = []
+
+    def tearDown(self):
+        base.rootpath = None
+        UMN.linkfilemaxsize = None
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def getnames(self):
+        handler = UMN.UMNDirHandler('/', '', None, self.config,
+                                    os.stat(self.root))
+        # Record which dotfiles get opened.
+        realopen = handler.vfs.open
+        def open(selector, *args):
+            if selector.startswith('/.') and \
+               not selector.startswith('/.cache'):
+                self.opens.append(selector)
+            return realopen(selector, *args)
+        handler.vfs.open = open
+        handler.getentry()
+        handler.prepare()
+        return [entry.getname() for entry in handler.getdirlist()]
+
+    def testlisting(self):
+        names = self.getnames()
+        assert 'Third file' in names
+        assert 'Elsewhere' in names
+        assert not 'file5' in names
+        assert not 'Too big' in names
+        self.assertEquals(len(names), 10)
+        self.opens.sort()
+        self.assertEquals(self.opens, ['/.Links', '/.cap/file3.txt',
+                                       '/.cap/file5.txt'])
+
+    def testcache(self):
+        first = self.getnames()
+        # Written whole under another name, then renamed into place.
+        self.assertEquals([name for name in os.listdir(self.root) \
+                           if name.startswith('.cache.pygopherd.umn')],
+                          ['.cache.pygopherd.umn'])
+        self.opens = []
+        self.assertEquals(self.getnames(), first)
+        self.assertEquals(self.opens, [])
+
+        # Changing a cap file, or adding one, is noticed.
+        self.write('.cap/file3.txt', 'Name=Changed third file\nNumb=1\n')
+        self.write('.cap/file7.txt', 'Name=Seventh file\n')
+        names = self.getnames()
+        assert 'Changed third file' in names
+        assert 'Seventh file' in names
+        self.opens.sort()
+        self.assertEquals(self.opens, ['/.cap/file3.txt', '/.cap/file7.txt'])
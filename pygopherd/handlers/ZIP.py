@@ -41,6 +41,11 @@ UNX_IFLNK = 0120000L
 from pygopherd.handlers import base
 
 class VFS_Zip(base.VFS_Real):
+    # The entry and bad-file caches are updated without locking.
+    threadsafe = 0
+    # Paths are of members of the archive.
+    contentcacheable = 0
+
     def __init__(self, config, chain, zipfilename):
         self.config = config
         self.chain = chain
@@ -219,6 +224,9 @@ class VFS_Zip(base.VFS_Real):
     def unlink(self, selector):
         raise NotImplementedError, "VFS_ZIP cannot unlink files."
 
+    def rename(self, selector, newselector):
+        raise NotImplementedError, "VFS_ZIP cannot rename files."
+
     def _getfspathfinal(self, selector):
         # Strip off the filename part.
         selector = selector[len(self.zipfilename):]
@@ -608,6 +616,8 @@ class TestVFS_Zip(unittest.TestCase):
         
         
 class ZIPHandler(base.BaseHandler):
+    warmable = 1
+
     def canhandlerequest(self):
         """We can handle the request if it's a ZIP file, in our pattern, etc.
         """
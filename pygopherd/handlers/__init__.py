@@ -18,6 +18,6 @@
 
 __all__ = ['base', 'dir', 'file', 'url', 'gophermap',
            'UMN', 'ZIP', 'html', 'mbox', 'virtual', 'pyg', 'scriptexec',
-           'tal']
+           'tal', 'responsecache', 'search', 'stats']
 #import base, dir, file, gophermap, UMN, html, mbox, virtual, pyg
 #import scriptexec, url
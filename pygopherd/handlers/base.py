@@ -19,11 +19,52 @@
 import SocketServer
 import re
 import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry
+from pygopherd import protocols, gopherentry, contentcache
+try:
+    import thread
+except ImportError:
+    import dummy_thread as thread
 
 rootpath = None
 
+# Functions to call once the request being served by a thread has been
+# answered, by thread: work done for this request alone that its client
+# need not wait for, such as writing back caches it updated.
+deferred = {}
+
+def deferuntilfinished(func):
+    deferred.setdefault(thread.get_ident(), []).append(func)
+
+def finishrequest():
+    for func in deferred.pop(thread.get_ident(), []):
+        func()
+
+# Functions to call when this process is done serving requests: at exit,
+# or, for a child of a forking server, once its request has been answered.
+# Handlers use these to release what they keep open between requests.
+workerfinishers = []
+
+def addworkerfinisher(func):
+    if not func in workerfinishers:
+        workerfinishers.append(func)
+
+def finishworker():
+    while workerfinishers:
+        workerfinishers.pop(0)()
+
+def gettempselector(selector):
+    """Returns where to write a new version of selector before renaming
+    it into place, so that readers never see half a file: a name no other
+    process or thread writes to."""
+    return '%s.%d.%d' % (selector, os.getpid(), thread.get_ident())
+
 class VFS_Real:
+    # Whether several threads may use this object at once.
+    threadsafe = 1
+    # Whether getfspath() names a real file, whose contents may be kept
+    # in the content cache.
+    contentcacheable = 1
+
     def __init__(self, config, chain = None):
         """This implementation does not chain."""
         self.config = config
@@ -34,6 +75,9 @@ class VFS_Real:
     def unlink(self, selector):
         os.unlink(self.getfspath(selector))
 
+    def rename(self, selector, newselector):
+        os.rename(self.getfspath(selector), self.getfspath(newselector))
+
     def stat(self, selector):
         return os.stat(self.getfspath(selector))
 
@@ -52,6 +96,25 @@ class VFS_Real:
     def listdir(self, selector):
         return os.listdir(self.getfspath(selector))
 
+    def setlistinghint(self, selector, names):
+        """Records names as the contents of the directory selector, as
+        just read by a directory handler.  Lookups of files beside the ones
+        in the listing can then skip the filesystem.  Hints last as long as
+        this object, which is created per request."""
+        hint = {}
+        for name in names:
+            hint[name] = 1
+        if not hasattr(self, 'listinghints'):
+            self.listinghints = {}
+        self.listinghints[selector.rstrip('/')] = hint
+
+    def getlistinghint(self, selector):
+        """Returns a dictionary of the names in directory selector, or
+        None if it has not been listed."""
+        if not hasattr(self, 'listinghints'):
+            return None
+        return self.listinghints.get(selector.rstrip('/'))
+
     def getrootpath(self):
         global rootpath
         if not rootpath:
@@ -69,16 +132,54 @@ class VFS_Real:
         return fspath
 
     def copyto(self, name, fd):
+        cache = self.contentcacheable and contentcache.getcache(self.config)
+        if cache:
+            data = cache.get(self.getfspath(name))
+            if data != None:
+                contentcache.writeto(data, fd)
+                return
         rfile = self.open(name, 'rb')
         while 1:
             data = rfile.read(4096)
             if not len(data):
                 break
             fd.write(data)
-        rfile.close
+        rfile.close()
+
+    def copyrangeto(self, name, fd, offset, length):
+        """Copy length bytes of name, starting at offset, to fd."""
+        rfile = self.open(name, 'rb')
+        try:
+            if hasattr(rfile, 'seek'):
+                rfile.seek(offset)
+            else:
+                while offset > 0:
+                    data = rfile.read(min(4096, offset))
+                    if not len(data):
+                        break
+                    offset -= len(data)
+            while length > 0:
+                data = rfile.read(min(4096, length))
+                if not len(data):
+                    break
+                fd.write(data)
+                length -= len(data)
+        finally:
+            rfile.close()
 
 class BaseHandler:
     """Skeleton handler -- includes commonly-used routines."""
+
+    # Set by handlers whose choice of a file, and the entry they give for
+    # it, depend only on the selector, the file's metadata and its
+    # contents.  Directory handlers may then cache those entries.
+    entrycacheable = 0
+
+    # Set by handlers whose getentry(), prepare() and getdirlist() only
+    # read files and fill caches, running nothing, so that they may be
+    # called at startup to warm those caches.
+    warmable = 0
+
     def __init__(self, selector, searchrequest, protocol, config, statresult,
                  vfs = None):
         """Parameters are:
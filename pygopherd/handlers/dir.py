@@ -20,15 +20,20 @@
 import SocketServer
 import re
 import os, stat, os.path, mimetypes, time
-from pygopherd import protocols, gopherentry, handlers
+from pygopherd import protocols, gopherentry, handlers, parallel
 from pygopherd.handlers import base
 from stat import *
-import cPickle
+import cPickle, marshal
 
 cachetime = None
 cachefile = None
+entrycache = None
+eaexts = None
+metadatathreads = None
 
 class DirHandler(base.BaseHandler):
+    warmable = 1
+
     def canhandlerequest(self):
         """We can handle the request if it's for a directory."""
         return self.statresult and S_ISDIR(self.statresult[ST_MODE])
@@ -43,6 +48,9 @@ class DirHandler(base.BaseHandler):
         "Initialize the list of files.  Ignore the files we're suppoed to."
         self.files = []
         dirfiles = self.vfs.listdir(self.getselector())
+        # Lets entries look for their .abstract and such without opening
+        # files that aren't there.
+        self.vfs.setlistinghint(self.selectorbase, dirfiles)
         ignorepatt = self.config.get("handlers.dir.DirHandler", "ignorepatt")
         for file in dirfiles:
             if self.prep_initfiles_canaddfile(ignorepatt,
@@ -57,15 +65,172 @@ class DirHandler(base.BaseHandler):
         "Generate entries from the list."
 
         self.fileentries = []
-        for file in self.files:
-            # We look up the appropriate handler for this object, and ask
-            # it to give us an entry object.
+        self.prep_statfiles()
+        self.loadentrycache()
+        results = parallel.parallelmap(self.prep_makeentry, self.files,
+                                       self.getmetadatathreads())
+        for i in range(len(self.files)):
+            handler, fileentry = results[i]
+            self.prep_entriesappend(self.files[i], handler, fileentry)
+        self.saveentrycache()
+
+    def prep_makeentry(self, file):
+        """Returns (handler, entry) for file.  This may be called from
+        several threads at once."""
+        statresult = self.statresults[file]
+        handler, fileentry = self.prep_cachedentry(file, statresult)
+        if not handler:
+            # We look up the appropriate handler for this object, and
+            # ask it to give us an entry object.
             handler = handlers.HandlerMultiplexer.\
                         getHandler(self.selectorbase + '/' \
-                                   + file, self.searchrequest, self.protocol,
-                                   self.config, vfs = self.vfs)
+                                   + file, self.searchrequest,
+                                   self.protocol, self.config,
+                                   vfs = self.vfs,
+                                   statresult = statresult)
             fileentry = handler.getentry()
-            self.prep_entriesappend(file, handler, fileentry)
+            self.prep_cacheentry(file, statresult, handler, fileentry)
+        return (handler, fileentry)
+
+    def prep_statfiles(self):
+        """Stats every file in the list in one pass.  Files that can't be
+        stat()ed get None, and are left to the handlers."""
+        self.statresults = {}
+        results = parallel.parallelmap(self.prep_statfile, self.files,
+                                       self.getmetadatathreads())
+        for i in range(len(self.files)):
+            self.statresults[self.files[i]] = results[i]
+
+    def prep_statfile(self, file):
+        try:
+            return self.vfs.stat(self.selectorbase + '/' + file)
+        except OSError:
+            return None
+
+    def getmetadatathreads(self):
+        """Returns how many threads may stat files and build their entries
+        at once; 1 means to do it all in this thread."""
+        global metadatathreads
+        if metadatathreads == None:
+            metadatathreads = 1
+            if self.config.has_option("handlers.dir.DirHandler",
+                                      "metadatathreads"):
+                metadatathreads = max(1, self.config.getint( \
+                    "handlers.dir.DirHandler", "metadatathreads"))
+        if not getattr(self.vfs, 'threadsafe', 0):
+            return 1
+        return metadatathreads
+
+    ## The entry cache, .cache.pygopherd.entries, holds the entries that
+    ## handlers with entrycacheable set made for the files in this
+    ## directory.  An entry is reused while the file's metadata, and that
+    ## of its extended attribute files, is unchanged.  This skips the
+    ## handler search and populating the entry for files seen before.
+
+    def getentrycachename(self):
+        return self.selectorbase + '/.cache.pygopherd.entries'
+
+    def loadentrycache(self):
+        global entrycache, eaexts
+        if entrycache == None:
+            entrycache = 1
+            if self.config.has_option("handlers.dir.DirHandler",
+                                      "entrycache"):
+                entrycache = self.config.getboolean("handlers.dir.DirHandler",
+                                                    "entrycache")
+            eaexts = eval(self.config.get("GopherEntry", "eaexts")).keys()
+        self.entrycache = None
+        self.newentrycache = {}
+        self.handlerclasses = {}
+        if not (entrycache and self.vfs.iswritable(self.getentrycachename())):
+            return
+        self.entrycache = {}
+        # Changing the handler list can change every entry.
+        self.entrycachehandlers = \
+            self.config.get("handlers.HandlerMultiplexer", "handlers")
+        try:
+            fd = self.vfs.open(self.getentrycachename(), 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] == 1 and \
+               data['handlers'] == self.entrycachehandlers:
+                self.entrycache = data['entries']
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+
+    def saveentrycache(self):
+        if self.entrycache == None or self.newentrycache == self.entrycache:
+            return
+        tempname = base.gettempselector(self.getentrycachename())
+        try:
+            fd = self.vfs.open(tempname, 'wb')
+            try:
+                marshal.dump({'version': 1,
+                              'handlers': self.entrycachehandlers,
+                              'entries': self.newentrycache}, fd)
+            finally:
+                fd.close()
+            self.vfs.rename(tempname, self.getentrycachename())
+        except (IOError, OSError, ValueError):
+            # ValueError: an entry had something marshal can't store.
+            try:
+                self.vfs.unlink(tempname)
+            except OSError:
+                pass
+
+    def getentrykey(self, file, statresult):
+        """Returns what must be unchanged for a cached entry for file to
+        be reused."""
+        # The entry cache is only used on the real filesystem, so these
+        # are full os.stat results, with sub-second times where available.
+        key = [(statresult.st_mode, statresult.st_ino, statresult.st_size,
+                statresult.st_mtime, statresult.st_ctime)]
+        listing = self.vfs.getlistinghint(self.selectorbase)
+        for ext in eaexts:
+            if listing == None or listing.has_key(file + ext):
+                try:
+                    eastat = self.vfs.stat(self.selectorbase + '/' + file + ext)
+                    key.append((ext, eastat.st_size, eastat.st_mtime,
+                                eastat.st_ctime))
+                except OSError:
+                    pass
+        return tuple(key)
+
+    def prep_cachedentry(self, file, statresult):
+        """Returns (handler, entry) for file from the entry cache, or
+        (None, None)."""
+        if self.entrycache == None or statresult == None or \
+           not self.entrycache.has_key(file):
+            return (None, None)
+        key, handlername, state = self.entrycache[file]
+        if key != self.getentrykey(file, statresult):
+            return (None, None)
+        if not self.handlerclasses.has_key(handlername):
+            self.handlerclasses[handlername] = \
+                handlers.HandlerMultiplexer.getHandlerClass(handlername)
+        handlerclass = self.handlerclasses[handlername]
+        if not handlerclass:
+            return (None, None)
+        selector = self.selectorbase + '/' + file
+        handler = handlerclass(selector, self.searchrequest, self.protocol,
+                               self.config, statresult, self.vfs)
+        handler.entry = gopherentry.setentrystate( \
+            gopherentry.GopherEntry(selector, self.config), state)
+        self.newentrycache[file] = self.entrycache[file]
+        return (handler, handler.entry)
+
+    def prep_cacheentry(self, file, statresult, handler, fileentry):
+        if self.entrycache == None or statresult == None or \
+           not handler.entrycacheable:
+            return
+        handlername = handler.__class__.__module__ + '.' + \
+                      handler.__class__.__name__
+        # Store it now, before any post-processing of the entry.
+        self.newentrycache[file] = (self.getentrykey(file, statresult),
+                                    handlername,
+                                    gopherentry.getentrystate(fileentry))
 
     def prep_entriesappend(self, file, handler, fileentry):
         """Subclasses can override to do post-processing on the entry while
@@ -127,8 +292,8 @@ class DirHandler(base.BaseHandler):
 
     def savecache(self):
         global cachefile
-        if self.fromcache:
-            # Don't resave the cache.
+        if self.fromcache or cachetime <= 0:
+            # Don't resave the cache, or don't cache at all.
             return
         if not self.vfs.iswritable(self.selector + "/" + cachefile):
             return
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the directory handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from pygopherd import testutil, gopherentry
+from pygopherd.handlers import base, dir, HandlerMultiplexer
+
+class DirHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.dir.DirHandler", "cachetime", "0")
+        base.rootpath = self.root
+        dir.entrycache = None
+        dir.metadatathreads = None
+        gopherentry.eacache.clear()
+        self.write('index.html', '<title>The index</title>\n')
+        self.write('notes.txt', 'Some notes\n')
+        self.write('notes.txt.abstract', 'About the notes\n')
+        self.write('mail', 'From user@example.com Mon Jan  6 12:00:00 2003\n'
+                   'Subject: Hi\n\nHello\n')
+        os.mkdir(os.path.join(self.root, 'subdir'))
+        self.lookups = []
+        self.realgetHandler = HandlerMultiplexer.getHandler
+        def getHandler(selector, *args, **kwargs):
+            self.lookups.append(selector)
+            return self.realgetHandler(selector, *args, **kwargs)
+        HandlerMultiplexer.getHandler = getHandler
+
+    def tearDown(self):
+        HandlerMultiplexer.getHandler = self.realgetHandler
+        base.rootpath = None
+        dir.entrycache = None
+        dir.metadatathreads = None
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def getlisting(self, vfs = None):
+        self.lookups = []
+        handler = HandlerMultiplexer.getHandler('/', '', None, self.config,
+                                                vfs = vfs)
+        handler.getentry()
+        handler.prepare()
+        return [(entry.getselector(), entry.gettype(), entry.getname(),
+                 entry.getmimetype(), entry.geteadict()) \
+                for entry in handler.getdirlist()]
+
+    def testentrycache(self):
+        self.config.set("handlers.dir.DirHandler", "entrycache", "off")
+        expected = self.getlisting()
+        dir.entrycache = None
+        self.config.set("handlers.dir.DirHandler", "entrycache", "on")
+        self.assertEquals(self.getlisting(), expected)
+        assert os.path.exists(os.path.join(self.root,
+                                           '.cache.pygopherd.entries'))
+        # Written beside it and renamed into place.
+        self.assertEquals([name for name in os.listdir(self.root) \
+                           if name.startswith('.cache.pygopherd.entries.')],
+                          [])
+
+        # Only the directory, which is never cached, is looked up again.
+        self.assertEquals(self.getlisting(), expected)
+        self.assertEquals(self.lookups, ['/', '/subdir'])
+
+        # A changed file or extended attribute file is looked up again.
+        self.write('notes.txt.abstract', 'More about the notes\n')
+        self.write('index.html', '<title>The new index</title>\n')
+        listing = self.getlisting()
+        self.lookups.sort()
+        self.assertEquals(self.lookups, ['/', '/index.html', '/notes.txt',
+                                         '/subdir'])
+        self.assertEquals(listing[2][4], {'ABSTRACT': 'More about the notes'})
+
+    def testmetadatathreads(self):
+        self.config.set("handlers.dir.DirHandler", "entrycache", "off")
+        for i in range(20):
+            self.write('page%02d.html' % i, '<title>Page %d</title>\n' % i)
+            self.write('page%02d.html.abstract' % i, 'About page %d\n' % i)
+        expected = self.getlisting()
+
+        dir.metadatathreads = None
+        self.config.set("handlers.dir.DirHandler", "metadatathreads", "1")
+        vfs = testutil.VFS_Slow(self.config, 0.005)
+        start = time.time()
+        self.assertEquals(self.getlisting(vfs), expected)
+        serialtime = time.time() - start
+        self.assertEquals(vfs.maxwaiting, 1)
+
+        dir.metadatathreads = None
+        self.config.set("handlers.dir.DirHandler", "metadatathreads", "8")
+        vfs = testutil.VFS_Slow(self.config, 0.005)
+        start = time.time()
+        self.assertEquals(self.getlisting(vfs), expected)
+        paralleltime = time.time() - start
+        assert vfs.maxwaiting > 1
+        assert vfs.maxwaiting <= 8
+        assert paralleltime < serialtime
@@ -25,6 +25,9 @@ import pygopherd.pipe
 from stat import *
 
 class FileHandler(base.BaseHandler):
+    entrycacheable = 1
+    warmable = 1
+
     def canhandlerequest(self):
         """We can handle the request if it's for a file."""
         return self.statresult and S_ISREG(self.statresult[ST_MODE])
@@ -17,15 +17,217 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import SocketServer
-import re
-import os, stat, os.path, mimetypes
+import re, marshal, time
+import os, stat, os.path, mimetypes, threading
+from collections import OrderedDict
 from pygopherd import protocols, gopherentry
 from pygopherd.handlers import base
 from stat import *
 
+class CompiledGophermap:
+    """A parsed gophermap.  self.items holds, for each line of the map,
+    either the text of an info line or the state of the entry for a link
+    (see gopherentry.getentrystate), with local links already filled in
+    from the filesystem.
+
+    self.depends maps each selector the result was built from to its
+    (mtime, size), or None if it did not exist: the map itself, the
+    targets of local links, the directories holding them, and their
+    extended attribute files.  The compiled map can be reused while a stat
+    of each of these gives the same answer.  It is saved beside the map
+    in .cache.pygopherd.gophermap.<name>."""
+
+    version = 1
+
+    def __init__(self, vfs, selector, selectorbase):
+        self.vfs = vfs
+        self.selector = selector
+        self.selectorbase = selectorbase  # What links are relative to
+        self.items = None
+        self.depends = {}
+        self.compiletime = None
+
+    def getcachename(self):
+        (dir, file) = os.path.split(self.selector)
+        return os.path.join(dir, '.cache.pygopherd.gophermap.' + file)
+
+    def load(self):
+        try:
+            fd = self.vfs.open(self.getcachename(), 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] == self.version and \
+               data['selectorbase'] == self.selectorbase:
+                self.items = data['items']
+                self.depends = data['depends']
+                self.compiletime = data['compiletime']
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+
+    def save(self):
+        cachename = self.getcachename()
+        tempname = base.gettempselector(cachename)
+        try:
+            fd = self.vfs.open(tempname, 'wb')
+            try:
+                marshal.dump({'version': self.version,
+                              'selectorbase': self.selectorbase,
+                              'items': self.items,
+                              'depends': self.depends,
+                              'compiletime': self.compiletime}, fd)
+            finally:
+                fd.close()
+            self.vfs.rename(tempname, cachename)
+        except (IOError, OSError, ValueError):
+            try:
+                self.vfs.unlink(tempname)
+            except OSError:
+                pass
+
+    def getdepend(self, selector):
+        try:
+            statval = self.vfs.stat(selector)
+        except OSError:
+            return None
+        return (statval[ST_MTIME], statval[ST_SIZE])
+
+    def adddepend(self, selector):
+        if not self.depends.has_key(selector):
+            self.depends[selector] = self.getdepend(selector)
+        return self.depends[selector]
+
+    def iscurrent(self):
+        if self.items == None:
+            return 0
+        for selector, value in self.depends.items():
+            if self.getdepend(selector) != value:
+                return 0
+        return 1
+
+    def iscacheable(self):
+        """Changes made in the second the map was compiled may not show in
+        the mtimes, so such a map can't be trusted later."""
+        for value in self.depends.values():
+            if value != None and value[0] >= self.compiletime:
+                return 0
+        return 1
+
+    def compile(self, config):
+        eaexts = eval(config.get("GopherEntry", "eaexts"))
+        self.compiletime = int(time.time())
+        self.items = []
+        self.depends = {}
+        self.adddepend(self.selector)
+        rfile = self.vfs.open(self.selector, 'rb')
+        try:
+            lines = rfile.readlines()
+        finally:
+            rfile.close()
+
+        for line in lines:
+            if line.find("\t") == -1:  # Info line
+                self.items.append(line.strip())
+                continue
+
+            # gophermap link
+            args = map(lambda arg: arg.strip(), line.split("\t"))
+
+            if len(args) < 2 or not len(args[1]):
+                args[1] = args[0][1:] # Copy display string to selector
+
+            selector = args[1]
+            if selector[0] != '/': # Relative link
+                selector = self.selectorbase + '/' + selector
+
+            entry = gopherentry.GopherEntry(selector, config)
+            entry.type = args[0][0]
+            entry.name = args[0][1:]
+
+            if len(args) >= 3 and len(args[2]):
+                entry.host = args[2]
+
+            if len(args) >= 4 and len(args[3]):
+                entry.port = int(args[3])
+
+            if entry.gethost() == None and entry.getport() == None:
+                # If we're using links on THIS server, try to fill
+                # it in for gopher+.  Creating the target, or an extended
+                # attribute file beside it, changes its directory.
+                self.adddepend(os.path.dirname(selector))
+                try:
+                    statval = self.vfs.stat(selector)
+                except OSError:
+                    statval = None
+                    self.depends[selector] = None
+                if statval != None:
+                    self.depends[selector] = (statval[ST_MTIME],
+                                              statval[ST_SIZE])
+                    entry.populatefromfs(selector, statval, vfs = self.vfs)
+                    eabase = selector
+                    if S_ISDIR(statval[ST_MODE]):
+                        eabase = selector + '/'
+                    for extension, blockname in eaexts.items():
+                        if entry.ea.has_key(blockname):
+                            self.adddepend(eabase + extension)
+            self.items.append(gopherentry.getentrystate(entry))
+
+    def getentries(self, config):
+        entries = []
+        for item in self.items:
+            if type(item) == type(''):
+                entries.append(gopherentry.getinfoentry(item, config))
+            else:
+                entries.append(gopherentry.setentrystate( \
+                    gopherentry.GopherEntry(item['selector'], config), item))
+        return entries
+
+# Compiled maps, by selector of the map, least recently used first.
+# Those that fall out are loaded again from their cache files.
+compiledmaps = OrderedDict()
+compiledmapslock = threading.Lock()
+maxcompiledmaps = 256
+
+def getcompiledmap(vfs, selector, selectorbase, config):
+    """Returns an up-to-date CompiledGophermap for the map at selector.
+    One that is kept may be in use by other threads, so it is never
+    changed; a new one replaces it."""
+    cacheable = vfs.iswritable(selector)
+    compiledmapslock.acquire()
+    try:
+        compiled = compiledmaps.pop(selector, None)
+        if compiled != None:
+            compiledmaps[selector] = compiled
+    finally:
+        compiledmapslock.release()
+    if cacheable and compiled != None and \
+       compiled.selectorbase == selectorbase and compiled.iscurrent():
+        return compiled
+
+    compiled = CompiledGophermap(vfs, selector, selectorbase)
+    if cacheable:
+        compiled.load()
+    if not compiled.iscurrent():
+        compiled.compile(config)
+        if cacheable and compiled.iscacheable():
+            compiled.save()
+    compiledmapslock.acquire()
+    try:
+        compiledmaps.pop(selector, None)
+        if cacheable and compiled.iscacheable():
+            compiledmaps[selector] = compiled
+            while len(compiledmaps) > maxcompiledmaps:
+                compiledmaps.popitem(0)
+    finally:
+        compiledmapslock.release()
+    return compiled
+
 class BuckGophermapHandler(base.BaseHandler):
     """Bucktooth selector handler.  Adheres to the specification
     at gopher://gopher.floodgap.com:70/0/buck/dbrowse%3Ffaquse%201"""
+    warmable = 1
+
     def canhandlerequest(self):
         """We can handle the request if it's for a directory AND
         the directory has a gophermap file."""
@@ -52,47 +254,13 @@ class BuckGophermapHandler(base.BaseHandler):
 
         if self.getselector().endswith(".gophermap") and \
            self.statresult and S_ISREG(self.statresult[ST_MODE]):
-            self.rfile = self.vfs.open(self.getselector(), 'rb')
+            mapselector = self.getselector()
         else:
-            self.rfile = self.vfs.open(self.selectorbase + '/gophermap', 'rb')
-
-        self.entries = []
-
-        selectorbase = self.selectorbase
-        
-        while 1:
-            line = self.rfile.readline()
-            if not line:
-                break
-            if re.search("\t", line):   # gophermap link
-                args = map(lambda arg: arg.strip(), line.split("\t"))
-
-                if len(args) < 2 or not len(args[1]):
-                    args[1] = args[0][1:] # Copy display string to selector
-
-                selector = args[1]
-                if selector[0] != '/': # Relative link
-                    selector = selectorbase + '/' + selector
-                
-                entry = gopherentry.GopherEntry(selector, self.config)
-                entry.type = args[0][0]
-                entry.name = args[0][1:]
-
-                if len(args) >= 3 and len(args[2]):
-                    entry.host = args[2]
-
-                if len(args) >= 4 and len(args[3]):
-                    entry.port = int(args[3])
-
-                if entry.gethost() == None and entry.getport() == None:
-                    # If we're using links on THIS server, try to fill
-                    # it in for gopher+.
-                    if self.vfs.exists(selector):
-                        entry.populatefromvfs(self.vfs, selector)
-                self.entries.append(entry)
-            else:                       # Info line
-                line = line.strip()
-                self.entries.append(gopherentry.getinfoentry(line, self.config))
+            mapselector = self.selectorbase + '/gophermap'
+
+        self.entries = getcompiledmap(self.vfs, mapselector,
+                                      self.selectorbase,
+                                      self.config).getentries(self.config)
 
     def isdir(self):
         return 1
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the gophermap handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from pygopherd import testutil, gopherentry
+from pygopherd.handlers import base, gophermap
+
+class BuckGophermapHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        base.rootpath = self.root
+        gophermap.compiledmaps.clear()
+        gopherentry.eacache.clear()
+        os.mkdir(os.path.join(self.root, 'docs'))
+        self.write('docs/readme.txt', 'Read me\n')
+        self.write('docs/readme.txt.abstract', 'What to read\n')
+        self.write('gophermap', 'Welcome\n'
+                   '0The readme\tdocs/readme.txt\n'
+                   '0Coming soon\tdocs/new.txt\n'
+                   '1Elsewhere\t/\tgopher.example.com\t70\n')
+        self.age()
+        self.opens = []
+
+    def tearDown(self):
+        base.rootpath = None
+        gophermap.compiledmaps.clear()
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def age(self, seconds = 60):
+        """Backdates everything, so the compiled map can be trusted."""
+        when = time.time() - seconds
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in dirnames + filenames:
+                os.utime(os.path.join(dirpath, name), (when, when))
+        os.utime(self.root, (when, when))
+
+    def getentries(self):
+        handler = gophermap.BuckGophermapHandler('/', '', None, self.config,
+                                                 os.stat(self.root))
+        realopen = handler.vfs.open
+        def open(selector, *args):
+            if not selector.startswith('/.cache'):
+                self.opens.append(selector)
+            return realopen(selector, *args)
+        handler.vfs.open = open
+        assert handler.canhandlerequest()
+        handler.prepare()
+        return [(entry.gettype(), entry.getname(), entry.getselector(),
+                 entry.gethost(), entry.geteadict())
+                for entry in handler.getdirlist()]
+
+    def testmap(self):
+        entries = self.getentries()
+        self.assertEquals(entries[0][0:2], ('i', 'Welcome'))
+        self.assertEquals(entries[1], ('0', 'The readme', '/docs/readme.txt',
+                                       None, {'ABSTRACT': 'What to read'}))
+        self.assertEquals(entries[2], ('0', 'Coming soon', '/docs/new.txt',
+                                       None, {}))
+        self.assertEquals(entries[3], ('1', 'Elsewhere', '/',
+                                       'gopher.example.com', {}))
+
+    def testcache(self):
+        expected = self.getentries()
+        assert os.path.exists(os.path.join(self.root,
+                                           '.cache.pygopherd.gophermap.gophermap'))
+        self.opens = []
+        self.assertEquals(self.getentries(), expected)
+        self.assertEquals(self.opens, [])
+
+        # A fresh process uses the saved copy.
+        gophermap.compiledmaps.clear()
+        self.assertEquals(self.getentries(), expected)
+        self.assertEquals(self.opens, [])
+        self.assertEquals([name for name in os.listdir(self.root) \
+                           if name.startswith('.cache')],
+                          ['.cache.pygopherd.gophermap.gophermap'])
+
+        # Only so many are kept in memory; the rest are loaded again.
+        gophermap.maxcompiledmaps = 0
+        gophermap.compiledmaps.clear()
+        try:
+            self.assertEquals(self.getentries(), expected)
+            self.assertEquals(self.opens, [])
+            self.assertEquals(len(gophermap.compiledmaps), 0)
+        finally:
+            gophermap.maxcompiledmaps = 256
+
+    def testdepends(self):
+        self.getentries()
+        self.write('docs/readme.txt.abstract', 'Something else to read\n')
+        self.write('docs/new.txt', 'New\n')
+        self.write('docs/new.txt.abstract', 'Brand new\n')
+        self.age(30)
+        entries = self.getentries()
+        self.assertEquals(entries[1][4], {'ABSTRACT': 'Something else to read'})
+        self.assertEquals(entries[2][4], {'ABSTRACT': 'Brand new'})
+
+        self.write('gophermap', 'Changed\n')
+        self.age(10)
+        self.opens = []
+        self.assertEquals(self.getentries()[0][0:2], ('i', 'Changed'))
+        self.assertEquals(self.opens, ['/gophermap'])
@@ -17,10 +17,16 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from pygopherd.handlers.file import FileHandler
+from pygopherd.handlers import base
 import HTMLParser
 import SocketServer
-import re
+import re, marshal
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 import os, stat, os.path, mimetypes
+from collections import OrderedDict
 from pygopherd import protocols, gopherentry
 from pygopherd.gopherentry import GopherEntry
 import htmlentitydefs
@@ -56,6 +62,150 @@ class HTMLTitleParser(HTMLParser.HTMLParser):
         if self.readingtitle and htmlentitydefs.entitydefs.has_key(name):
             self.titlestr += htmlentitydefs.entitydefs[name]
 
+###########################################################################
+# Title cache
+# Titles are kept per directory in .cache.pygopherd.html, so that a menu
+# of HTML files doesn't have to open every one of them.
+###########################################################################
+
+class HTMLTitleCache:
+    """The titles of the HTML files in one directory.  self.titles maps
+    a filename to (mtime, size, title); title is None for files without
+    one."""
+
+    version = 1
+
+    def __init__(self, vfs, dirselector):
+        self.vfs = vfs
+        if dirselector == '/':
+            dirselector = ''
+        self.cachename = dirselector + '/.cache.pygopherd.html'
+        self.titles = {}
+        self.changed = {}               # Entries not yet saved
+        self.loadedmtime = None
+        # Directory handlers may look up titles from several threads.
+        self.lock = threading.RLock()
+
+    def getcachemtime(self):
+        try:
+            return self.vfs.stat(self.cachename)[ST_MTIME]
+        except OSError:
+            return None
+
+    def load(self):
+        """(Re)reads the cache file if another process has changed it."""
+        self.lock.acquire()
+        try:
+            self._load()
+        finally:
+            self.lock.release()
+
+    def _load(self):
+        mtime = self.getcachemtime()
+        if mtime == None or mtime == self.loadedmtime:
+            return
+        try:
+            fd = self.vfs.open(self.cachename, 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] == self.version:
+                self.titles = data['titles']
+                self.titles.update(self.changed)
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+        self.loadedmtime = mtime
+
+    def get(self, filename, statval, reload = 1):
+        """Returns (found, title) for filename."""
+        if self.titles.has_key(filename):
+            mtime, size, title = self.titles[filename]
+            if mtime == statval[ST_MTIME] and size == statval[ST_SIZE]:
+                return (1, title)
+        if reload:
+            # Another process may have seen it since we last looked.
+            self.load()
+            return self.get(filename, statval, 0)
+        return (0, None)
+
+    def set(self, filename, statval, title):
+        """Records the title, to be saved once the request that found it
+        has been answered, along with any others found meanwhile."""
+        value = (statval[ST_MTIME], statval[ST_SIZE], title)
+        self.lock.acquire()
+        try:
+            if not self.changed:
+                base.deferuntilfinished(self.save)
+            self.titles[filename] = value
+            self.changed[filename] = value
+        finally:
+            self.lock.release()
+
+    def save(self):
+        self.lock.acquire()
+        try:
+            if not self.changed:
+                return
+            # Pick up anything other processes have added meanwhile.
+            self._load()
+            tempname = base.gettempselector(self.cachename)
+            try:
+                fd = self.vfs.open(tempname, 'wb')
+                try:
+                    marshal.dump({'version': self.version,
+                                  'titles': self.titles}, fd)
+                finally:
+                    fd.close()
+                self.vfs.rename(tempname, self.cachename)
+            except (IOError, OSError):
+                try:
+                    self.vfs.unlink(tempname)
+                except OSError:
+                    pass
+            self.changed = {}
+            self.loadedmtime = self.getcachemtime()
+        finally:
+            self.lock.release()
+
+# Title caches, by directory, least recently used first.  Those that fall
+# out are loaded again from their cache files.
+titlecaches = OrderedDict()
+titlecacheslock = threading.Lock()
+maxtitlecaches = 256
+
+def gettitlecache(vfs, dirselector):
+    titlecacheslock.acquire()
+    try:
+        cache = titlecaches.pop(dirselector, None)
+        if cache == None:
+            cache = HTMLTitleCache(vfs, dirselector)
+        titlecaches[dirselector] = cache
+        while len(titlecaches) > maxtitlecaches:
+            titlecaches.popitem(0)
+    finally:
+        titlecacheslock.release()
+    cache.vfs = vfs
+    if cache.loadedmtime == None:
+        cache.load()
+    return cache
+
+# How much of a file the quick title scan looks at.
+titlescanbytes = 8192
+titlepatt = re.compile('<title(?:\s[^>]*)?>(.*?)</title\s*>', re.I | re.S)
+
+def scantitle(data):
+    """Looks for a plain title in data, the start of an HTML file.
+    Returns None if there isn't one that is safe to take as-is, in which
+    case the file needs a proper parse."""
+    match = titlepatt.search(data)
+    if not match:
+        return None
+    title = match.group(1)
+    if title.find('&') != -1 or title.find('<') != -1:
+        return None
+    return title
+
 class HTMLFileTitleHandler(FileHandler):
     """This class will set the title of a HTML document based on the
     HTML title.  It is a clone of the UMN gsfindhtmltitle function."""
@@ -69,8 +219,38 @@ class HTMLFileTitleHandler(FileHandler):
     def getentry(self):
         # Start with the entry from the parent.
         entry = FileHandler.getentry(self)
-        parser = HTMLTitleParser()
+        cache = None
+        if self.statresult and self.vfs.iswritable(self.getselector()):
+            (dir, file) = os.path.split(self.getselector())
+            cache = gettitlecache(self.vfs, dir)
+            found, title = cache.get(file, self.statresult)
+        if not (cache and found):
+            title = self.gettitle()
+            if cache:
+                cache.set(file, self.statresult, title)
+
+        if title != None:
+            # Convert all whitespace sequences to a single space.
+            # Removes newlines, tabs, etc.  Good for presentation
+            # and for security.
+            entry.setname(re.sub('[\s]+', ' ', title))
+        return entry
+
+    def gettitle(self):
+        """Reads the title from the file; returns None if it has none."""
         file = self.vfs.open(self.getselector(), "rt")
+        title = scantitle(file.read(titlescanbytes))
+        if title != None:
+            file.close()
+            return title
+
+        # Entities, markup, or no title near the start; parse it properly.
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        else:
+            file.close()
+            file = self.vfs.open(self.getselector(), "rt")
+        parser = HTMLTitleParser()
         try:
             while not parser.gotcompletetitle:
                 line = file.readline()
@@ -89,10 +269,5 @@ class HTMLFileTitleHandler(FileHandler):
         # or a complete title (or error).  Now, figure out what happened.
 
         if parser.gotcompletetitle:
-            # Convert all whitespace sequences to a single space.
-            # Removes newlines, tabs, etc.  Good for presentation
-            # and for security.
-            title = re.sub('[\s]+', ' ', parser.titlestr)
-            entry.setname(title)
-        return entry
-
+            return parser.titlestr
+        return None
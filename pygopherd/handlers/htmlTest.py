@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the HTML title handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil
+from pygopherd import testutil
+from pygopherd.handlers import base, html
+
+class HTMLTitleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        base.rootpath = self.root
+        html.titlecaches.clear()
+        self.opens = []
+
+    def tearDown(self):
+        base.rootpath = None
+        base.deferred.clear()
+        html.titlecaches.clear()
+        html.maxtitlecaches = 256
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def gettitle(self, name):
+        selector = '/' + name
+        handler = html.HTMLFileTitleHandler(selector, '', None, self.config,
+                                            os.stat(self.root + selector))
+        assert handler.canhandlerequest()
+        # Record which HTML files get opened.
+        realopen = handler.vfs.open
+        def open(selector, *args):
+            if selector.endswith('.html') and \
+               not selector.startswith('/.cache'):
+                self.opens.append(selector)
+            return realopen(selector, *args)
+        handler.vfs.open = open
+        return handler.getentry().getname()
+
+    def testtitles(self):
+        self.write('plain.html', "<html><HEAD><Title>A\n  plain\ttitle</TITLE>")
+        self.write('entity.html', "<title>Fish &amp; chips</title>")
+        self.write('late.html', "<p>" + "x" * 20000 + "<title>Late</title>")
+        self.write('none.html', "<html><body>No title</body></html>")
+        self.assertEquals(self.gettitle('plain.html'), 'A plain title')
+        self.assertEquals(self.gettitle('entity.html'), 'Fish & chips')
+        self.assertEquals(self.gettitle('late.html'), 'Late')
+        self.assertEquals(self.gettitle('none.html'), 'none.html')
+
+    def testcache(self):
+        self.write('a.html', "<title>First</title>")
+        self.write('b.html', "<html></html>")
+        self.assertEquals(self.gettitle('a.html'), 'First')
+        self.assertEquals(self.gettitle('b.html'), 'b.html')
+        base.finishrequest()
+        assert os.path.exists(os.path.join(self.root, '.cache.pygopherd.html'))
+
+        # A new process finds both, including the missing title, on disk.
+        html.titlecaches.clear()
+        self.opens = []
+        self.assertEquals(self.gettitle('a.html'), 'First')
+        self.assertEquals(self.gettitle('b.html'), 'b.html')
+        self.assertEquals(self.opens, [])
+        # Only a request that found new titles writes the cache back.
+        self.assertEquals(base.deferred, {})
+
+        # A changed file is read again.
+        self.write('a.html', "<title>Second version</title>")
+        self.assertEquals(self.gettitle('a.html'), 'Second version')
+        self.assertEquals(self.opens, ['/a.html'])
+
+    def testbound(self):
+        html.maxtitlecaches = 1
+        os.mkdir(os.path.join(self.root, 'sub'))
+        self.write('a.html', "<title>First</title>")
+        self.write('sub/b.html', "<title>Second</title>")
+        self.assertEquals(self.gettitle('a.html'), 'First')
+        self.assertEquals(self.gettitle('sub/b.html'), 'Second')
+        self.assertEquals(html.titlecaches.keys(), ['/sub'])
+        # One that fell out is still saved once the request is answered.
+        base.finishrequest()
+        assert os.path.exists(os.path.join(self.root, '.cache.pygopherd.html'))
@@ -18,12 +18,15 @@
 
 
 import SocketServer
-import re
-import os, stat, os.path, mimetypes
-from pygopherd import protocols, gopherentry
+import re, marshal, time, rfc822
+import os, stat, os.path, mimetypes, threading
+from collections import OrderedDict
+from StringIO import StringIO
+from pygopherd import protocols, gopherentry, GopherExceptions, searchindex
+from pygopherd.handlers import base
 from pygopherd.handlers.virtual import Virtual
 from pygopherd.handlers.base import VFS_Real
-from mailbox import UnixMailbox, Maildir
+from mailbox import UnixMailbox
 from stat import *
 
 
@@ -32,6 +35,13 @@ from stat import *
 ###########################################################################
 
 class FolderHandler(Virtual):
+    """Presents a mail folder as a menu of its messages, a page at a time.
+    Pages are requested with a selector argument of /PAGE/<n>, and a
+    search of the folder with /SEARCH.  Subclasses supply
+    getmessagecount, getmessageentry, getmessagekeys and openmessage."""
+
+    section = "handlers.mbox.FolderHandler"
+
     def getentry(self):
         ## Return my own entry.
         if not self.entry:
@@ -41,26 +51,178 @@ class FolderHandler(Virtual):
             self.entry.setname(os.path.basename(self.getselector()))
             self.entry.setmimetype('application/gopher-menu')
             self.entry.setgopherpsupport(0)
+            if self.searching:
+                self.entry.settype('7')
+                self.entry.setselector(self.selector)
         return self.entry
 
+    def canhandlepage(self):
+        """Returns true if the selector has no arguments, names a page of
+        this folder or asks to search it, and sets self.page and
+        self.searching accordingly."""
+        self.page = 1
+        self.searching = 0
+        if not self.selectorargs:
+            return 1
+        if self.selectorargs == '/SEARCH':
+            self.searching = self.issearchable()
+            return self.searching
+        page = re.search('^/PAGE/(\d+)$', self.selectorargs)
+        if not page or int(page.group(1)) < 1:
+            return 0
+        self.page = int(page.group(1))
+        return 1
+
+    def getpagesize(self):
+        if self.config.has_option(self.section, "pagesize"):
+            return self.config.getint(self.section, "pagesize")
+        return 100
+
+    def isnewestfirst(self):
+        if self.config.has_option(self.section, "order"):
+            return self.config.get(self.section, "order") == "newest"
+        return 1
+
+    def issearchable(self):
+        if self.config.has_option(self.section, "search"):
+            return self.config.getboolean(self.section, "search")
+        return 0
+
+    def getmessagecount(self):
+        """Returns the number of messages in the folder."""
+        return 0
+
+    def getmessageentry(self, pos):
+        """Returns the entry for message pos, counting from 0 for the
+        oldest message."""
+        return None
+
+    def getmessagekeys(self):
+        """Returns a key for each message, oldest first, that stays the
+        same for as long as the message does.  Valid after
+        getmessagecount."""
+        return []
+
+    def openmessage(self, key):
+        """Returns a file with the message key, headers and body."""
+        return StringIO('')
+
     def prepare(self):
-        self.entries = []
-        count = 1
-        while 1:
-            message = self.mbox.next()
-            if not message:
-                break
-            handler = MessageHandler(self.genargsselector(self.getargflag() + \
-                                     str(count)), self.searchrequest,
-                                     self.protocol, self.config, None)
-            self.entries.append(handler.getentry(message))
-            count += 1
+        self.count = self.getmessagecount()
+        self.newestfirst = self.isnewestfirst()
+        if self.searching:
+            self.preparesearch()
+            return
+        pagesize = self.getpagesize()
+        if pagesize < 1:
+            # Everything on one page.
+            pagesize = max(self.count, 1)
+        self.pagecount = max((self.count + pagesize - 1) / pagesize, 1)
+        if self.page > self.pagecount:
+            raise GopherExceptions.FileNotFound, \
+                  [self.selector, "no such page", self.protocol]
+        self.first = (self.page - 1) * pagesize
+        self.last = min(self.first + pagesize, self.count)
+
+    def getsearchindex(self):
+        """Returns the search index of this folder, brought up to date
+        by reading just the messages it hasn't seen."""
+        bodies = 0
+        if self.config.has_option(self.section, "searchbodies"):
+            bodies = self.config.getboolean(self.section, "searchbodies")
+        return getmailindex(mailsearchindexes, MailSearchIndex, self.vfs,
+                            self.getselector(), self.getmessagekeys(),
+                            self.openmessage, bodies)
+
+    def preparesearch(self):
+        self.results = None
+        if not self.searchrequest:
+            return
+        positions = {}
+        keys = self.getmessagekeys()
+        for pos in range(len(keys)):
+            positions[keys[pos]] = pos
+        maxresults = 100
+        if self.config.has_option(self.section, "maxresults"):
+            maxresults = self.config.getint(self.section, "maxresults")
+        self.results = [positions[key] for key in \
+                        self.getsearchindex().search(self.searchrequest,
+                                                     maxresults) \
+                        if positions.has_key(key)]
+
+    def updatesearchindex(self):
+        try:
+            self.getsearchindex()
+        except (IOError, OSError), e:
+            GopherExceptions.log(e, self.protocol, self)
+
+    def pageentry(self, page, name):
+        selector = self.genargsselector('/PAGE/%d' % page)
+        entry = gopherentry.GopherEntry(selector, self.config)
+        entry.settype('1')
+        entry.setname(name)
+        entry.setmimetype('application/gopher-menu')
+        entry.setgopherpsupport(0)
+        return entry
+
+    def searchentry(self):
+        entry = gopherentry.GopherEntry(self.genargsselector('/SEARCH'),
+                                        self.config)
+        entry.settype('7')
+        entry.setname('Search this folder')
+        entry.setmimetype('application/gopher-menu')
+        entry.setgopherpsupport(0)
+        return entry
 
     def isdir(self):
         return 1
 
     def getdirlist(self):
-        return self.entries
+        """Generates the page, so that it can be sent as it is built."""
+        if self.searching:
+            for entry in self.getsearchlist():
+                yield entry
+            return
+        if self.issearchable():
+            yield self.searchentry()
+            # Index any new mail once this menu has been sent, so that
+            # searches find it already indexed.
+            base.deferuntilfinished(self.updatesearchindex)
+        if self.page > 1:
+            yield self.pageentry(self.page - 1, "Previous page (%d of %d)" % \
+                                 (self.page - 1, self.pagecount))
+        for i in range(self.first, self.last):
+            if self.newestfirst:
+                yield self.getmessageentry(self.count - 1 - i)
+            else:
+                yield self.getmessageentry(i)
+        if self.page < self.pagecount:
+            yield self.pageentry(self.page + 1, "Next page (%d of %d)" % \
+                                 (self.page + 1, self.pagecount))
+
+    def getsearchlist(self):
+        if self.results == None:
+            yield gopherentry.getinfoentry("Enter words to search for.",
+                                           self.config)
+        elif not self.results:
+            yield gopherentry.getinfoentry("Nothing matched %s." % \
+                                           self.searchrequest, self.config)
+        for pos in self.results or []:
+            yield self.getmessageentry(pos)
+
+def makemessageentry(selector, config, subject):
+    entry = gopherentry.GopherEntry(selector, config)
+    entry.settype('0')
+    entry.setmimetype('text/plain')
+    entry.setgopherpsupport(0)
+
+    # Sanitize, esp. for continuations.
+    subject = re.sub('\s+', ' ', subject or '').strip()
+    if subject:
+        entry.setname(subject)
+    else:
+        entry.setname('<no subject>')
+    return entry
 
 class MessageHandler(Virtual):
     def canhandlerequest(self):
@@ -74,67 +236,354 @@ class MessageHandler(Virtual):
         if not msgnum:
             return 0
         self.msgnum = int(msgnum.group(1))
-        self.message = None
         return 1
 
-    def getentry(self, message = None):
-        """Set the message if called from, eg, the dir handler.  Saves
-        having to rescan the file.  If not set, will figure it out."""
-        if not message:
-            message = self.getmessage()
-            
-        if not self.entry:
-            self.entry = gopherentry.GopherEntry(self.selector, self.config)
-            self.entry.settype('0')
-            self.entry.setmimetype('text/plain')
-            self.entry.setgopherpsupport(0)
-
-            subject = message.getheader('Subject', '<no subject>')
-            # Sanitize, esp. for continuations.
-            subject = re.sub('\s+', ' ', subject)
-            if subject:
-                self.entry.setname(subject)
-            else:
-                self.entry.setname('<no subject>')
+    def makeentry(self, subject):
+        self.entry = makemessageentry(self.selector, self.config, subject)
         return self.entry
 
-    def getmessage(self):
-        if self.message:
-            return self.message
-        mbox = self.openmailbox()
-        message = None
-        for x in range(self.msgnum):
-            message = mbox.next()
-        self.message = message
-        return self.message
-
     def prepare(self):
         self.canhandlerequest()         # Init the vars
 
-    def write(self, wfile):
-        # Print out the headers first.
-        for header in self.getmessage().headers:
-            wfile.write(header)
+###########################################################################
+# Unix MBOX support
+###########################################################################
+
+class MailIndex:
+    """Base class for the per-folder message indexes.  Subclasses set
+    cachekind and list the attributes to persist in cachedattrs.  The
+    index is saved beside the folder in .cache.pygopherd.<cachekind>.<name>,
+    which the directory handlers already hide."""
+
+    version = 1
+    cachekind = None
+    cachedattrs = []
+
+    def __init__(self, vfs, selector):
+        self.vfs = vfs
+        self.selector = selector
+        self.lock = threading.Lock()
+
+    def getcachename(self):
+        (dir, file) = os.path.split(self.selector)
+        return os.path.join(dir, '.cache.pygopherd.%s.%s' % \
+                            (self.cachekind, file))
+
+    def load(self):
+        cachename = self.getcachename()
+        if not self.vfs.iswritable(cachename):
+            return
+        try:
+            fd = self.vfs.open(cachename, 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] != self.version:
+                return
+            for attr in self.cachedattrs:
+                setattr(self, attr, data[attr])
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+
+    def save(self):
+        cachename = self.getcachename()
+        if not self.vfs.iswritable(cachename):
+            return
+        data = {'version': self.version}
+        for attr in self.cachedattrs:
+            data[attr] = getattr(self, attr)
+        tempname = base.gettempselector(cachename)
+        try:
+            fd = self.vfs.open(tempname, 'wb')
+            try:
+                marshal.dump(data, fd)
+            finally:
+                fd.close()
+            self.vfs.rename(tempname, cachename)
+        except (IOError, OSError):
+            try:
+                self.vfs.unlink(tempname)
+            except OSError:
+                pass
+
+# How many indexes of each kind are kept in memory.  Those that fall out
+# are loaded again from their cache files.
+maxmailindexes = 64
+mailindexeslock = threading.Lock()
+
+def getmailindex(cache, indexclass, vfs, selector, *args):
+    """Returns an up-to-date index of class indexclass for selector.
+    Indexes of folders on the real filesystem are kept in cache, an
+    OrderedDict, least recently used first, for reuse by later requests.
+    One is brought up to date by one thread at a time."""
+    if vfs.iswritable(selector):
+        mailindexeslock.acquire()
+        try:
+            index = cache.pop(selector, None)
+            if index == None:
+                index = indexclass(vfs, selector)
+            cache[selector] = index
+            while len(cache) > maxmailindexes:
+                cache.popitem(0)
+        finally:
+            mailindexeslock.release()
+        index.lock.acquire()
+        try:
+            index.vfs = vfs
+            apply(index.update, args)
+        finally:
+            index.lock.release()
+    else:
+        index = indexclass(vfs, selector)
+        apply(index.update, args)
+    return index
+
+class MailSearchIndex(MailIndex):
+    """Words of the Subject, From and Date headers of each message in a
+    folder, and optionally of its body, for searching.
+
+    self.words maps the key of each message to its words and their
+    weights.  Only messages with keys not seen before are read, so an
+    update costs as much as the new mail.  The words are searched through
+    an index file written beside the folder in
+    .cache.pygopherd.mailsearch.<name> whenever they change."""
+
+    cachekind = 'mailwords'
+    cachedattrs = ['words', 'bodies']
+    headerweights = [('subject', 10), ('from', 6), ('date', 2)]
+    bodyweight = 1
+    maxbodysize = 65536
+
+    def __init__(self, vfs, selector):
+        MailIndex.__init__(self, vfs, selector)
+        self.words = None
+        self.bodies = None
+        self.memoryindex = None
+
+    def getindexname(self):
+        (dir, file) = os.path.split(self.selector)
+        return os.path.join(dir, '.cache.pygopherd.mailsearch.' + file)
+
+    def update(self, keys, openmessage, bodies):
+        if self.words == None:
+            self.load()
+        if self.words == None or self.bodies != bodies:
+            self.words = {}
+            self.bodies = bodies
+        words = {}
+        for key in keys:
+            if self.words.has_key(key):
+                words[key] = self.words[key]
+            else:
+                fd = openmessage(key)
+                try:
+                    words[key] = self.readwords(fd)
+                finally:
+                    fd.close()
+        changed = len(words) != len(self.words) or \
+                  not self.vfs.exists(self.getindexname())
+        for key in words.keys():
+            if not self.words.has_key(key):
+                changed = 1
+        self.words = words
+        if changed:
+            self.memoryindex = None
+            self.save()
+            self.writeindex()
+
+    def readwords(self, fd):
+        message = rfc822.Message(fd)
+        words = {}
+        for header, weight in self.headerweights:
+            searchindex.addwords(words, message.getheader(header, ''), weight)
+        if self.bodies:
+            searchindex.addwords(words, fd.read(self.maxbodysize),
+                                 self.bodyweight)
+        return words
+
+    def writeindex(self):
+        indexname = self.getindexname()
+        if self.vfs.iswritable(indexname):
+            try:
+                searchindex.writeindex(self.vfs.getfspath(indexname),
+                                       self.getdocs())
+                return
+            except (IOError, OSError):
+                pass
+        self.memoryindex = searchindex.MemoryIndex(self.getdocs())
+
+    def getdocs(self):
+        docs = self.words.items()
+        # Equal matches then come oldest first.
+        docs.sort()
+        return docs
+
+    def search(self, query, maxresults = None):
+        """Returns the keys of the messages matching query, best first."""
+        index = self.memoryindex
+        if not index:
+            index = searchindex.getreader(
+                self.vfs.getfspath(self.getindexname()))
+        if not index:
+            self.writeindex()
+            index = self.memoryindex or searchindex.getreader(
+                self.vfs.getfspath(self.getindexname()))
+        return index.search(query, maxresults)
+
+mailsearchindexes = OrderedDict()
+
+class MBoxIndex(MailIndex):
+    """Byte-offset index of the messages in one mbox file.
+
+    self.messages holds a (fromoffset, start, end, subject) tuple for each
+    message.  fromoffset is where its From_ line begins; start:end is the
+    message itself, headers and body, without the From_ line.
+
+    The index is saved beside the mbox in .cache.pygopherd.mbox.<name> and
+    is valid while the size and mtime of the mbox match, unless it was
+    scanned in the second it was last changed.  If the mbox has only
+    grown, just the new data is scanned."""
+
+    version = 2
+    cachekind = 'mbox'
+    cachedattrs = ['size', 'mtime', 'scantime', 'messages']
+    fromre = re.compile(UnixMailbox._fromlinepattern)
+
+    def __init__(self, vfs, selector):
+        MailIndex.__init__(self, vfs, selector)
+        self.size = None
+        self.mtime = None
+        self.scantime = None
+        self.messages = []
+        self.scanstart = None           # Where the last scan began
+
+    def update(self, statval = None):
+        """Bring the index up to date with the mbox."""
+        if not statval:
+            statval = self.vfs.stat(self.selector)
+        size, mtime = statval[ST_SIZE], statval[ST_MTIME]
+        if self.mtime == None:
+            self.load()
+        # A change in the same second as the last scan would not show up
+        # in the mtime, and may not in the size, so such a scan is never
+        # trusted.
+        if size == self.size and mtime == self.mtime and \
+           self.scantime > mtime:
+            return
+        self.scantime = int(time.time())
+        self.scan(size)
+        self.size, self.mtime = size, mtime
+        self.save()
+
+    def isfromlineat(self, fd, offset):
+        fd.seek(offset)
+        return self.fromre.match(fd.readline())
 
-        # Now the message body.
-        self.rfile = self.getmessage().fp
+    def scan(self, size):
+        """Index the mbox.  If it has grown since the last scan and the
+        old messages are still where they were, rescan from the start of
+        the last known message only."""
+        fd = self.vfs.open(self.selector, 'rb')
+        start = 0
+        if self.messages and self.size != None and size > self.size and \
+           hasattr(fd, 'seek') and \
+           self.isfromlineat(fd, self.messages[0][0]) and \
+           self.isfromlineat(fd, self.messages[-1][0]):
+            # The last message may have been incomplete; redo it.
+            start = self.messages[-1][0]
+            messages = self.messages[:-1]
+            fd.seek(start)
+        else:
+            messages = []
+            if hasattr(fd, 'seek'):
+                fd.seek(0)
+        self.scanstart = start
+
+        pos = start
+        current = None
         while 1:
-            string = self.rfile.read(4096)
-            if not len(string):
+            line = fd.readline()
+            if not line:
                 break
-            wfile.write(string)
-        self.rfile.close()
-        self.rfile = None
+            if line[:5] == 'From ' and self.fromre.match(line):
+                if current:
+                    messages.append((current[0], current[1], pos,
+                                     current[2]))
+                current = [pos, pos + len(line), None]
+                inheaders = 1
+                header = None
+            elif current and inheaders:
+                if not line.strip():
+                    inheaders = 0
+                elif line[0] in ' \t':
+                    if header == 'subject':
+                        current[2] += ' ' + line.strip()
+                elif line.find(':') != -1:
+                    header, value = line.split(':', 1)
+                    header = header.strip().lower()
+                    if header == 'subject':
+                        current[2] = value.strip()
+                else:
+                    inheaders = 0
+            pos += len(line)
+        if current:
+            messages.append((current[0], current[1], pos, current[2]))
+        fd.close()
+        self.messages = messages
 
-###########################################################################
-# Unix MBOX support
-###########################################################################
+mboxindexes = OrderedDict()
+
+class MessageFile:
+    """A message in an open mbox, from start to end, read as a file of its
+    own without reading it all in."""
+
+    def __init__(self, fd, start, end):
+        self.fd = fd
+        self.remaining = end - start
+        if hasattr(fd, 'seek'):
+            fd.seek(start)
+        else:
+            while start > 0:
+                data = fd.read(min(4096, start))
+                if not len(data):
+                    break
+                start -= len(data)
+
+    def getsize(self, size):
+        if size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size = -1):
+        size = self.getsize(size)
+        if not size:
+            return ''
+        data = self.fd.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size = -1):
+        size = self.getsize(size)
+        if not size:
+            return ''
+        data = self.fd.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fd.close()
+
+def getmboxindex(vfs, selector, statval = None):
+    return getmailindex(mboxindexes, MBoxIndex, vfs, selector, statval)
 
 class MBoxFolderHandler(FolderHandler):
+    entrycacheable = 1
+
     def canhandlerequest(self):
         """Figure out if this is a handleable request."""
 
-        if self.selectorargs:
+        if not self.canhandlepage():
             return 0
         
         if not (self.statresult and S_ISREG(self.statresult[ST_MODE])):
@@ -148,10 +597,25 @@ class MBoxFolderHandler(FolderHandler):
         except IOError:
             return 0
 
-    def prepare(self):
-        self.rfile = self.vfs.open(self.getselector(), "rt")
-        self.mbox = UnixMailbox(self.rfile)
-        FolderHandler.prepare(self)
+    def getmessagecount(self):
+        self.index = getmboxindex(self.vfs, self.getselector(),
+                                  self.statresult)
+        return len(self.index.messages)
+
+    def getmessageentry(self, pos):
+        selector = self.genargsselector(self.getargflag() + str(pos + 1))
+        return makemessageentry(selector, self.config,
+                                self.index.messages[pos][3])
+
+    def getmessagekeys(self):
+        # Where each message starts and ends changes only when the mbox
+        # is rewritten.
+        return [(message[1], message[2]) for message in self.index.messages]
+
+    def openmessage(self, key):
+        start, end = key
+        return MessageFile(self.vfs.open(self.getselector(), 'rb'),
+                           start, end)
 
     def getargflag(self):
         return "/MBOX-MESSAGE/"
@@ -160,28 +624,150 @@ class MBoxMessageHandler(MessageHandler):
     def getargflag(self):
         return "/MBOX-MESSAGE/"
 
-    def openmailbox(self):
-        fd = self.vfs.open(self.getselector(), "rt")
-        return UnixMailbox(fd)
+    def getindexentry(self):
+        index = getmboxindex(self.vfs, self.getselector(), self.statresult)
+        if self.msgnum < 1 or self.msgnum > len(index.messages):
+            raise GopherExceptions.FileNotFound, \
+                  [self.selector, "no such message", self.protocol]
+        return index.messages[self.msgnum - 1]
+
+    def getentry(self, message = None):
+        if not self.entry:
+            self.makeentry(self.getindexentry()[3])
+        return self.entry
+
+    def write(self, wfile):
+        # The message is a contiguous range of the mbox; send it as-is.
+        fromoffset, start, end, subject = self.getindexentry()
+        self.vfs.copyrangeto(self.getselector(), wfile, start, end - start)
 
 ###########################################################################
 # Maildir support
 ###########################################################################
 
+class MaildirIndex(MailIndex):
+    """Index of the messages in one Maildir, keyed by the unique part of
+    each message's filename (the part before the ':'), which stays the
+    same when a message moves from new/ to cur/ or its flags change.
+
+    self.messages maps key to [subdir, filename, date, subject] and
+    self.keys holds the keys oldest first.  The date is the delivery time
+    that starts the filename.  Subjects are read from the message only
+    when first asked for, and then kept."""
+
+    cachekind = 'maildir'
+    cachedattrs = ['mtimes', 'scantime', 'messages', 'keys']
+    subdirs = ['new', 'cur']
+
+    def __init__(self, vfs, selector):
+        MailIndex.__init__(self, vfs, selector)
+        self.mtimes = None
+        self.scantime = None
+        self.messages = {}
+        self.keys = []
+        self.parsed = 0                 # Headers read since the last save
+
+    def getkey(self, filename):
+        return filename.split(':', 1)[0]
+
+    def update(self, force = 0):
+        """Bring the index up to date.  Unless force is set, the
+        directories are only listed when new/ or cur/ have changed."""
+        if self.mtimes == None:
+            self.load()
+        mtimes = [self.vfs.stat(self.selector + '/' + subdir)[ST_MTIME] \
+                  for subdir in self.subdirs]
+        # A change in the same second as the last scan would not show up
+        # in the mtimes, so such a scan is never trusted.
+        if not force and mtimes == self.mtimes and \
+           self.scantime > max(mtimes):
+            return
+        self.scantime = int(time.time())
+        messages = {}
+        for subdir in self.subdirs:
+            for filename in self.vfs.listdir(self.selector + '/' + subdir):
+                if filename.startswith('.'):
+                    continue
+                key = self.getkey(filename)
+                if self.messages.has_key(key):
+                    date, subject = self.messages[key][2:]
+                else:
+                    try:
+                        date = self.getdate(subdir, filename)
+                    except OSError:
+                        # Moved or deleted since the listing.
+                        continue
+                    subject = None
+                messages[key] = [subdir, filename, date, subject]
+        self.messages = messages
+        self.keys = messages.keys()
+        self.keys.sort(lambda a, b: cmp((messages[a][2], a),
+                                        (messages[b][2], b)))
+        self.mtimes = mtimes
+        self.save()
+
+    def getdate(self, subdir, filename):
+        # Delivery agents start the name with the delivery time.
+        date = filename.split('.', 1)[0]
+        if date.isdigit():
+            return int(date)
+        return self.vfs.stat(self.selector + '/' + subdir + '/' + \
+                             filename)[ST_MTIME]
+
+    def getsubject(self, key):
+        message = self.messages[key]
+        if message[3] == None:
+            fd = self.vfs.open(self.selector + '/' + message[0] + '/' + \
+                               message[1])
+            message[3] = rfc822.Message(fd).getheader('Subject', '')
+            fd.close()
+            self.parsed += 1
+        return message[3]
+
+    def flush(self):
+        """Saves any subjects read since the index was last saved."""
+        if self.parsed:
+            self.save()
+            self.parsed = 0
+
+maildirindexes = OrderedDict()
+
+def getmaildirindex(vfs, selector, force = 0):
+    return getmailindex(maildirindexes, MaildirIndex, vfs, selector, force)
+
 class MaildirFolderHandler(FolderHandler):
     def canhandlerequest(self):
         if not isinstance(self.vfs, VFS_Real):
             return 0
-        if self.selectorargs:
+        if not self.canhandlepage():
             return 0
         if not (self.statresult and S_ISDIR(self.statresult[ST_MODE])):
             return 0
         return self.vfs.isdir(self.getselector() + "/new") and \
                self.vfs.isdir(self.getselector() + "/cur")
 
-    def prepare(self):
-        self.mbox = Maildir(self.getfspath())
-        FolderHandler.prepare(self)
+    def getmessagecount(self):
+        self.index = getmaildirindex(self.vfs, self.getselector())
+        return len(self.index.keys)
+
+    def getmessageentry(self, pos):
+        key = self.index.keys[pos]
+        selector = self.genargsselector(self.getargflag() + key)
+        return makemessageentry(selector, self.config,
+                                self.index.getsubject(key))
+
+    def getmessagekeys(self):
+        return self.index.keys
+
+    def openmessage(self, key):
+        subdir, filename = self.index.messages[key][:2]
+        return self.vfs.open(self.getselector() + '/' + subdir + '/' + \
+                             filename)
+
+    def getdirlist(self):
+        for entry in FolderHandler.getdirlist(self):
+            yield entry
+        self.index.flush()
 
     def getargflag(self):
         return "/MAILDIR-MESSAGE/"
@@ -190,6 +776,48 @@ class MaildirMessageHandler(MessageHandler):
     def getargflag(self):
         return "/MAILDIR-MESSAGE/"
 
-    def openmailbox(self):
-        return Maildir(self.getfspath())
+    def canhandlerequest(self):
+        """Messages are named by their Maildir key rather than their
+        position, so a link stays valid as new mail arrives."""
+        if not self.selectorargs:
+            return 0
+        key = re.search('^' + self.getargflag() + '([^/:]+)$',
+                        self.selectorargs)
+        if not key:
+            return 0
+        self.key = key.group(1)
+        return 1
+
+    def getindexentry(self, force = 0):
+        self.index = getmaildirindex(self.vfs, self.getselector(), force)
+        if not self.index.messages.has_key(self.key):
+            raise GopherExceptions.FileNotFound, \
+                  [self.selector, "no such message", self.protocol]
+        return self.index.messages[self.key]
 
+    def getmessagepath(self, force = 0):
+        subdir, filename, date, subject = self.getindexentry(force)
+        return self.getselector() + '/' + subdir + '/' + filename
+
+    def getentry(self, message = None):
+        if not self.entry:
+            self.getindexentry()
+            self.makeentry(self.index.getsubject(self.key))
+            self.index.flush()
+        return self.entry
+
+    def prepare(self):
+        try:
+            self.rfile = self.vfs.open(self.getmessagepath())
+        except IOError:
+            # Moved to cur/ or re-flagged since the index was built.
+            self.rfile = self.vfs.open(self.getmessagepath(1))
+
+    def write(self, wfile):
+        while 1:
+            string = self.rfile.read(4096)
+            if not len(string):
+                break
+            wfile.write(string)
+        self.rfile.close()
+        self.rfile = None
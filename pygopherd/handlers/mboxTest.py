@@ -0,0 +1,335 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the mailbox handlers
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from StringIO import StringIO
+from pygopherd import testutil, GopherExceptions
+from pygopherd.handlers import base, mbox
+
+def makemessage(num, subject = None):
+    message = "From user%d@example.com Mon Jan  6 12:00:00 2003\n" % num
+    message += "From: user%d@example.com\n" % num
+    if subject != None:
+        message += "Subject: %s\n" % subject
+    message += "\nThis is message %d.\n\n" % num
+    return message
+
+class MBoxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.mbox.FolderHandler", "order", "oldest")
+        self.config.set("handlers.mbox.FolderHandler", "search", "no")
+        base.rootpath = self.root
+        mbox.mboxindexes.clear()
+        mbox.mailsearchindexes.clear()
+        self.messages = [makemessage(1, "First"),
+                         makemessage(2, "Second\n  continued"),
+                         makemessage(3)]
+        self.write(''.join(self.messages))
+
+    def tearDown(self):
+        base.rootpath = None
+        base.deferred.clear()
+        mbox.mboxindexes.clear()
+        mbox.mailsearchindexes.clear()
+        shutil.rmtree(self.root)
+
+    def write(self, data, mode = 'wb'):
+        fd = open(os.path.join(self.root, 'mbox'), mode)
+        fd.write(data)
+        fd.close()
+
+    def gethandler(self, selector, handlerclass):
+        handler = handlerclass(selector, '', None, self.config,
+                               os.stat(os.path.join(self.root, 'mbox')))
+        assert handler.canhandlerequest()
+        return handler
+
+    def getentries(self, selector = '/mbox'):
+        handler = self.gethandler(selector, mbox.MBoxFolderHandler)
+        handler.prepare()
+        return list(handler.getdirlist())
+
+    def getnames(self, selector = '/mbox'):
+        return [entry.getname() for entry in self.getentries(selector)]
+
+    def testfolder(self):
+        self.assertEquals(self.getnames(),
+                          ['First', 'Second continued', '<no subject>'])
+        self.assertEquals(self.getentries()[1].getselector(),
+                          '/mbox|/MBOX-MESSAGE/2')
+
+    def testpages(self):
+        self.config.set("handlers.mbox.FolderHandler", "pagesize", "2")
+        self.config.set("handlers.mbox.FolderHandler", "order", "newest")
+        entries = self.getentries()
+        self.assertEquals([entry.getname() for entry in entries],
+                          ['<no subject>', 'Second continued',
+                           'Next page (2 of 2)'])
+        self.assertEquals(entries[0].getselector(), '/mbox|/MBOX-MESSAGE/3')
+        self.assertEquals(entries[2].getselector(), '/mbox|/PAGE/2')
+        self.assertEquals(entries[2].gettype(), '1')
+        entries = self.getentries('/mbox|/PAGE/2')
+        self.assertEquals([entry.getname() for entry in entries],
+                          ['Previous page (1 of 2)', 'First'])
+        self.assertEquals(entries[0].getselector(), '/mbox|/PAGE/1')
+
+        handler = self.gethandler('/mbox|/PAGE/3', mbox.MBoxFolderHandler)
+        self.assertRaises(GopherExceptions.FileNotFound, handler.prepare)
+        handler = mbox.MBoxFolderHandler('/mbox|/PAGE/0', '', None,
+                                         self.config, None)
+        assert not handler.canhandlerequest()
+
+    def testmessage(self):
+        handler = self.gethandler('/mbox|/MBOX-MESSAGE/2',
+                                  mbox.MBoxMessageHandler)
+        handler.prepare()
+        self.assertEquals(handler.getentry().getname(), 'Second continued')
+        wfile = StringIO()
+        handler.write(wfile)
+        # Everything but the From_ line.
+        expected = self.messages[1][self.messages[1].index('\n') + 1:]
+        self.assertEquals(wfile.getvalue(), expected)
+
+    def testopenmessage(self):
+        handler = self.gethandler('/mbox', mbox.MBoxFolderHandler)
+        handler.prepare()
+        fd = handler.openmessage(handler.getmessagekeys()[1])
+        lines = self.messages[1].split('\n')
+        self.assertEquals(fd.readline(), lines[1] + '\n')
+        self.assertEquals(fd.read(), '\n'.join(lines[2:]))
+        # The next message isn't part of it.
+        self.assertEquals(fd.readline(), '')
+        fd.close()
+
+    def testnosuchmessage(self):
+        handler = self.gethandler('/mbox|/MBOX-MESSAGE/4',
+                                  mbox.MBoxMessageHandler)
+        self.assertRaises(GopherExceptions.FileNotFound, handler.getentry)
+
+    def testcache(self):
+        # Scanned well after it was written, so the index can be trusted.
+        when = time.time() - 60
+        os.utime(os.path.join(self.root, 'mbox'), (when, when))
+        self.getnames()
+        assert os.path.exists(os.path.join(self.root,
+                                           '.cache.pygopherd.mbox.mbox'))
+        # A fresh process loads the saved index instead of scanning.
+        mbox.mboxindexes.clear()
+        index = mbox.getmboxindex(base.VFS_Real(self.config), '/mbox')
+        self.assertEquals(index.scanstart, None)
+        self.assertEquals(len(index.messages), 3)
+
+    def testsamesecond(self):
+        # Changed in the second it was scanned, without changing size.
+        filename = os.path.join(self.root, 'mbox')
+        when = int(time.time()) + 10
+        os.utime(filename, (when, when))
+        self.getnames()
+        self.messages[0] = self.messages[0].replace('First', 'Frost')
+        self.write(''.join(self.messages))
+        os.utime(filename, (when, when))
+        self.assertEquals(self.getnames()[0], 'Frost')
+
+    def testbound(self):
+        mbox.maxmailindexes = 1
+        try:
+            self.getnames()
+            mbox.mboxindexes['/other'] = mbox.MBoxIndex(None, '/other')
+            self.getnames()
+            self.assertEquals(mbox.mboxindexes.keys(), ['/mbox'])
+        finally:
+            mbox.maxmailindexes = 64
+
+    def testappend(self):
+        self.getnames()
+        self.messages.append(makemessage(4, "Fourth"))
+        self.write(self.messages[-1], 'ab')
+        self.assertEquals(self.getnames(),
+                          ['First', 'Second continued', '<no subject>',
+                           'Fourth'])
+        index = mbox.mboxindexes['/mbox']
+        # Only the last known message was rescanned.
+        self.assertEquals(index.scanstart, len(''.join(self.messages[:2])))
+
+    def testrewrite(self):
+        self.getnames()
+        self.write(makemessage(5, "Replaced") + ''.join(self.messages))
+        self.assertEquals(self.getnames(),
+                          ['Replaced', 'First', 'Second continued',
+                           '<no subject>'])
+        self.assertEquals(mbox.mboxindexes['/mbox'].scanstart, 0)
+
+    def search(self, query):
+        handler = mbox.MBoxFolderHandler('/mbox|/SEARCH', query, None,
+                                         self.config,
+                                         os.stat(os.path.join(self.root,
+                                                              'mbox')))
+        assert handler.canhandlerequest()
+        self.assertEquals(handler.getentry().gettype(), '7')
+        realopen = handler.openmessage
+        def openmessage(key):
+            self.opened.append(key)
+            return realopen(key)
+        handler.openmessage = openmessage
+        handler.prepare()
+        return [entry.getname() for entry in handler.getdirlist()]
+
+    def testsearchoff(self):
+        # Searching, and indexing as menus are sent, is asked for.
+        self.config.remove_option("handlers.mbox.FolderHandler", "search")
+        self.assertEquals(self.getentries()[0].getname(), 'First')
+        self.assertEquals(base.deferred, {})
+
+    def testsearch(self):
+        self.config.set("handlers.mbox.FolderHandler", "search", "yes")
+        self.opened = []
+        entries = self.getentries()
+        self.assertEquals(entries[0].gettype(), '7')
+        self.assertEquals(entries[0].getselector(), '/mbox|/SEARCH')
+        # The folder is indexed once its menu has been sent.
+        base.finishrequest()
+        assert os.path.exists(os.path.join(self.root,
+                                           '.cache.pygopherd.mailsearch.mbox'))
+
+        self.assertEquals(self.search('second'), ['Second continued'])
+        self.assertEquals(self.search('USER1@example.com'), ['First'])
+        self.assertEquals(self.search('example'),
+                          ['First', 'Second continued', '<no subject>'])
+        self.assertEquals(self.search('message'), ['Nothing matched message.'])
+        self.assertEquals(self.search(''), ['Enter words to search for.'])
+        self.assertEquals(self.opened, [])
+
+        # New mail is indexed without reading the rest again.
+        self.messages.append(makemessage(4, "Fourth"))
+        self.write(self.messages[-1], 'ab')
+        self.assertEquals(self.search('fourth'), ['Fourth'])
+        self.assertEquals(len(self.opened), 1)
+
+    def testsearchbodies(self):
+        self.config.set("handlers.mbox.FolderHandler", "search", "yes")
+        self.config.set("handlers.mbox.FolderHandler", "searchbodies", "yes")
+        self.opened = []
+        self.assertEquals(self.search('message'),
+                          ['First', 'Second continued', '<no subject>'])
+
+class MaildirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.mbox.FolderHandler", "order", "oldest")
+        self.config.set("handlers.mbox.FolderHandler", "search", "no")
+        base.rootpath = self.root
+        mbox.maildirindexes.clear()
+        mbox.mailsearchindexes.clear()
+        self.maildir = os.path.join(self.root, 'Maildir')
+        for subdir in ['new', 'cur', 'tmp']:
+            os.makedirs(os.path.join(self.maildir, subdir))
+        self.deliver('1041854400.M1P1.host', 'cur', ':2,S',
+                     "Subject: Older\nDate: Mon, 6 Jan 2003 12:00:00 +0000\n")
+        self.deliver('1041940800.M2P2.host', 'new', '',
+                     "Subject: Newer\nDate: Tue, 7 Jan 2003 12:00:00 +0000\n")
+
+    def tearDown(self):
+        base.rootpath = None
+        base.deferred.clear()
+        mbox.maildirindexes.clear()
+        mbox.mailsearchindexes.clear()
+        shutil.rmtree(self.root)
+
+    def deliver(self, key, subdir, flags, headers):
+        fd = open(os.path.join(self.maildir, subdir, key + flags), 'wb')
+        fd.write(headers + "\nBody of %s\n" % key)
+        fd.close()
+
+    def getindex(self, force = 0):
+        return mbox.getmaildirindex(base.VFS_Real(self.config), '/Maildir',
+                                    force)
+
+    def testfolder(self):
+        handler = mbox.MaildirFolderHandler('/Maildir', '', None, self.config,
+                                            os.stat(self.maildir))
+        assert handler.canhandlerequest()
+        handler.prepare()
+        entries = list(handler.getdirlist())
+        self.assertEquals([entry.getname() for entry in entries],
+                          ['Older', 'Newer'])
+        self.assertEquals(entries[0].getselector(),
+                          '/Maildir|/MAILDIR-MESSAGE/1041854400.M1P1.host')
+
+    def testmessage(self):
+        self.getindex()
+        # Moving the message to cur/ must not change its selector.
+        os.rename(os.path.join(self.maildir, 'new', '1041940800.M2P2.host'),
+                  os.path.join(self.maildir, 'cur',
+                               '1041940800.M2P2.host:2,S'))
+        handler = mbox.MaildirMessageHandler( \
+            '/Maildir|/MAILDIR-MESSAGE/1041940800.M2P2.host', '', None,
+            self.config, None)
+        assert handler.canhandlerequest()
+        handler.prepare()
+        self.assertEquals(handler.getentry().getname(), 'Newer')
+        wfile = StringIO()
+        handler.write(wfile)
+        assert wfile.getvalue().endswith("\nBody of 1041940800.M2P2.host\n")
+
+        handler = mbox.MaildirMessageHandler( \
+            '/Maildir|/MAILDIR-MESSAGE/1.nosuch', '', None, self.config, None)
+        assert handler.canhandlerequest()
+        self.assertRaises(GopherExceptions.FileNotFound, handler.prepare)
+
+    def testincremental(self):
+        index = self.getindex()
+        self.assertEquals(len(index.keys), 2)
+        self.deliver('1041945000.M3P3.host', 'new', '', "Subject: Third\n")
+        index = self.getindex(1)
+        self.assertEquals(index.keys[-1], '1041945000.M3P3.host')
+        self.assertEquals(index.messages['1041854400.M1P1.host'][3], None)
+
+    def testsearch(self):
+        self.config.set("handlers.mbox.FolderHandler", "search", "yes")
+        handler = mbox.MaildirFolderHandler('/Maildir|/SEARCH', 'jan older',
+                                            None, self.config,
+                                            os.stat(self.maildir))
+        assert handler.canhandlerequest()
+        handler.prepare()
+        entries = list(handler.getdirlist())
+        self.assertEquals([entry.getname() for entry in entries], ['Older'])
+        self.assertEquals(entries[0].getselector(),
+                          '/Maildir|/MAILDIR-MESSAGE/1041854400.M1P1.host')
+
+    def testlazysubjects(self):
+        self.config.set("handlers.mbox.FolderHandler", "pagesize", "1")
+        self.config.set("handlers.mbox.FolderHandler", "order", "newest")
+        handler = mbox.MaildirFolderHandler('/Maildir', '', None, self.config,
+                                            os.stat(self.maildir))
+        assert handler.canhandlerequest()
+        handler.prepare()
+        self.assertEquals([entry.getname() for entry in handler.getdirlist()],
+                          ['Newer', 'Next page (2 of 2)'])
+        # Only the message on the page was read, and that was saved.
+        mbox.maildirindexes.clear()
+        index = self.getindex()
+        self.assertEquals(index.messages['1041940800.M2P2.host'][3], 'Newer')
+        self.assertEquals(index.messages['1041854400.M1P1.host'][3], None)
@@ -1,8 +1,254 @@
-from pygopherd import protocols, gopherentry
+from pygopherd import protocols, gopherentry, logger, privatedir
+from pygopherd.handlers import base, responsecache
 from pygopherd.handlers.base import BaseHandler, VFS_Real
 from pygopherd.handlers.virtual import Virtual
 from stat import *
-import imp, re
+import imp, re, os, time, marshal, urllib
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+# Loaded PYG modules, by filesystem path: (mtime, size, loadtime, pid,
+# module), pid being the process that loaded it.  A module is loaded
+# once and then reused, with whatever state it keeps, until its source
+# changes.
+pygmodules = {}
+# Held while a module is looked up or loaded, so that two threads don't
+# both load it and run its pygstartup.
+pygmoduleslock = threading.RLock()
+bytecodedir = None
+
+def getbytecodename(config, fspath):
+    """Returns where to keep the compiled code for the PYG file fspath:
+    in the configured bytecodedir, or beside the file.  Returns None if
+    it isn't to be kept, because the bytecodedir isn't private to the
+    server and others could plant code there."""
+    global bytecodedir
+    if bytecodedir == None:
+        bytecodedir = ''
+        if config.has_option("handlers.pyg.PYGHandler", "bytecodedir"):
+            bytecodedir = config.get("handlers.pyg.PYGHandler", "bytecodedir")
+            try:
+                privatedir.makeprivatedir(bytecodedir)
+            except OSError, e:
+                logger.log("Not keeping PYG bytecode: %s" % e[1])
+                bytecodedir = 0
+    if bytecodedir == 0:
+        return None
+    if bytecodedir:
+        return os.path.join(bytecodedir, urllib.quote(fspath, ''))
+    (dir, file) = os.path.split(fspath)
+    return os.path.join(dir, '.cache.pygopherd.pyg.' + file)
+
+def loadbytecode(filename, key):
+    """Returns the code saved in filename if it was compiled, by this
+    version of Python, from a source with key (mtime, size); else None.
+    The code is run, so it is only trusted from a regular file that the
+    server wrote and no one else can change."""
+    if filename == None:
+        return None
+    try:
+        fd = os.fdopen(os.open(filename, os.O_RDONLY | \
+                               getattr(os, 'O_NOFOLLOW', 0)), 'rb')
+    except OSError:
+        return None
+    try:
+        statval = os.fstat(fd.fileno())
+        if not S_ISREG(statval[ST_MODE]) or \
+           statval[ST_UID] != os.getuid() or \
+           S_IMODE(statval[ST_MODE]) & 022:
+            return None
+        data = marshal.load(fd)
+        if data['magic'] == imp.get_magic() and data['key'] == key:
+            return data['code']
+    except (IOError, EOFError, ValueError, TypeError, KeyError):
+        pass
+    finally:
+        fd.close()
+    return None
+
+def savebytecode(filename, key, code):
+    if filename == None:
+        return
+    # Write and rename, so other processes never read half a file.
+    tempname = base.gettempselector(filename)
+    try:
+        fd = privatedir.createexclusive(tempname, 0644)
+        try:
+            marshal.dump({'magic': imp.get_magic(), 'key': key,
+                          'code': code}, fd)
+        finally:
+            fd.close()
+        os.rename(tempname, filename)
+    except (IOError, OSError):
+        try:
+            os.unlink(tempname)
+        except OSError:
+            pass
+
+def getpygmodule(vfs, selector, fspath, statresult, config):
+    """Returns the module for the PYG file at selector.  It is compiled
+    and run only if it is new or has changed since it was last loaded."""
+    pygmoduleslock.acquire()
+    try:
+        return loadpygmodule(vfs, selector, fspath, statresult, config)
+    finally:
+        pygmoduleslock.release()
+
+def loadpygmodule(vfs, selector, fspath, statresult, config):
+    key = (statresult[ST_MTIME], statresult[ST_SIZE])
+    if pygmodules.has_key(fspath):
+        mtime, size, loadtime, pid, module = pygmodules[fspath]
+        # A change in the second it was loaded may not show in the mtime.
+        if (mtime, size) == key and mtime < loadtime:
+            return module
+
+    loadtime = int(time.time())
+    bytecodename = getbytecodename(config, fspath)
+    code = loadbytecode(bytecodename, key)
+    if code == None:
+        fd = vfs.open(selector, "rt")
+        try:
+            source = fd.read()
+        finally:
+            fd.close()
+        code = compile(source, fspath, 'exec')
+        if key[0] < loadtime:
+            savebytecode(bytecodename, key, code)
+
+    if pygmodules.has_key(fspath):
+        stoppygmodule(fspath, pygmodules[fspath][3], pygmodules[fspath][4])
+        del pygmodules[fspath]
+    module = imp.new_module('PYGHandler')
+    module.__file__ = fspath
+    exec code in module.__dict__
+    pygclass = getattr(module, 'PYGMain', None)
+    if hasattr(pygclass, 'pygstartup'):
+        pygclass.pygstartup(config)
+    base.addworkerfinisher(stoppygmodules)
+    pygmodules[fspath] = (key[0], key[1], loadtime, os.getpid(), module)
+    return module
+
+def stoppygmodule(fspath, pid, module):
+    """Runs the shutdown hook of a PYG module that is being dropped, if
+    this process started it, and empties its pools.  A child of a forking
+    server leaves those its parent started alone."""
+    try:
+        pygclass = getattr(module, 'PYGMain', None)
+        if pid == os.getpid() and hasattr(pygclass, 'pygshutdown'):
+            pygclass.pygshutdown()
+    finally:
+        for key in pools.keys():
+            if key[0] == fspath:
+                pools[key].clear()
+                del pools[key]
+
+def stoppygmodules():
+    for fspath, (mtime, size, loadtime, pid, module) in pygmodules.items():
+        stoppygmodule(fspath, pid, module)
+    pygmodules.clear()
+
+def preload(config):
+    """Loads, and starts, the PYG files named by the preload option.
+    Called in the server process before it serves, so that under the
+    forking server each request's process has them from the start,
+    rather than loading and starting them afresh."""
+    section = "handlers.pyg.PYGHandler"
+    if not config.has_option(section, "preload"):
+        return
+    vfs = VFS_Real(config)
+    for selector in config.get(section, "preload").split():
+        try:
+            getpygmodule(vfs, selector, vfs.getfspath(selector),
+                         vfs.stat(selector), config)
+        except Exception, e:
+            logger.log("Couldn't preload PYG file %s: %s" % (selector, e))
+
+###########################################################################
+# Resource pools
+# PYG modules stay loaded between requests, so they can keep connections
+# to the servers they use instead of making a new one every time.
+###########################################################################
+
+class ResourcePool:
+    """Keeps idle resources, such as connections, for reuse.
+
+    create() makes a new resource.  check(resource), if given, returns
+    true if an idle resource still works.  destroy(resource), if given,
+    releases one that won't be used again.  Resources idle for more than
+    maxidle seconds are destroyed instead of reused; at most maxsize are
+    kept.
+
+    Pools belong to one process.  A child that inherits a pool from its
+    parent starts with an empty one, leaving the parent's resources
+    alone."""
+
+    def __init__(self, create, check = None, destroy = None, maxidle = 60,
+                 maxsize = 4):
+        self.create = create
+        self.check = check
+        self.destroy = destroy
+        self.maxidle = maxidle
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = []                  # (time returned, resource)
+
+    def takeidle(self):
+        self.lock.acquire()
+        try:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.idle = []
+            if self.idle:
+                return self.idle.pop()
+            return None
+        finally:
+            self.lock.release()
+
+    def get(self):
+        """Returns an idle resource that passes the check, or a new one."""
+        while 1:
+            idle = self.takeidle()
+            if idle == None:
+                return self.create()
+            returned, resource = idle
+            if time.time() - returned <= self.maxidle and \
+               (not self.check or self.check(resource)):
+                return resource
+            self.discard(resource)
+
+    def put(self, resource):
+        """Gives back a resource that is in good order."""
+        self.lock.acquire()
+        try:
+            if self.pid == os.getpid() and len(self.idle) < self.maxsize:
+                self.idle.append((time.time(), resource))
+                return
+        finally:
+            self.lock.release()
+        self.discard(resource)
+
+    def discard(self, resource):
+        """Destroys a resource that won't be used again."""
+        if self.destroy:
+            try:
+                self.destroy(resource)
+            except:
+                pass
+
+    def clear(self):
+        """Destroys all the idle resources."""
+        while 1:
+            idle = self.takeidle()
+            if idle == None:
+                return
+            self.discard(idle[1])
+
+# Pools, by (path of the PYG file, name).
+pools = {}
+poolslock = threading.Lock()
 
 class PYGHandler(Virtual):
     def canhandlerequest(self):
@@ -12,19 +258,24 @@ class PYGHandler(Virtual):
                (S_IMODE(self.statresult[ST_MODE]) & S_IXOTH) and \
                re.search("\.pyg$", self.getselector())):
             return 0
-        self.modfd = self.vfs.open(self.getselector(), "rt")
-        self.module = imp.load_module('PYGHandler',
-                                      self.modfd,
-                                      self.getfspath(),
-                                      ('', '', imp.PY_SOURCE))
+        self.module = getpygmodule(self.vfs, self.getselector(),
+                                   self.getfspath(), self.statresult,
+                                   self.config)
         self.pygclass = self.module.PYGMain
         self.pygobject = self.pygclass(self.selector, self.searchrequest,
                                        self.protocol,
                                        self.config, self.statresult)
         return self.pygobject.isrequestforme()
-        
+
+    def gethandler(self):
+        return responsecache.wrap(self)
+
     def prepare(self):
-        return self.pygobject.prepare()
+        try:
+            return self.pygobject.prepare()
+        except:
+            self.releaseresources(0)
+            raise
 
     def getentry(self):
         return self.pygobject.getentry()
@@ -32,11 +283,86 @@ class PYGHandler(Virtual):
     def isdir(self):
         return self.pygobject.isdir()
 
+    def releaseresources(self, reuse = 1):
+        if hasattr(self.pygobject, 'releaseresources'):
+            self.pygobject.releaseresources(reuse)
+
     def getdirlist(self):
-        return self.pygobject.getdirlist()
+        try:
+            retval = self.pygobject.getdirlist()
+        except:
+            self.releaseresources(0)
+            raise
+        self.releaseresources()
+        return retval
 
     def write(self, wfile):
-        self.pygobject.write(wfile)
+        try:
+            self.pygobject.write(wfile)
+        except:
+            self.releaseresources(0)
+            raise
+        self.releaseresources()
 
 class PYGBase(Virtual):
-    pass
+    """Base class for the PYGMain class of PYG applications.
+
+    The module of a PYG file is loaded once per server process and kept
+    until the file changes.  PYGMain may override the pygstartup and
+    pygshutdown class methods, which are called when the module is loaded
+    and when it is dropped or the process is done serving.  Under the
+    forking server, that process is the one forked for the request,
+    unless the file is listed in the preload option.
+
+    Applications get long-lived resources with getresource().  Each is
+    taken from a pool kept with the module, and given back once the
+    response is written -- or, for menus, once getdirlist returns."""
+
+    def pygstartup(klass, config):
+        """Called after the module is loaded in this process, before its
+        first request."""
+        pass
+    pygstartup = classmethod(pygstartup)
+
+    def pygshutdown(klass):
+        """Called when the module is dropped: its source has changed, or
+        this process is done serving requests.  Its pools are emptied
+        afterwards."""
+        pass
+    pygshutdown = classmethod(pygshutdown)
+
+    def getpool(self, name, create, check = None, destroy = None,
+                maxidle = 60, maxsize = 4):
+        """Returns this application's ResourcePool called name, making it
+        with the given arguments if it doesn't exist yet."""
+        key = (self.getfspath(), name)
+        poolslock.acquire()
+        try:
+            if not pools.has_key(key):
+                pools[key] = ResourcePool(create, check, destroy, maxidle,
+                                          maxsize)
+            return pools[key]
+        finally:
+            poolslock.release()
+
+    def getresource(self, name, create, check = None, destroy = None,
+                    maxidle = 60, maxsize = 4):
+        """Gets a resource from the pool called name (see getpool) for the
+        rest of this request."""
+        pool = self.getpool(name, create, check, destroy, maxidle, maxsize)
+        resource = pool.get()
+        if not hasattr(self, 'resources'):
+            self.resources = []
+        self.resources.append((pool, resource))
+        return resource
+
+    def releaseresources(self, reuse = 1):
+        """Gives back the resources from getresource.  With reuse false,
+        after an error, they are destroyed instead."""
+        resources = getattr(self, 'resources', [])
+        self.resources = []
+        for pool, resource in resources:
+            if reuse:
+                pool.put(resource)
+            else:
+                pool.discard(resource)
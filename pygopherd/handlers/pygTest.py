@@ -0,0 +1,276 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the PYG handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from StringIO import StringIO
+from pygopherd import testutil, initialization
+from pygopherd.handlers import base, pyg
+
+pygsource = """
+from pygopherd.handlers.pyg import PYGBase
+from pygopherd.gopherentry import GopherEntry
+
+loads = []
+loads.append(1)
+
+class PYGMain(PYGBase):
+    def canhandlerequest(self):
+        return 1
+
+    def getentry(self):
+        entry = GopherEntry(self.selector, self.config)
+        entry.type = '0'
+        entry.name = '%s, load %%d'
+        return entry
+"""
+
+poolsource = """# Version %s
+from pygopherd.handlers.pyg import PYGBase
+from pygopherd.gopherentry import GopherEntry
+
+events = []
+made = []
+
+def makeconnection():
+    made.append(len(made) + 1)
+    return made[-1]
+
+class PYGMain(PYGBase):
+    def pygstartup(klass, config):
+        events.append('startup')
+    pygstartup = classmethod(pygstartup)
+
+    def pygshutdown(klass):
+        events.append('shutdown')
+    pygshutdown = classmethod(pygshutdown)
+
+    def canhandlerequest(self):
+        return 1
+
+    def prepare(self):
+        self.conn = self.getresource('conn', makeconnection,
+                                     destroy = events.append)
+
+    def write(self, wfile):
+        if self.searchrequest == 'fail':
+            raise IOError, "client went away"
+        wfile.write("connection %%d" %% self.conn)
+"""
+
+class PYGHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        base.rootpath = self.root
+        pyg.pygmodules.clear()
+        pyg.bytecodedir = None
+        self.write('First')
+        self.opens = []
+
+    def tearDown(self):
+        base.rootpath = None
+        pyg.pygmodules.clear()
+        pyg.bytecodedir = None
+        shutil.rmtree(self.root)
+
+    def write(self, name, age = 60, source = pygsource):
+        filename = os.path.join(self.root, 'app.pyg')
+        fd = open(filename, 'w')
+        fd.write(source % name)
+        fd.close()
+        os.chmod(filename, 0755)
+        # Old enough for the loaded module to be trusted.
+        when = time.time() - age
+        os.utime(filename, (when, when))
+
+    def gethandler(self, searchrequest = ''):
+        vfs = base.VFS_Real(self.config)
+        realopen = vfs.open
+        def open(selector, *args):
+            self.opens.append(selector)
+            return realopen(selector, *args)
+        vfs.open = open
+        handler = pyg.PYGHandler('/app.pyg|args', searchrequest, None,
+                                 self.config, None, vfs)
+        assert handler.canhandlerequest()
+        return handler
+
+    def getname(self):
+        handler = self.gethandler()
+        return handler.getentry().getname() % len(handler.module.loads)
+
+    def testreuse(self):
+        self.assertEquals(self.getname(), 'First, load 1')
+        # The module, and its state, stays loaded.
+        self.assertEquals(self.getname(), 'First, load 1')
+        self.assertEquals(self.opens, ['/app.pyg'])
+
+        # Another process uses the saved code.
+        assert os.path.exists(os.path.join(self.root,
+                                           '.cache.pygopherd.pyg.app.pyg'))
+        pyg.pygmodules.clear()
+        self.opens = []
+        self.assertEquals(self.getname(), 'First, load 1')
+        self.assertEquals(self.opens, [])
+
+    def testchange(self):
+        self.getname()
+        self.write('Second', 30)
+        self.assertEquals(self.getname(), 'Second, load 1')
+        self.assertEquals(self.opens, ['/app.pyg', '/app.pyg'])
+
+    def testbytecodedir(self):
+        bytecodedir = os.path.join(self.root, 'bytecode')
+        os.mkdir(bytecodedir, 0700)
+        self.config.set("handlers.pyg.PYGHandler", "bytecodedir", bytecodedir)
+        self.getname()
+        self.assertEquals(len(os.listdir(bytecodedir)), 1)
+        assert not os.path.exists(os.path.join(self.root,
+                                               '.cache.pygopherd.pyg.app.pyg'))
+
+    def testuntrusted(self):
+        # Code others could have written is never run.
+        self.getname()
+        bytecodename = os.path.join(self.root, '.cache.pygopherd.pyg.app.pyg')
+        os.chmod(bytecodename, 0666)
+        pyg.pygmodules.clear()
+        self.opens = []
+        self.getname()
+        self.assertEquals(self.opens, ['/app.pyg'])
+
+        # Nor is a bytecodedir others could write to used.
+        self.config.set("logger", "logmethod", "none")
+        initialization.initlogger(self.config, 'TESTING')
+        bytecodedir = os.path.join(self.root, 'bytecode')
+        os.mkdir(bytecodedir)
+        os.chmod(bytecodedir, 0777)
+        self.config.set("handlers.pyg.PYGHandler", "bytecodedir", bytecodedir)
+        pyg.pygmodules.clear()
+        pyg.bytecodedir = None
+        self.getname()
+        self.assertEquals(os.listdir(bytecodedir), [])
+
+    def getoutput(self, searchrequest = ''):
+        handler = self.gethandler(searchrequest)
+        handler.prepare()
+        wfile = StringIO()
+        handler.write(wfile)
+        return (handler.module, wfile.getvalue())
+
+    def testlifecycle(self):
+        self.write('1', source = poolsource)
+        module, output = self.getoutput()
+        self.assertEquals(output, 'connection 1')
+        module, output = self.getoutput()
+        self.assertEquals(output, 'connection 1')
+        self.assertEquals(module.events, ['startup'])
+
+        # A new version of the module shuts down the old one.
+        self.write('2.0', 30, source = poolsource)
+        newmodule, output = self.getoutput()
+        self.assertEquals(module.events, ['startup', 'shutdown', 1])
+        self.assertEquals(newmodule.events, ['startup'])
+        self.assertEquals(output, 'connection 1')
+
+        base.finishworker()
+        self.assertEquals(newmodule.events, ['startup', 'shutdown', 1])
+        self.assertEquals(pyg.pygmodules, {})
+        self.assertEquals(pyg.pools, {})
+
+    def testfailure(self):
+        # A resource used by a request that failed isn't reused.
+        self.write('1', source = poolsource)
+        self.assertRaises(IOError, self.getoutput, 'fail')
+        module, output = self.getoutput()
+        self.assertEquals(output, 'connection 2')
+        self.assertEquals(module.events, ['startup', 1])
+        base.finishworker()
+
+    def testpreload(self):
+        self.write('1', source = poolsource)
+        self.config.set("logger", "logmethod", "none")
+        initialization.initlogger(self.config, 'TESTING')
+        self.config.set("handlers.pyg.PYGHandler", "preload",
+                        "/app.pyg /missing.pyg")
+        pyg.preload(self.config)
+        module, output = self.getoutput()
+        self.assertEquals(module.events, ['startup'])
+        # A child of a forking server leaves the parent's module be.
+        fspath = os.path.join(self.root, 'app.pyg')
+        mtime, size, loadtime, pid, module = pyg.pygmodules[fspath]
+        pyg.pygmodules[fspath] = (mtime, size, loadtime, pid + 1, module)
+        base.finishworker()
+        self.assertEquals(module.events, ['startup', 1])
+        self.assertEquals(pyg.pygmodules, {})
+
+class ResourcePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.made = 0
+        self.destroyed = []
+        self.broken = {}
+
+    def create(self):
+        self.made += 1
+        return self.made
+
+    def check(self, resource):
+        return not self.broken.has_key(resource)
+
+    def getpool(self, **kwargs):
+        return apply(pyg.ResourcePool, (self.create, self.check,
+                                        self.destroyed.append), kwargs)
+
+    def testreuse(self):
+        pool = self.getpool(maxsize = 2)
+        first, second, third = pool.get(), pool.get(), pool.get()
+        self.assertEquals((first, second, third), (1, 2, 3))
+        for resource in (first, second, third):
+            pool.put(resource)
+        self.assertEquals(self.destroyed, [3])
+        self.assertEquals(pool.get(), 2)
+        self.broken[1] = 1
+        self.assertEquals(pool.get(), 4)
+        self.assertEquals(self.destroyed, [3, 1])
+
+    def testmaxidle(self):
+        pool = self.getpool(maxidle = 60)
+        pool.put(pool.get())
+        pool.idle[0] = (time.time() - 61, pool.idle[0][1])
+        self.assertEquals(pool.get(), 2)
+        self.assertEquals(self.destroyed, [1])
+
+    def testfork(self):
+        pool = self.getpool()
+        pool.put(pool.get())
+        # As if this were a child process.
+        pool.pid = -1
+        self.assertEquals(pool.get(), 2)
+        self.assertEquals(self.destroyed, [])
+
+    def testclear(self):
+        pool = self.getpool()
+        first, second = pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+        pool.clear()
+        self.assertEquals(self.destroyed, [2, 1])
+        self.assertEquals(pool.get(), 3)
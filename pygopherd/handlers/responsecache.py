@@ -0,0 +1,346 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: response cache for dynamic handlers
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Keeps the output of scripts and PYG applications for a while, so that
+requests for the same selector and search can be answered without running
+them again.
+
+Caching is opt-in.  A response is kept for ttl seconds, and for stale
+seconds after that it is still sent to clients while one request runs the
+handler again, after its own client has been answered, to refresh it.
+Responses are kept on disk, so that all the processes of a forking server
+share them."""
+
+from pygopherd import GopherExceptions, gopherentry, logger, privatedir
+from pygopherd.handlers import base
+from pygopherd.handlers.base import BaseHandler
+from StringIO import StringIO
+import os, sys, re, time, types, marshal, hashlib, errno, tempfile
+
+section = "handlers.responsecache"
+version = 1
+
+patterns = None
+cachedir = None
+maxresponsesize = None
+maxsize = None
+# Whether cachedir has been found fit to use, once checked.
+cachedirok = None
+
+# Seconds after which a refresh is taken to have died with its process.
+refreshlocktime = 300
+
+def loadconfig(config):
+    global patterns, cachedir, maxresponsesize, maxsize, cachedirok
+    if patterns != None:
+        return
+    patterns = []
+    cachedirok = None
+    if config.has_option(section, "patterns"):
+        for pattern, policy in eval(config.get(section, "patterns")).items():
+            if type(policy) == types.IntType:
+                policy = (policy, 0)
+            patterns.append((re.compile(pattern), tuple(policy)))
+    cachedir = os.path.join(tempfile.gettempdir(),
+                            'pygopherd-responses-%d' % os.getuid())
+    if config.has_option(section, "cachedir"):
+        cachedir = config.get(section, "cachedir")
+    maxresponsesize = 262144
+    if config.has_option(section, "maxresponsesize"):
+        maxresponsesize = config.getint(section, "maxresponsesize")
+    maxsize = 16777216
+    if config.has_option(section, "maxsize"):
+        maxsize = config.getint(section, "maxsize")
+
+def readdeclaration(vfs, selector):
+    """Reads the declaration file selector, with lines like ttl = 60 and
+    stale = 300, and returns (ttl, stale); None if there is no such file
+    or it names no ttl."""
+    try:
+        fd = vfs.open(selector, 'rt')
+    except IOError:
+        return None
+    try:
+        lines = fd.readlines()
+    finally:
+        fd.close()
+    policy = {'ttl': None, 'stale': 0}
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == '#' or line.find('=') == -1:
+            continue
+        name, value = [x.strip() for x in line.split('=', 1)]
+        if policy.has_key(name.lower()):
+            try:
+                policy[name.lower()] = int(value)
+            except ValueError:
+                return None
+    if policy['ttl'] == None:
+        return None
+    return (policy['ttl'], policy['stale'])
+
+def getpolicy(handler):
+    """Returns (ttl, stale) for responses of handler, or None if they
+    are not to be cached."""
+    loadconfig(handler.config)
+    selector = handler.getselector()
+    for pattern, policy in patterns:
+        if pattern.search(selector):
+            return policy
+    return readdeclaration(handler.vfs, selector + '.responsecache')
+
+def wrap(handler):
+    """Returns a handler that answers from the cache for handler, if its
+    responses are to be cached; else handler itself."""
+    policy = getpolicy(handler)
+    if not policy or policy[0] <= 0 or not checkcachedir():
+        return handler
+    return CachingHandler(handler, policy[0], policy[1])
+
+def checkcachedir():
+    """Returns true if cachedir is private to the server, making it if
+    need be.  Responses are sent from it as they are, so one that others
+    can write to must not be used."""
+    global cachedirok
+    if cachedirok == None:
+        try:
+            privatedir.makeprivatedir(cachedir)
+            cachedirok = 1
+        except OSError, e:
+            logger.log("Not caching responses: %s" % e[1])
+            cachedirok = 0
+    return cachedirok
+
+def getcachename(selector, searchrequest):
+    key = selector + '\t' + (searchrequest or '')
+    return os.path.join(cachedir, hashlib.md5(key).hexdigest())
+
+def loadresponse(filename, selector, searchrequest):
+    try:
+        fd = open(filename, 'rb')
+        try:
+            data = marshal.load(fd)
+        finally:
+            fd.close()
+        if data['version'] == version and data['selector'] == selector and \
+           data['searchrequest'] == searchrequest:
+            return data
+    except (IOError, EOFError, ValueError, TypeError, KeyError):
+        pass
+    return None
+
+def saveresponse(filename, data):
+    # Write and rename, so other processes never read half a file.
+    tempname = filename + '.%d' % os.getpid()
+    try:
+        fd = privatedir.createexclusive(tempname)
+        try:
+            fd.write(data)
+        finally:
+            fd.close()
+        os.rename(tempname, filename)
+    except (IOError, OSError):
+        try:
+            os.unlink(tempname)
+        except OSError:
+            pass
+        return
+    trim()
+
+def trim():
+    """Removes the oldest responses until those left fit in maxsize."""
+    files = []
+    total = 0
+    try:
+        names = os.listdir(cachedir)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith('.refresh'):
+            continue
+        try:
+            statval = os.stat(os.path.join(cachedir, name))
+        except OSError:
+            continue
+        files.append((statval.st_mtime, statval.st_size, name))
+        total += statval.st_size
+    files.sort()
+    while total > maxsize and files:
+        mtime, size, name = files.pop(0)
+        try:
+            os.unlink(os.path.join(cachedir, name))
+        except OSError:
+            pass
+        total -= size
+
+def lockrefresh(filename):
+    """Returns true if this process gets to refresh the response kept in
+    filename; false if another is already doing so."""
+    lockname = filename + '.refresh'
+    for attempt in range(2):
+        try:
+            os.close(os.open(lockname, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0600))
+            return 1
+        except OSError, e:
+            if e[0] != errno.EEXIST:
+                return 0
+        try:
+            if os.stat(lockname).st_mtime > time.time() - refreshlocktime:
+                return 0
+            os.unlink(lockname)
+        except OSError:
+            pass
+    return 0
+
+def unlockrefresh(filename):
+    try:
+        os.unlink(filename + '.refresh')
+    except OSError:
+        pass
+
+class ResponseRecorder:
+    """Passes writes on to wfile, keeping a copy of them as long as they
+    total no more than limit bytes."""
+    def __init__(self, wfile, limit):
+        self.wfile = wfile
+        self.limit = limit
+        self.size = 0
+        self.data = []
+
+    def write(self, data):
+        self.wfile.write(data)
+        if self.data != None:
+            self.size += len(data)
+            if self.size > self.limit:
+                self.data = None
+            else:
+                self.data.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def getvalue(self):
+        """Returns all that was written, or None if it was too much."""
+        if self.data == None:
+            return None
+        return ''.join(self.data)
+
+class CachingHandler(BaseHandler):
+    """Answers for another handler from the response cache, running that
+    handler when there is no usable response kept."""
+
+    def __init__(self, handler, ttl, stale):
+        BaseHandler.__init__(self, handler.selector, handler.searchrequest,
+                             handler.protocol, handler.config,
+                             handler.statresult, handler.vfs)
+        self.handler = handler
+        self.ttl = ttl
+        self.stale = stale
+        self.cachename = getcachename(self.selector, self.searchrequest)
+        self.response = None
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    def isrequestforme(self):
+        return self.handler.isrequestforme()
+
+    def getentry(self):
+        return self.handler.getentry()
+
+    def getselector(self):
+        return self.handler.getselector()
+
+    def prepare(self):
+        response = loadresponse(self.cachename, self.selector,
+                                self.searchrequest)
+        if response:
+            age = time.time() - response['time']
+            if age < self.ttl:
+                self.response = response
+                return
+            if age < self.ttl + self.stale:
+                # Stale: send it anyway, and if nobody else is refreshing
+                # it, do so once this client has been answered.
+                self.response = response
+                if lockrefresh(self.cachename):
+                    base.deferuntilfinished(self.refresh)
+                return
+        return self.handler.prepare()
+
+    def isdir(self):
+        if self.response:
+            return self.response['isdir']
+        return self.handler.isdir()
+
+    def getdirlist(self):
+        if self.response:
+            return [gopherentry.setentrystate(
+                        gopherentry.GopherEntry(state['selector'],
+                                                self.config), state) \
+                    for state in self.response['dirlist']]
+        entries = list(self.handler.getdirlist())
+        self.store(1, None, entries)
+        return entries
+
+    def write(self, wfile):
+        if self.response:
+            wfile.write(self.response['data'])
+            return
+        recorder = ResponseRecorder(wfile, maxresponsesize)
+        self.handler.write(recorder)
+        self.store(0, recorder.getvalue(), None)
+
+    def store(self, isdir, data, entries):
+        if data == None and entries == None:
+            return
+        if entries != None:
+            entries = [gopherentry.getentrystate(entry) for entry in entries]
+        try:
+            data = marshal.dumps({'version': version,
+                                  'selector': self.selector,
+                                  'searchrequest': self.searchrequest,
+                                  'time': time.time(),
+                                  'isdir': isdir,
+                                  'data': data,
+                                  'dirlist': entries})
+        except ValueError:
+            return
+        if len(data) <= maxresponsesize:
+            saveresponse(self.cachename, data)
+
+    def refresh(self):
+        """Runs the handler again, storing its new response."""
+        try:
+            try:
+                self.handler.prepare()
+                if self.handler.isdir():
+                    self.store(1, None, list(self.handler.getdirlist()))
+                else:
+                    recorder = ResponseRecorder(StringIO(), maxresponsesize)
+                    self.handler.write(recorder)
+                    self.store(0, recorder.getvalue(), None)
+            except:
+                GopherExceptions.log(sys.exc_info()[1], None, self.handler)
+        finally:
+            unlockrefresh(self.cachename)
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the response cache
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time, marshal
+from StringIO import StringIO
+from pygopherd import testutil, initialization
+from pygopherd.handlers import base, pyg, responsecache, HandlerMultiplexer
+
+pygsource = """
+from pygopherd.handlers.pyg import PYGBase
+from pygopherd.gopherentry import GopherEntry
+
+runs = []
+
+class PYGMain(PYGBase):
+    def canhandlerequest(self):
+        return 1
+
+    def prepare(self):
+        runs.append(self.selectorargs)
+
+    def getentry(self):
+        entry = GopherEntry(self.selector, self.config)
+        entry.type = '0'
+        return entry
+
+    def isdir(self):
+        return self.selectorargs == 'menu'
+
+    def getdirlist(self):
+        entry = GopherEntry('/item', self.config)
+        entry.name = 'Run %d' % len(runs)
+        return [entry]
+
+    def write(self, wfile):
+        wfile.write('Run %d of %s for %s' % (len(runs), self.selectorargs,
+                                             self.searchrequest))
+"""
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.responsecache", "cachedir",
+                        os.path.join(self.root, 'responses'))
+        self.config.set("handlers.responsecache", "patterns",
+                        "{'^/app\\.pyg$': (60, 300)}")
+        base.rootpath = self.root
+        responsecache.patterns = None
+        pyg.pygmodules.clear()
+        filename = os.path.join(self.root, 'app.pyg')
+        for name in ['app.pyg', 'other.pyg']:
+            filename = os.path.join(self.root, name)
+            fd = open(filename, 'w')
+            fd.write(pygsource)
+            fd.close()
+            os.chmod(filename, 0755)
+            when = time.time() - 60
+            os.utime(filename, (when, when))
+
+    def tearDown(self):
+        base.rootpath = None
+        base.deferred.clear()
+        responsecache.patterns = None
+        pyg.pygmodules.clear()
+        shutil.rmtree(self.root)
+
+    def gethandler(self, selector, searchrequest = ''):
+        handler = HandlerMultiplexer.getHandler(selector, searchrequest, None,
+                                                self.config,
+                                                [pyg.PYGHandler])
+        handler.getentry()
+        handler.prepare()
+        return handler
+
+    def get(self, selector, searchrequest = ''):
+        handler = self.gethandler(selector, searchrequest)
+        if handler.isdir():
+            return [entry.getname() for entry in handler.getdirlist()]
+        wfile = StringIO()
+        handler.write(wfile)
+        return wfile.getvalue()
+
+    def age(self, selector, searchrequest, seconds):
+        filename = responsecache.getcachename(selector, searchrequest)
+        fd = open(filename, 'rb')
+        data = marshal.load(fd)
+        fd.close()
+        data['time'] -= seconds
+        fd = open(filename, 'wb')
+        marshal.dump(data, fd)
+        fd.close()
+
+    def testcache(self):
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        # Arguments and searches are part of the key.
+        self.assertEquals(self.get('/app.pyg|b'), 'Run 2 of b for ')
+        self.assertEquals(self.get('/app.pyg|a', 'word'), 'Run 3 of a for word')
+        self.assertEquals(self.get('/app.pyg|menu'), ['Run 4'])
+        self.assertEquals(self.get('/app.pyg|menu'), ['Run 4'])
+
+        # Responses past their ttl and stale time are made again.
+        self.age('/app.pyg|a', '', 400)
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 5 of a for ')
+
+        # Other applications aren't cached.
+        self.assertEquals(self.get('/other.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(self.get('/other.pyg|a'), 'Run 2 of a for ')
+
+    def teststale(self):
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.age('/app.pyg|a', '', 100)
+
+        # Both get the stale copy, but only the first refreshes it, once
+        # its client has been answered.
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(len(base.deferred.values()[0]), 1)
+        base.finishrequest()
+        self.assertEquals(base.deferred, {})
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 2 of a for ')
+        assert not os.path.exists(
+            responsecache.getcachename('/app.pyg|a', '') + '.refresh')
+
+    def testdeclaration(self):
+        fd = open(os.path.join(self.root, 'other.pyg.responsecache'), 'w')
+        fd.write('# Changes hourly\nttl = 3600\n')
+        fd.close()
+        self.assertEquals(self.get('/other.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(self.get('/other.pyg|a'), 'Run 1 of a for ')
+
+    def testbounds(self):
+        self.config.set("handlers.responsecache", "maxresponsesize", "200")
+        self.config.set("handlers.responsecache", "maxsize", "250")
+        responsecache.patterns = None
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(self.get('/app.pyg|' + 'x' * 200),
+                          'Run 2 of %s for ' % ('x' * 200))
+        self.assertEquals(self.get('/app.pyg|' + 'x' * 200),
+                          'Run 3 of %s for ' % ('x' * 200))
+        # Only one of these fits in maxsize; the oldest goes.
+        self.assertEquals(self.get('/app.pyg|b'), 'Run 4 of b for ')
+        self.assertEquals(len(os.listdir(os.path.join(self.root,
+                                                      'responses'))), 1)
+        self.assertEquals(self.get('/app.pyg|b'), 'Run 4 of b for ')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 5 of a for ')
+
+    def testprivate(self):
+        self.config.set("logger", "logmethod", "none")
+        initialization.initlogger(self.config, 'TESTING')
+        cachedir = os.path.join(self.root, 'responses')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 1 of a for ')
+        self.assertEquals(os.stat(cachedir).st_mode & 0777, 0700)
+
+        # A directory others can write to isn't trusted.
+        os.chmod(cachedir, 0777)
+        responsecache.patterns = None
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 2 of a for ')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 3 of a for ')
+
+        # Nor is a link to one.
+        os.chmod(cachedir, 0700)
+        os.rename(cachedir, cachedir + '.real')
+        os.symlink(cachedir + '.real', cachedir)
+        responsecache.patterns = None
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 4 of a for ')
+        self.assertEquals(self.get('/app.pyg|a'), 'Run 5 of a for ')
@@ -17,12 +17,17 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from pygopherd import protocols, gopherentry
+from pygopherd import protocols, gopherentry, scriptworkers, sighandlers
+from pygopherd.handlers import responsecache
 from pygopherd.handlers.base import BaseHandler, VFS_Real
 from pygopherd.handlers.virtual import Virtual
 import pygopherd.pipe
 from stat import *
-import imp, re, os
+import imp, re, os, tempfile
+
+persistent = None
+requesttimeout = None
+workerdir = None
 
 class ExecHandler(Virtual):
     def canhandlerequest(self):
@@ -39,27 +44,65 @@ class ExecHandler(Virtual):
         entry.setgopherpsupport(0)
         return entry
 
+    def gethandler(self):
+        return responsecache.wrap(self)
+
+    def getworkercount(self):
+        """Returns how many persistent workers to keep for this script, or
+        0 to run it once for the request."""
+        global persistent, requesttimeout, workerdir
+        if persistent == None:
+            section = "handlers.scriptexec.ExecHandler"
+            persistent = []
+            if self.config.has_option(section, "persistent"):
+                for pattern, count in \
+                        eval(self.config.get(section, "persistent")).items():
+                    persistent.append((re.compile(pattern), count))
+            requesttimeout = 60
+            if self.config.has_option(section, "requesttimeout"):
+                requesttimeout = self.config.getint(section, "requesttimeout")
+            workerdir = os.path.join(tempfile.gettempdir(),
+                                     'pygopherd-workers-%d' % os.getuid())
+            if self.config.has_option(section, "workerdir"):
+                workerdir = self.config.get(section, "workerdir")
+        for pattern, count in persistent:
+            if pattern.search(self.getselector()):
+                return count
+        return 0
+
+    def getrequestenv(self):
+        """Returns the variables that describe this request."""
+        env = {}
+        env['SERVER_NAME'] = self.protocol.server.server_name
+        env['SERVER_PORT'] = str(self.protocol.server.server_port)
+        env['REMOTE_ADDR'] = self.protocol.requesthandler.client_address[0]
+        env['REMOTE_PORT'] = str(self.protocol.requesthandler.client_address[1])
+        env['REMOTE_HOST'] = env['REMOTE_ADDR']
+        env['SELECTOR'] = self.selector
+        env['REQUEST'] = self.getselector()
+        if self.searchrequest:
+            env['SEARCHREQUEST'] = self.searchrequest
+        return env
+
     def write(self, wfile):
+        env = self.getrequestenv()
+        count = self.getworkercount()
+        if count:
+            env['ARGS'] = self.selectorargs or ''
+            scriptworkers.request(self.getfspath(), count, requesttimeout,
+                                  workerdir, env, wfile, sighandlers.pid)
+            return
+
         # We work on a separate thing to avoid contaminating our own
         # environment.  Just saying newenv = os.environ would still
         # do that.
-        newenv = {}
-        for key in os.environ.keys():
-            newenv[key] = os.environ[key]
-        newenv['SERVER_NAME'] = self.protocol.server.server_name
-        newenv['SERVER_PORT'] = str(self.protocol.server.server_port)
-        newenv['REMOTE_ADDR'] = self.protocol.requesthandler.client_address[0]
-        newenv['REMOTE_PORT'] = str(self.protocol.requesthandler.client_address[1])
-        newenv['REMOTE_HOST'] = newenv['REMOTE_ADDR']
-        newenv['SELECTOR'] = self.selector
-        newenv['REQUEST'] = self.getselector()
-        if self.searchrequest:
-            newenv['SEARCHREQUEST'] = self.searchrequest
+        newenv = os.environ.copy()
+        newenv.update(env)
         wfile.flush()
 
         args = [self.getfspath()]
         if self.selectorargs:
-            args.extend(self.selectorags.split(' '))
+            args.extend(self.selectorargs.split(' '))
 
         pygopherd.pipe.pipedata(self.getfspath(), args, newenv,
                                 childstdout = wfile)
@@ -0,0 +1,107 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: search handler
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from pygopherd import GopherExceptions, gopherentry, searchindex
+from pygopherd.handlers import base
+from pygopherd.handlers.base import BaseHandler
+from pygopherd.handlers.responsecache import lockrefresh, unlockrefresh
+from stat import *
+import os, sys, time
+
+section = "handlers.search.SearchHandler"
+
+class SearchHandler(BaseHandler):
+    """Answers type 7 searches of the whole server, from an index of the
+    documents under the root that is brought up to date now and then."""
+
+    def getoption(self, name, default):
+        if self.config.has_option(section, name):
+            return self.config.get(section, name)
+        return default
+
+    def canhandlerequest(self):
+        return self.selector == self.getoption("selector", "/search")
+
+    def getindexname(self):
+        return self.getoption("indexfile", self.vfs.getfspath('/') + \
+                              '/.cache.pygopherd.search')
+
+    def getentry(self):
+        if not self.entry:
+            self.entry = gopherentry.GopherEntry(self.selector, self.config)
+            self.entry.settype('7')
+            self.entry.setname('Search this server')
+            self.entry.setmimetype('application/gopher-menu')
+        return self.entry
+
+    def prepare(self):
+        filename = self.getindexname()
+        self.checkindex(filename)
+        reader = searchindex.getreader(filename)
+        self.entries = []
+        if not reader:
+            self.addinfo("The search index is being built.  " \
+                         "Please try again shortly.")
+        elif not self.searchrequest:
+            self.addinfo("Enter words to search for.")
+        else:
+            maxresults = int(self.getoption("maxresults", "100"))
+            for (selector, type, name, mimetype) in \
+                    reader.search(self.searchrequest, maxresults):
+                entry = gopherentry.GopherEntry(selector, self.config)
+                entry.settype(type)
+                entry.setname(name)
+                entry.setmimetype(mimetype)
+                self.entries.append(entry)
+            if not self.entries:
+                self.addinfo("Nothing matched %s." % self.searchrequest)
+
+    def addinfo(self, text):
+        self.entries.append(gopherentry.getinfoentry(text, self.config))
+
+    def checkindex(self, filename):
+        """Arranges for the index to be updated once this request is
+        answered, if it is missing or older than reindexinterval seconds
+        and nobody is updating it already."""
+        interval = int(self.getoption("reindexinterval", "3600"))
+        try:
+            if interval <= 0 or \
+               os.stat(filename)[ST_MTIME] > time.time() - interval:
+                return
+        except OSError:
+            pass
+        if lockrefresh(filename):
+            base.deferuntilfinished(self.updateindex)
+
+    def updateindex(self):
+        filename = self.getindexname()
+        try:
+            try:
+                maxfilesize = int(self.getoption("maxfilesize", "1048576"))
+                searchindex.Indexer(self.config, filename,
+                                    maxfilesize).update()
+            except:
+                GopherExceptions.log(sys.exc_info()[1], self.protocol, self)
+        finally:
+            unlockrefresh(filename)
+
+    def isdir(self):
+        return 1
+
+    def getdirlist(self):
+        return self.entries
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the search handler
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil
+from pygopherd import testutil, searchindex
+from pygopherd.handlers import base, HandlerMultiplexer
+
+class SearchHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("handlers.HandlerMultiplexer", "handlers",
+                        "[search.SearchHandler, file.FileHandler]")
+        self.savedhandlers = HandlerMultiplexer.handlers
+        HandlerMultiplexer.handlers = None
+        base.rootpath = self.root
+        for name in ['apple.txt', 'banana.txt', 'apple pie.txt']:
+            fd = open(os.path.join(self.root, name), 'w')
+            fd.write('Fruit\n')
+            fd.close()
+
+    def tearDown(self):
+        HandlerMultiplexer.handlers = self.savedhandlers
+        base.rootpath = None
+        base.deferred.clear()
+        searchindex.readers.clear()
+        shutil.rmtree(self.root)
+
+    def search(self, query):
+        handler = HandlerMultiplexer.getHandler('/search', query, None,
+                                                self.config)
+        self.assertEquals(handler.getentry().gettype(), '7')
+        handler.prepare()
+        assert handler.isdir()
+        return [(entry.gettype(), entry.getname()) \
+                for entry in handler.getdirlist()]
+
+    def testsearch(self):
+        # The index is built after the first search is answered.
+        self.assertEquals(self.search('apple'),
+                          [('i', 'The search index is being built.  '
+                                 'Please try again shortly.')])
+        base.finishrequest()
+        self.assertEquals(self.search('apple'), [('0', 'apple pie.txt'),
+                                                 ('0', 'apple.txt')])
+        self.assertEquals(self.search('fruit pie'), [('0', 'apple pie.txt')])
+        self.assertEquals(self.search('cherry'),
+                          [('i', 'Nothing matched cherry.')])
+        self.assertEquals(self.search(''),
+                          [('i', 'Enter words to search for.')])
+        self.assertEquals(base.deferred, {})
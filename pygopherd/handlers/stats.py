@@ -0,0 +1,60 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: server statistics handler
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from pygopherd import gopherentry, contentcache
+from pygopherd.handlers.base import BaseHandler
+
+section = "handlers.stats.StatsHandler"
+
+class StatsHandler(BaseHandler):
+    """Reports the server's admission limits, its busiest clients and how
+    its content cache is doing, as a text document, to the addresses
+    allowed to see it."""
+
+    def getoption(self, name, default):
+        if self.config.has_option(section, name):
+            return self.config.get(section, name)
+        return default
+
+    def canhandlerequest(self):
+        if self.selector != self.getoption("selector", "/server-stats"):
+            return 0
+        try:
+            address = self.protocol.requesthandler.client_address[0]
+        except AttributeError:
+            return 0
+        return address in self.getoption("allowfrom", "127.0.0.1 ::1").split()
+
+    def getentry(self):
+        if not self.entry:
+            self.entry = gopherentry.GopherEntry(self.selector, self.config)
+            self.entry.settype('0')
+            self.entry.setname('Server statistics')
+            self.entry.setmimetype('text/plain')
+        return self.entry
+
+    def write(self, wfile):
+        server = self.protocol.server
+        if hasattr(server, 'admission'):
+            lines = server.admission.getstats(int(self.getoption("top", "10")))
+        else:
+            lines = ["No statistics are kept by this server."]
+        cache = contentcache.getcache(self.config)
+        if cache:
+            lines = lines + [""] + cache.getstats()
+        wfile.write("".join([line + "\r\n" for line in lines]))
@@ -44,7 +44,95 @@ if haslogging:
 
 from pygopherd.handlers.file import FileHandler
 from pygopherd import gopherentry
-import re, os.path
+import re, os.path, time
+from stat import *
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+def compiletemplate(fd):
+    return simpleTAL.compileHTMLTemplate(fd)
+
+class TemplateCache:
+    """Compiled templates, by filesystem path, kept while their files are
+    unchanged.  Both TALFileHandler and the loaders for macros use it.
+
+    The cache holds at most maxbytes worth of template source, a rough
+    measure of the memory the compiled templates take; the least
+    recently used are dropped first."""
+
+    def __init__(self, maxbytes, compile = compiletemplate):
+        self.maxbytes = maxbytes
+        self.compile = compile
+        # fspath -> [mtime, size, compiletime, template, lastuse]
+        self.templates = {}
+        self.bytes = 0
+        self.uses = 0
+        self.lock = threading.Lock()
+
+    def compilefile(self, vfs, selector):
+        fd = vfs.open(selector)
+        try:
+            return self.compile(fd)
+        finally:
+            fd.close()
+
+    def get(self, vfs, selector, statval):
+        """Returns the compiled template in selector, whose stat() result
+        is statval."""
+        if not vfs.iswritable(selector) or statval[ST_SIZE] > self.maxbytes:
+            return self.compilefile(vfs, selector)
+        fspath = vfs.getfspath(selector)
+        self.lock.acquire()
+        try:
+            self.uses += 1
+            if self.templates.has_key(fspath):
+                item = self.templates[fspath]
+                # A change in the second it was compiled may not show in
+                # the mtime.
+                if item[0:2] == [statval[ST_MTIME], statval[ST_SIZE]] and \
+                   item[0] < item[2]:
+                    item[4] = self.uses
+                    return item[3]
+        finally:
+            self.lock.release()
+
+        compiletime = int(time.time())
+        template = self.compilefile(vfs, selector)
+        self.lock.acquire()
+        try:
+            self.remove(fspath)
+            self.templates[fspath] = [statval[ST_MTIME], statval[ST_SIZE],
+                                      compiletime, template, self.uses]
+            self.bytes += statval[ST_SIZE]
+            while self.bytes > self.maxbytes:
+                oldest = None
+                for key, item in self.templates.items():
+                    if oldest == None or item[4] < self.templates[oldest][4]:
+                        oldest = key
+                self.remove(oldest)
+        finally:
+            self.lock.release()
+        return template
+
+    def remove(self, fspath):
+        if self.templates.has_key(fspath):
+            self.bytes -= self.templates[fspath][1]
+            del self.templates[fspath]
+
+templatecache = None
+
+def gettemplatecache(config):
+    global templatecache
+    if templatecache == None:
+        maxbytes = 1048576
+        if config.has_option('handlers.tal.TALFileHandler',
+                             'templatecachesize'):
+            maxbytes = config.getint('handlers.tal.TALFileHandler',
+                                     'templatecachesize')
+        templatecache = TemplateCache(maxbytes)
+    return templatecache
 
 class TALLoader:
     def __init__(self, vfs, path):
@@ -70,11 +158,14 @@ class TALLoader:
 
     def __getattr__(self, key):
         fq = os.path.join(self.path, key)
-        if self.vfs.isfile(fq + ".html.tal"):
-            templateFile = self.vfs.open(fq + ".html.tal")
-            compiled = simpleTAL.compileHTMLTemplate(templateFile)
-            templateFile.close()
-            return compiled
+        try:
+            statval = self.vfs.stat(fq + ".html.tal")
+        except OSError:
+            statval = None
+        if statval and S_ISREG(statval[ST_MODE]):
+            return gettemplatecache(self.vfs.config).get(self.vfs,
+                                                         fq + ".html.tal",
+                                                         statval)
         elif self.vfs.isdir(fq):
             return self.__class__(self.vfs, fq)
         else:
@@ -88,7 +179,7 @@ class RecursiveTALLoader(TALLoader):
         try:
             return TALLoader.__getattr__(self, key)
         except AttributeError:
-            return self.getparent().__getattr__(self, key)
+            return getattr(self.getparent(), key)
 
 class TALFileHandler(FileHandler):
     def canhandlerequest(self):
@@ -117,7 +208,6 @@ class TALFileHandler(FileHandler):
         return self.entry
 
     def write(self, wfile):
-        rfile = self.vfs.open(self.getselector())
         context = simpleTALES.Context(allowPythonPath = self.allowpythonpath)
         context.addGlobal("selector", self.getselector())
         context.addGlobal('handler', self)
@@ -131,6 +221,8 @@ class TALFileHandler(FileHandler):
         context.addGlobal('dir', TALLoader(self.vfs, dirname))
         context.addGlobal('rdir', RecursiveTALLoader(self.vfs, dirname))
 
-        template = simpleTAL.compileHTMLTemplate(rfile)
-        rfile.close()
+        template = gettemplatecache(self.config).get(self.vfs,
+                                                     self.getselector(),
+                                                     self.statresult)
+        # Expands straight into the client's file, as it goes.
         template.expand(context, wfile)
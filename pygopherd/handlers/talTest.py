@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the TAL template cache
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from pygopherd import testutil
+from pygopherd.handlers import base, tal
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        base.rootpath = self.root
+        self.vfs = base.VFS_Real(self.config)
+        self.compiled = []
+        self.cache = tal.TemplateCache(100, self.compile)
+        for name in ['a', 'b', 'c']:
+            self.write(name, name * 40)
+
+    def tearDown(self):
+        base.rootpath = None
+        shutil.rmtree(self.root)
+
+    def compile(self, fd):
+        """Records what was compiled, instead of compiling it."""
+        data = fd.read()
+        self.compiled.append(data[0])
+        return data
+
+    def write(self, name, data, age = 60):
+        filename = os.path.join(self.root, name + '.html.tal')
+        fd = open(filename, 'w')
+        fd.write(data)
+        fd.close()
+        when = time.time() - age
+        os.utime(filename, (when, when))
+
+    def get(self, name):
+        selector = '/' + name + '.html.tal'
+        return self.cache.get(self.vfs, selector, self.vfs.stat(selector))
+
+    def testcache(self):
+        self.assertEquals(self.get('a'), 'a' * 40)
+        self.assertEquals(self.get('a'), 'a' * 40)
+        self.assertEquals(self.compiled, ['a'])
+
+        self.write('a', 'A' * 40, 30)
+        self.assertEquals(self.get('a'), 'A' * 40)
+        self.assertEquals(self.compiled, ['a', 'A'])
+        self.assertEquals(self.cache.bytes, 40)
+
+    def testbound(self):
+        self.get('a')
+        self.get('b')
+        self.get('a')
+        # Only two fit; b was used least recently.
+        self.get('c')
+        self.assertEquals(self.cache.bytes, 80)
+        self.get('a')
+        self.get('b')
+        self.assertEquals(self.compiled, ['a', 'b', 'c', 'b'])
+
+    def testloader(self):
+        tal.templatecache = self.cache
+        try:
+            os.mkdir(os.path.join(self.root, 'sub'))
+            loader = tal.RecursiveTALLoader(self.vfs, '/sub')
+            self.assertEquals(loader.a, 'a' * 40)
+            self.assertEquals(tal.TALLoader(self.vfs, '/').a, 'a' * 40)
+            self.assertEquals(self.compiled, ['a'])
+            self.assertRaises(AttributeError, getattr, loader, 'nosuch')
+        finally:
+            tal.templatecache = None
@@ -21,9 +21,10 @@ from ConfigParser import ConfigParser
 
 # Import lots of stuff so it's here before chrooting.
 import socket, os, sys, SocketServer, re, stat, os.path, UserDict, tempfile
-import time, atexit, errno, struct
+import time, atexit, errno, struct, signal, select, threading, fcntl
 
 from pygopherd import handlers, protocols, GopherExceptions, logger, sighandlers
+from pygopherd import admission, deadline, listeners, tls, warmup
 from pygopherd.protocols import *
 from pygopherd.protocols import ProtocolMultiplexer
 from pygopherd.handlers import *
@@ -33,6 +34,13 @@ import mimetypes
 
 import traceback
 
+# How this process was started, so that a reload can start it again.
+startargs = None
+startdir = None
+
+# The first file descriptor passed by socket activation.
+listenfdsstart = 3
+
 
 def initconffile(conffile):
     if not (os.path.isfile(conffile) and os.access(conffile, os.R_OK)):
@@ -72,16 +80,81 @@ def initmimetypes(config):
     pygopherd.fileext.init()
 
 class GopherRequestHandler(SocketServer.StreamRequestHandler):
-    def handle(self):
-        request = self.rfile.readline()
+    def setup(self):
+        # Why the connection is to be dropped, if it is.
+        self.refusal = None
+        if hasattr(self.request, 'recv'):   # Not when testing
+            try:
+                self.setupconnection()
+            except (deadline.ClientError, socket.error), e:
+                self.refusal = e
+        SocketServer.StreamRequestHandler.setup(self)
+        if not hasattr(self.connection, 'recv'):
+            return
+        config = self.server.config
+        # The request is read straight from the socket, within limits,
+        # rather than through the buffered file.
+        self.rfile.close()
+        self.rfile = deadline.RequestReader(self.connection,
+                         getconfigint(config, 'requesttimeout'),
+                         getconfigint(config, 'timeout'),
+                         getconfigint(config, 'maxrequestsize'))
+        self.wfile = deadline.ResponseWriter(self.wfile,
+                         getconfigint(config, 'minrate'),
+                         getconfigint(config, 'minrategrace'),
+                         not getattr(self.server, 'tlscontext', None))
+
+    def setupconnection(self):
+        """Sets the idle timeout on the connection, and reads the PROXY
+        header and makes the TLS handshake if its listener expects them.
+        A client named by a PROXY header is admitted here, once it is
+        known, rather than as the connection is accepted, so a slow
+        proxy holds up no one else."""
+        config = self.server.config
+        idletimeout = getconfigint(config, 'timeout')
+        if idletimeout > 0:
+            deadline.settimeouts(self.request, idletimeout)
+        listener = getattr(self.server, 'listener', None)
+        if listener and listener.proxyprotocol:
+            # The header comes ahead of any TLS handshake; leave that be.
+            reader = deadline.RequestReader(self.request,
+                         getconfigint(config, 'requesttimeout'), idletimeout,
+                         0, 1)
+            self.client_address = listeners.readproxyheader(reader) or \
+                                  self.client_address
+            reason = self.server.admitproxied(self.request,
+                                              self.client_address[0])
+            if reason:
+                self.server.sendrefusal(self.request)
+                raise deadline.ClientError, "turned away (%s)" % reason
+        if getattr(self.server, 'tlscontext', None):
+            self.request = tls.wrap(self.server.tlscontext, self.request,
+                                    getconfigint(config, 'requesttimeout'))
 
-        protohandler = \
+    def handle(self):
+        if self.refusal:
+            logger.log("%s: disconnected: %s" % (self.client_address[0],
+                                                 self.refusal))
+            return
+        try:
+            request = self.rfile.readline()
+            protohandler = \
                      ProtocolMultiplexer.getProtocol(request, \
                      self.server, self, self.rfile, self.wfile, self.server.config)
+        except deadline.ClientError, e:
+            logger.log("%s: disconnected: %s" % (self.client_address[0], e))
+            return
+        if not protohandler:
+            logger.log("%s: no protocol on this listener for request %s" % \
+                       (self.client_address[0], repr(request[:100])))
+            return
+
         try:
             protohandler.handle()
+        except deadline.ClientError, e:
+            GopherExceptions.log(e, protohandler, None)
         except socket.error, e:
-            if not (e[0] in [errno.ECONNRESET, errno.EPIPE]):
+            if not (e[0] in [errno.ECONNRESET, errno.EPIPE, errno.EAGAIN]):
                 traceback.print_exc()
             GopherExceptions.log(sys.exc_info()[1], protohandler, None)
         except:
@@ -91,7 +164,63 @@ class GopherRequestHandler(SocketServer.StreamRequestHandler):
                 traceback.print_exc()
             GopherExceptions.log(sys.exc_info()[1], protohandler, None)
 
+    def finish(self):
+        SocketServer.StreamRequestHandler.finish(self)
+        # The client has everything; let it go before tidying up.
+        if getattr(self.server, 'tlscontext', None) and not self.refusal:
+            tls.closenotify(self.request)
+        try:
+            self.request.shutdown(1)
+        except socket.error:
+            pass
+        try:
+            handlers.base.finishrequest()
+            if isinstance(self.server, SocketServer.ForkingMixIn):
+                # This process exits without running atexit functions.
+                handlers.base.finishworker()
+        except:
+            traceback.print_exc()
+
+def getconfigint(config, name):
+    """Returns the integer option name from [pygopherd], or 0 if it is
+    not set."""
+    if config.has_option('pygopherd', name):
+        return config.getint('pygopherd', name)
+    return 0
+
+def getlistensockets():
+    """Returns the listening sockets passed to this process by socket
+    activation -- by systemd, or by a reload of the server -- if any."""
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return []
+    try:
+        count = int(os.environ.get('LISTEN_FDS', '0'))
+    except ValueError:
+        count = 0
+    # Scripts we run mustn't think the sockets are theirs.
+    for name in ['LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES']:
+        if os.environ.has_key(name):
+            del os.environ[name]
+    sockets = []
+    for fd in range(listenfdsstart, listenfdsstart + count):
+        sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            family = sock.getsockopt(socket.SOL_SOCKET,
+                                     getattr(socket, 'SO_DOMAIN', 39))
+            if family != socket.AF_INET:
+                newsock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+                sock.close()
+                sock = newsock
+        except socket.error:
+            pass
+        os.close(fd)
+        sockets.append(sock)
+    return sockets
+
 def getserverobject(config):
+    """Returns the server, listening on the main address.  It serves
+    any other listeners too; they are in its listeners attribute, with
+    it first."""
     # Pick up the server type from the config.
 
     servertype = eval("SocketServer." + config.get("pygopherd", "servertype"))
@@ -101,45 +230,397 @@ def getserverobject(config):
 
         def server_bind(self):
             """Override server_bind to store server name."""
+            if self.address_family == socket.AF_UNIX and \
+               os.path.exists(self.server_address):
+                # Left behind by an earlier server.
+                os.unlink(self.server_address)
             servertype.server_bind(self)
+            self.setservername()
 
-            # Set a timeout.
-            if config.has_option('pygopherd', 'timeout'):
-                mytimeout = struct.pack("ll", long(config.get('pygopherd', 'timeout')), 0)
-                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
-                                       mytimeout)
-                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
-                                       mytimeout)
-                #self.socket.settimeout(int(config.get('pygopherd', 'timeout')))
-            host, port = self.socket.getsockname()
-            if config.has_option("pygopherd", "servername"):
+        def setservername(self):
+            listener = self.listener
+            if listener.servername:
+                self.server_name = listener.servername
+            elif config.has_option("pygopherd", "servername"):
                 self.server_name = config.get("pygopherd", "servername")
+            elif self.address_family == socket.AF_UNIX:
+                self.server_name = socket.getfqdn()
             else:
-                self.server_name = socket.getfqdn(host)
-            if config.has_option("pygopherd", "advertisedport"):
+                self.server_name = socket.getfqdn(self.socket.getsockname()[0])
+            if listener.advertisedport:
+                self.server_port = listener.advertisedport
+            elif config.has_option("pygopherd", "advertisedport"):
                 self.server_port = config.getint("pygopherd", "advertisedport")
+            elif self.address_family == socket.AF_UNIX:
+                self.server_port = config.getint("pygopherd", "port")
             else:
-                self.server_port = port
-
-    # Instantiate a server.  Has to be done before the security so we can
-    # get a privileged port if necessary.
-
-    interface = ''
-    if config.has_option('pygopherd', 'interface'):
-        servername = config.get('pygopherd', 'interface')
-        interface = config.get('pygopherd', 'interface')
+                self.server_port = self.socket.getsockname()[1]
+
+        def get_request(self):
+            request, client_address = servertype.get_request(self)
+            if self.address_family == socket.AF_UNIX:
+                client_address = ('local', 0)
+            return request, client_address
+
+        def verify_request(self, request, client_address):
+            """Turns the client away, cheaply and before reading its
+            request, if it is over its limits.  Connections from a proxy
+            are admitted by the worker answering them, by the client the
+            proxy names; see admitproxied().  Local connections to a Unix
+            domain socket are all one client, so they are not limited."""
+            if client_address[0] == 'local' or self.listener.proxyprotocol:
+                return 1
+            if not self.admission.admit(client_address[0]):
+                # Until its worker is reaped, or the request shut down.
+                self.admittedrequests[request] = client_address[0]
+                return 1
+            self.sendrefusal(request)
+            return 0
+
+        def sendrefusal(self, request):
+            try:
+                request.send("3%s\t\terror.host\t1\r\n" % \
+                             self.admission.message, socket.MSG_DONTWAIT)
+            except socket.error:
+                pass
+
+        def admitproxied(self, request, address):
+            """Admits the client a proxy named, from the worker answering
+            it.  Returns None if it may connect, or the reason it may
+            not.  A forked worker asks the server process, which keeps
+            the counts, over its admission channel."""
+            if address == 'local':
+                return None
+            channel = self.admissionchannel
+            if channel == None:
+                reason = self.admission.admit(address)
+                if not reason:
+                    self.admittedrequests[request] = address
+                return reason
+            answer = ''
+            try:
+                channel.sendall(address + '\n')
+                if select.select([channel], [], [],
+                                 getconfigint(self.config,
+                                              'requesttimeout') or None)[0]:
+                    answer = channel.recv(1024)
+            except (socket.error, select.error):
+                pass
+            if answer == 'ok':
+                return None
+            return answer or "no answer from the server"
+
+        def answeradmission(self, channel):
+            """Answers a forked worker's request, from admitproxied(), to
+            admit a client.  The channel is closed once the worker is."""
+            server, pid = self.channels[channel]
+            try:
+                address = channel.recv(1024).strip()
+            except socket.error:
+                address = ''
+            if not address:
+                del self.channels[channel]
+                channel.close()
+                return
+            reason = server.admission.admit(address)
+            if not reason:
+                server.admitted[pid] = address
+            try:
+                channel.send(reason or 'ok')
+            except socket.error:
+                pass
+
+        def releasefinished(self):
+            children = self.active_children or []
+            for pid in self.admitted.keys():
+                if not pid in children:
+                    self.admission.release(self.admitted[pid])
+                    del self.admitted[pid]
+
+        def reapchildren(self):
+            """Reaps the finished workers of every listener, and counts
+            their clients' connections as closed.  A client may be
+            turned away by one listener for a connection that ended on
+            another."""
+            for server in self.listeners:
+                if isinstance(server, SocketServer.ForkingMixIn):
+                    server.collect_children()
+                    server.releasefinished()
+
+        def process_request(self, request, client_address):
+            if not isinstance(self, SocketServer.ForkingMixIn):
+                return servertype.process_request(self, request,
+                                                  client_address)
+            # The worker's connection is counted until it is reaped.
+            address = self.admittedrequests.pop(request, None)
+            before = list(self.active_children or [])
+            if self.listener.proxyprotocol:
+                channel, self.admissionchannel = socket.socketpair()
+            try:
+                servertype.process_request(self, request, client_address)
+            finally:
+                started = [pid for pid in self.active_children or [] \
+                           if not pid in before]
+                if self.admissionchannel:
+                    self.admissionchannel.close()
+                    self.admissionchannel = None
+                    if started:
+                        self.channels[channel] = (self, started[0])
+                    else:
+                        channel.close()
+                if address != None:
+                    if started:
+                        self.admitted[started[0]] = address
+                    else:
+                        self.admission.release(address)
+
+        def shutdown_request(self, request):
+            """Closes request, and, under the threading server or one
+            that answers a request at a time, counts its client's
+            connection as closed."""
+            servertype.shutdown_request(self, request)
+            address = self.admittedrequests.pop(request, None)
+            if address != None:
+                self.admission.release(address)
+
+        def serve_forever(self, poll_interval = 0.5):
+            """Answers connections to any of the listeners until
+            shutdown() is called."""
+            self.stopped.clear()
+            try:
+                while not self.stopping:
+                    waitfor = self.listeners + self.channels.keys()
+                    timeout = poll_interval
+                    reloading = self.reloading
+                    if reloading:
+                        # Keep serving while the new server gets ready.
+                        pid, readyread, deadline = reloading
+                        waitfor = waitfor + [readyread]
+                        timeout = max(min(timeout, deadline - time.time()), 0)
+                    try:
+                        ready = select.select(waitfor, [], [], timeout)[0]
+                    except select.error, e:
+                        if e[0] == errno.EINTR:
+                            continue
+                        raise
+                    self.reapchildren()
+                    if reloading and (readyread in ready or \
+                                      time.time() >= deadline):
+                        finishreload(self)
+                        continue
+                    for server in ready:
+                        if self.channels.has_key(server):
+                            self.answeradmission(server)
+                        else:
+                            server._handle_request_noblock()
+            finally:
+                self.stopping = 0
+                self.stopped.set()
+
+        def shutdown(self):
+            self.stopping = 1
+            self.stopped.wait()
+
+    def newserver(listener, sock = None):
+        """Returns a server for listener, on sock if it's already
+        listening."""
+        class ListenerServer(MyServer):
+            address_family = listener.family
+        ListenerServer.listener = listener
+        if sock:
+            s = ListenerServer(listener.address, GopherRequestHandler, 0)
+            s.socket.close()
+            s.socket = sock
+            s.server_address = sock.getsockname()
+            s.setservername()
+            logger.log("Using the listening socket passed in, on %s" % \
+                       str(s.server_address))
+        else:
+            s = ListenerServer(listener.address, GopherRequestHandler)
+        s.config = config
+        s.protocols = listener.protocols
+        s.tlscontext = None
+        if listener.tls:
+            s.tlscontext = tls.getcontext(config, 'listener.' + listener.name)
+        # The addresses of the clients forked workers are answering, by pid.
+        s.admitted = {}
+        # The addresses of admitted clients, by request, until it is
+        # handed to a worker or shut down.
+        s.admittedrequests = {}
+        # In a forked worker for a proxy's connection, its end of the
+        # channel to the server process, for admitproxied().
+        s.admissionchannel = None
+        s.stopping = 0
+        s.stopped = threading.Event()
+        return s
+
+    # Instantiate the servers.  Has to be done before the security so we
+    # can get a privileged port if necessary.
 
     try:
-        s = MyServer((interface, config.getint('pygopherd', 'port')),
-                     GopherRequestHandler)
+        inherited = getlistensockets()
+        servers = []
+        for listener in listeners.getlisteners(config):
+            sock = None
+            for candidate in inherited:
+                if listener.matches(candidate):
+                    sock = candidate
+                    break
+            if not sock and not servers and inherited:
+                # A single socket for the main listener, wherever it is.
+                sock = inherited[0]
+            if sock:
+                inherited.remove(sock)
+            servers.append(newserver(listener, sock))
+        for sock in inherited:
+            logger.log("Closing unused listening socket %s" % \
+                       str(sock.getsockname()))
+            sock.close()
     except:
         GopherExceptions.log(sys.exc_info()[1], None, None)
         logger.log("Application startup NOT successful!")
         raise
 
-    s.config = config
+    s = servers[0]
+    s.listeners = servers
+    # (pid, ready pipe, deadline) of a new server starting by a reload.
+    s.reloading = None
+    sharedadmission = admission.Admission(config)
+    # The server process's ends of the admission channels of forked
+    # workers: (listener's server, pid), by channel.
+    channels = {}
+    for server in servers:
+        server.admission = sharedadmission
+        server.channels = channels
     return s
 
+def drain(s, seconds):
+    """Waits up to seconds for the requests being answered by server s
+    to finish, then cuts off any that haven't.  Returns true if they all
+    finished."""
+    cutoff = time.time() + seconds
+    children = []
+    for server in getattr(s, 'listeners', [s]):
+        children.extend(getattr(server, 'active_children', None) or [])
+    while children and time.time() < cutoff:
+        for pid in children[:]:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    children.remove(pid)
+            except OSError:
+                children.remove(pid)
+        if children:
+            time.sleep(0.1)
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except OSError:
+            pass
+    threads = [thread for thread in threading.enumerate() \
+               if thread != threading.currentThread()]
+    for thread in threads:
+        thread.join(max(cutoff - time.time(), 0))
+    return not children and \
+           not [thread for thread in threads if thread.isAlive()]
+
+def reload(s):
+    """Starts the server again, from the same command line, so that it
+    reads its configuration and code afresh.  The new server takes over
+    the listening sockets, so no connection is refused.  This one carries
+    on serving until the new one is ready; see finishreload()."""
+    if s.reloading:
+        logger.log("Reload already in progress; ignoring")
+        return
+    config = s.config
+    sockets = [server.socket for server in s.listeners]
+    readyread, readywrite = os.pipe()
+    pid = os.fork()
+    if not pid:
+        try:
+            os.close(readyread)
+            # Move everything out of the way of the descriptors the
+            # sockets are passed on, then put them there.
+            above = listenfdsstart + len(sockets)
+            readywrite = fcntl.fcntl(readywrite, fcntl.F_DUPFD, above)
+            fds = [fcntl.fcntl(sock.fileno(), fcntl.F_DUPFD, above) \
+                   for sock in sockets]
+            for i in range(len(fds)):
+                os.dup2(fds[i], listenfdsstart + i)
+                os.close(fds[i])
+            os.environ['LISTEN_PID'] = str(os.getpid())
+            os.environ['LISTEN_FDS'] = str(len(sockets))
+            os.environ['PYGOPHERD_READYFD'] = str(readywrite)
+            os.chdir(startdir)
+            os.execv(startargs[0], startargs)
+        except:
+            traceback.print_exc()
+        os._exit(1)
+
+    os.close(readywrite)
+    starttime = 30
+    if config.has_option("pygopherd", "starttime"):
+        starttime = config.getint("pygopherd", "starttime")
+    starttime += warmup.gettimelimit(config)
+    s.reloading = (pid, readyread, time.time() + starttime)
+    logger.log("Started new server as %d; serving until it is ready" % pid)
+
+def finishreload(s):
+    """Called by the server loop once the new server started by
+    reload() has said it is ready, has exited, or has run out of time.
+    If it is ready, this one stops accepting connections, gives those it
+    has draintime seconds to finish, and exits; if not, it carries on."""
+    config = s.config
+    pid, readyread, deadline = s.reloading
+    s.reloading = None
+    ready = ''
+    try:
+        if select.select([readyread], [], [], 0)[0]:
+            ready = os.read(readyread, 5)
+    except (OSError, select.error):
+        pass
+    os.close(readyread)
+    if ready != 'ready':
+        logger.log("Reload failed: the new server did not start; " \
+                   "carrying on")
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+        return
+
+    logger.log("New server running as %d; finishing requests and exiting" % \
+               pid)
+    for server in s.listeners:
+        server.socket.close()
+    draintime = 30
+    if config.has_option("pygopherd", "draintime"):
+        draintime = config.getint("pygopherd", "draintime")
+    if drain(s, draintime):
+        logger.log("All requests finished.  Goodbye.")
+        sys.exit(0)
+    logger.log("Requests still running after %d seconds cut off.  Goodbye." \
+               % draintime)
+    handlers.base.finishworker()
+    os._exit(0)
+
+def initready(config):
+    """Tells the server that started this one by a reload that this one
+    is ready to take over, and puts its pid in the pidfile."""
+    if not os.environ.has_key('PYGOPHERD_READYFD'):
+        return
+    try:
+        writepidfile(config)
+    except IOError, e:
+        logger.log("Couldn't update the pidfile: %s" % e)
+    fd = int(os.environ['PYGOPHERD_READYFD'])
+    del os.environ['PYGOPHERD_READYFD']
+    try:
+        os.write(fd, 'ready')
+        os.close(fd)
+    except OSError:
+        pass
+
 def initsecurity(config):
     idsetuid = None
     idsetgid = None
@@ -157,6 +638,12 @@ def initsecurity(config):
         logger.log("Chrooted to " + config.get("pygopherd", "root"))
         config.set("pygopherd", "root", "/")
 
+    if idsetuid != None and idsetuid == os.getuid() and \
+       (idsetgid == None or idsetgid == os.getgid()):
+        # Started by a reload of a server that has switched already.
+        logger.log("Already running as uid %d" % idsetuid)
+        return
+
     if idsetuid != None or idsetgid != None:
         os.setgroups( () )
         logger.log("Supplemental group list cleared.")
@@ -177,6 +664,23 @@ def initconditionaldetach(config):
             sys.exit(0)
 
 def initpidfile(config):
+    """Writes the pidfile, and gives it to the user the server is to run
+    as, so that a server started by a reload can rewrite it.  Such a
+    server writes it once it is ready instead; see initready()."""
+    if not config.has_option("pygopherd", "pidfile") or \
+       os.environ.has_key('PYGOPHERD_READYFD'):
+        return
+    writepidfile(config)
+    if os.getuid() == 0 and config.has_option("pygopherd", "setuid"):
+        import pwd
+        uid = pwd.getpwnam(config.get("pygopherd", "setuid"))[2]
+        gid = -1
+        if config.has_option("pygopherd", "setgid"):
+            import grp
+            gid = grp.getgrnam(config.get("pygopherd", "setgid"))[2]
+        os.chown(config.get("pygopherd", "pidfile"), uid, gid)
+
+def writepidfile(config):
     if config.has_option("pygopherd", "pidfile"):
         pidfile = config.get("pygopherd", "pidfile")
         fd = open(pidfile, "wt")
@@ -193,11 +697,22 @@ def initpgrp(config):
         logger.log("setpgrp() unavailable; not initializing process group")
         return None
 
-def initsighandlers(config, pgrp):
+def initsighandlers(config, pgrp, s = None):
     sighandlers.setsighuphandler()
     sighandlers.setsigtermhandler(pgrp)
+    if not s:
+        return
+    if config.getboolean("pygopherd", "usechroot"):
+        # The new server couldn't be started from inside the chroot.
+        logger.log("Reloading on SIGUSR1 is unavailable with usechroot")
+        sighandlers.setsigreloadhandler(None)
+    else:
+        sighandlers.setsigreloadhandler(lambda: reload(s))
 
 def initeverything(conffile):
+    global startargs, startdir
+    startargs = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+    startdir = os.getcwd()
     config = initconffile(conffile)
     initlogger(config, conffile)
     initexceptions(config)
@@ -206,9 +721,14 @@ def initeverything(conffile):
     initconditionaldetach(config)
     initpidfile(config)
     pgrp = initpgrp(config)
-    initsighandlers(config, pgrp)
+    initsighandlers(config, pgrp, s)
+    selectors = warmup.readaccesslog(config)
     initsecurity(config)
     os.chdir(config.get("pygopherd", "root"))
+    atexit.register(handlers.base.finishworker)
+    pyg.preload(config)
+    warmup.warm(config, selectors)
+    initready(config)
 
     logger.log("Running.  Root is '%s'" % config.get("pygopherd", "root"))
     return s
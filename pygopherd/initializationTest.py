@@ -20,6 +20,8 @@
 # END OF COPYRIGHT #
 
 import unittest, SocketServer, mimetypes
+import os, sys, socket, signal, subprocess, tempfile, shutil, time
+from ConfigParser import ConfigParser
 from pygopherd import initialization
 
 from pygopherd import logger, fileext
@@ -72,3 +74,136 @@ class initializationGeneralTestCase(unittest.TestCase):
         #FIXME
         pass
     
+
+    def testlistensocket(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        port = listener.getsockname()[1]
+        fd = os.dup(listener.fileno())
+        listener.close()
+        os.environ['LISTEN_PID'] = str(os.getpid())
+        os.environ['LISTEN_FDS'] = '1'
+        initialization.listenfdsstart = fd
+        try:
+            self.config.set("logger", "logmethod", "none")
+            initialization.initlogger(self.config, 'TESTING')
+            s = initialization.getserverobject(self.config)
+        finally:
+            initialization.listenfdsstart = 3
+        self.assertEquals(s.socket.getsockname()[1], port)
+        self.assertEquals(s.server_port, port)
+        assert not os.environ.has_key('LISTEN_PID')
+        s.server_close()
+
+class initializationReloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'root')
+        os.mkdir(self.root)
+        self.write('big', 'x' * 4000000)
+        self.write('small', 'Small file\n')
+
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(('127.0.0.1', 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+
+        config = ConfigParser()
+        config.read('conf/pygopherd.conf')
+        for option in ['setuid', 'setgid']:
+            config.remove_option("pygopherd", option)
+        self.pidfile = os.path.join(self.dir, 'pid')
+        for option, value in [('detach', 'no'), ('pidfile', self.pidfile),
+                              ('port', str(self.port)),
+                              ('interface', '127.0.0.1'),
+                              ('usechroot', 'no'), ('root', self.root),
+                              ('mimetypes', os.path.abspath('conf/mime.types')
+                               + ':/etc/mime.types')]:
+            config.set("pygopherd", option, value)
+        config.set("logger", "logmethod", "none")
+        self.conffile = os.path.join(self.dir, 'pygopherd.conf')
+        fd = open(self.conffile, 'w')
+        config.write(fd)
+        fd.close()
+
+        self.launcher = os.path.join(self.dir, 'serve.py')
+        fd = open(self.launcher, 'w')
+        # A new server started by a reload takes a while to start.
+        fd.write("import sys, os, time\n"
+                 "sys.path.insert(0, %s)\n"
+                 "if os.environ.has_key('LISTEN_FDS'):\n"
+                 "    time.sleep(1.5)\n"
+                 "from pygopherd import initialization\n"
+                 "initialization.initeverything(sys.argv[1]).serve_forever()\n"
+                 % repr(os.path.abspath('.')))
+        fd.close()
+        self.devnull = open(os.devnull, 'w')
+
+    def tearDown(self):
+        pid = self.getpid()
+        if pid:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.devnull.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'w')
+        fd.write(data)
+        fd.close()
+
+    def getpid(self):
+        try:
+            return int(open(self.pidfile).read())
+        except (IOError, ValueError):
+            return None
+
+    def connect(self, selector):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(('127.0.0.1', self.port))
+        sock.sendall(selector + "\r\n")
+        return sock
+
+    def readall(self, sock):
+        data = []
+        while 1:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        sock.close()
+        return ''.join(data)
+
+    def waitfor(self, func):
+        for i in range(200):
+            if func():
+                return
+            time.sleep(0.05)
+        self.fail("timed out")
+
+    def testreload(self):
+        server = subprocess.Popen([sys.executable, self.launcher,
+                                   self.conffile], stdout = self.devnull,
+                                  stderr = self.devnull)
+        self.waitfor(lambda: self.getpid() == server.pid)
+        self.assertEquals(self.readall(self.connect('/small')),
+                          'Small file\n')
+
+        # A download in progress carries on across the reload.
+        download = self.connect('/big')
+        self.assertEquals(download.recv(1000), 'x' * 1000)
+        os.kill(server.pid, signal.SIGUSR1)
+        # Meanwhile, the old one serves on.
+        time.sleep(0.2)
+        self.assertEquals(self.readall(self.connect('/small')),
+                          'Small file\n')
+        self.assertEquals(self.getpid(), server.pid)
+        self.waitfor(lambda: self.getpid() not in [None, server.pid])
+        self.assertEquals(self.readall(self.connect('/small')),
+                          'Small file\n')
+        self.assertEquals(server.poll(), None)
+        self.assertEquals(len(self.readall(download)), 4000000 - 1000)
+        self.assertEquals(server.wait(), 0)
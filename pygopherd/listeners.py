@@ -0,0 +1,165 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: listening addresses and the PROXY protocol
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socket, struct
+from pygopherd import deadline
+
+class Listener:
+    """One address the server listens on, and how to treat connections
+    to it.  Made from a [listener.<name>] section of the config file, or
+    from the [pygopherd] interface and port for the main one."""
+
+    def __init__(self, name, family, address, protocols = None,
+                 proxyprotocol = 0, servername = None, advertisedport = None,
+                 tls = 0):
+        self.name = name
+        self.family = family
+        self.address = address
+        # A string naming a list of protocol classes, as the protocols
+        # option of ProtocolMultiplexer does; None to use that.
+        self.protocols = protocols
+        self.proxyprotocol = proxyprotocol
+        self.servername = servername
+        self.advertisedport = advertisedport
+        self.tls = tls
+
+    def matches(self, sock):
+        """Returns true if sock is listening where this should."""
+        try:
+            if sock.getsockopt(socket.SOL_SOCKET,
+                               getattr(socket, 'SO_DOMAIN', 39)) != self.family:
+                return 0
+            name = sock.getsockname()
+        except socket.error:
+            return 0
+        if self.family == socket.AF_UNIX:
+            return name == self.address
+        return name[1] != 0 and tuple(name[:2]) == tuple(self.address[:2])
+
+def parseaddress(address, defaultport = 70):
+    """Returns (family, sockaddr) for address, which is one of:
+
+    unix:/path      -- a Unix domain socket
+    host:port       -- a host name or IPv4 address and port
+    [ipv6]:port     -- an IPv6 address and port
+    host, [ipv6]    -- the same, on defaultport
+    :port, port     -- all interfaces, on port
+
+    An empty host is all IPv4 interfaces; [::] is all IPv6 ones, and
+    usually IPv4 as well."""
+    address = address.strip()
+    if address.startswith('unix:'):
+        return (socket.AF_UNIX, address[5:])
+    host = address
+    port = defaultport
+    if address.startswith('['):
+        end = address.find(']')
+        if end == -1:
+            raise ValueError, "unterminated [ in address %s" % address
+        host = address[1:end]
+        if address[end + 1:].startswith(':'):
+            port = int(address[end + 2:])
+    elif address.isdigit():
+        host = ''
+        port = int(address)
+    elif address.count(':') == 1:
+        host, port = address.split(':')
+        port = int(port)
+    if not host:
+        return (socket.AF_INET, ('0.0.0.0', port))
+    family, socktype, proto, canonname, sockaddr = \
+            socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                               socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0]
+    return (family, sockaddr)
+
+def getlisteners(config):
+    """Returns the Listeners the config file asks for: the main one
+    first, then any others in section name order."""
+    interface = ''
+    if config.has_option('pygopherd', 'interface'):
+        interface = config.get('pygopherd', 'interface')
+    if interface.find(':') != -1 and not interface.startswith('['):
+        interface = '[%s]' % interface      # A bare IPv6 address
+    family, address = parseaddress(interface,
+                                   config.getint('pygopherd', 'port'))
+    retval = [Listener('main', family, address)]
+
+    sections = [section for section in config.sections() \
+                if section.startswith('listener.')]
+    sections.sort()
+    for section in sections:
+        family, address = parseaddress(config.get(section, 'address'))
+        listener = Listener(section[9:], family, address)
+        if config.has_option(section, 'protocols'):
+            listener.protocols = config.get(section, 'protocols')
+        if config.has_option(section, 'proxyprotocol'):
+            listener.proxyprotocol = config.getboolean(section,
+                                                       'proxyprotocol')
+        if config.has_option(section, 'servername'):
+            listener.servername = config.get(section, 'servername')
+        if config.has_option(section, 'advertisedport'):
+            listener.advertisedport = config.getint(section, 'advertisedport')
+        if config.has_option(section, 'tls'):
+            listener.tls = config.getboolean(section, 'tls')
+        retval.append(listener)
+    return retval
+
+proxyv2signature = '\r\n\r\n\0\r\nQUIT\n'
+
+def readproxyheader(rfile):
+    """Reads the PROXY protocol header, version 1 or 2, a proxy sends
+    ahead of the client's request.  Returns the client's (address, port),
+    or None if the proxy connected on its own behalf.  Raises
+    deadline.ClientError if there is no valid header; a connection to a
+    listener expecting one must not be trusted without it."""
+    start = rfile.read(6)
+    if start == 'PROXY ':
+        line = rfile.readline(102)
+        if not line.endswith('\r\n'):
+            raise deadline.ClientError, "bad PROXY header"
+        fields = line.split()
+        if fields and fields[0] == 'UNKNOWN':
+            return None
+        if len(fields) != 5 or not fields[0] in ['TCP4', 'TCP6']:
+            raise deadline.ClientError, "bad PROXY header"
+        try:
+            return (fields[1], int(fields[3]))
+        except ValueError:
+            raise deadline.ClientError, "bad PROXY header"
+
+    if start != proxyv2signature[:6]:
+        raise deadline.ClientError, "missing PROXY header"
+    header = start + rfile.read(10)
+    if len(header) != 16 or header[:12] != proxyv2signature or \
+       ord(header[12]) >> 4 != 2:
+        raise deadline.ClientError, "missing PROXY header"
+    command = ord(header[12]) & 0xf
+    family = ord(header[13])
+    length = struct.unpack('>H', header[14:16])[0]
+    data = rfile.read(length)
+    if len(data) != length:
+        raise deadline.ClientError, "short PROXY header"
+    if command == 0:                    # LOCAL
+        return None
+    if family == 0x11 and length >= 12:     # TCP over IPv4
+        return (socket.inet_ntoa(data[0:4]),
+                struct.unpack('>H', data[8:10])[0])
+    if family == 0x21 and length >= 36:     # TCP over IPv6
+        return (socket.inet_ntop(socket.AF_INET6, data[0:16]),
+                struct.unpack('>H', data[32:34])[0])
+    return None
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of listeners
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socket, struct, threading, tempfile, shutil, os
+from StringIO import StringIO
+from pygopherd import listeners, deadline, initialization, testutil
+from pygopherd.handlers import base
+
+class ListenersTestCase(unittest.TestCase):
+    def testparseaddress(self):
+        self.assertEquals(listeners.parseaddress('unix:/run/gopher'),
+                          (socket.AF_UNIX, '/run/gopher'))
+        self.assertEquals(listeners.parseaddress('127.0.0.1:7070'),
+                          (socket.AF_INET, ('127.0.0.1', 7070)))
+        self.assertEquals(listeners.parseaddress('127.0.0.1'),
+                          (socket.AF_INET, ('127.0.0.1', 70)))
+        self.assertEquals(listeners.parseaddress(':80'),
+                          (socket.AF_INET, ('0.0.0.0', 80)))
+        self.assertEquals(listeners.parseaddress('8070'),
+                          (socket.AF_INET, ('0.0.0.0', 8070)))
+        family, address = listeners.parseaddress('[::1]:80')
+        self.assertEquals((family, address[:2]),
+                          (socket.AF_INET6, ('::1', 80)))
+
+    def testgetlisteners(self):
+        config = testutil.getconfig()
+        config.set("pygopherd", "interface", "::1")
+        config.add_section("listener.web")
+        config.set("listener.web", "address", "127.0.0.1:8080")
+        config.set("listener.web", "protocols", "[http.HTTPProtocol]")
+        config.set("listener.web", "advertisedport", "80")
+        config.add_section("listener.proxy")
+        config.set("listener.proxy", "address", "unix:/tmp/gopher")
+        config.set("listener.proxy", "proxyprotocol", "yes")
+        main, proxy, web = listeners.getlisteners(config)
+        self.assertEquals((main.family, main.address[:2], main.protocols),
+                          (socket.AF_INET6, ('::1', 70), None))
+        self.assertEquals((proxy.name, proxy.address, proxy.proxyprotocol),
+                          ('proxy', '/tmp/gopher', 1))
+        self.assertEquals((web.address, web.protocols, web.advertisedport),
+                          (('127.0.0.1', 8080), '[http.HTTPProtocol]', 80))
+
+    def read(self, data):
+        rfile = StringIO(data)
+        return listeners.readproxyheader(rfile), rfile.read()
+
+    def testproxyv1(self):
+        self.assertEquals(self.read("PROXY TCP4 192.0.2.5 192.0.2.1 "
+                                    "5555 70\r\n/\r\n"),
+                          (('192.0.2.5', 5555), "/\r\n"))
+        self.assertEquals(self.read("PROXY TCP6 2001:db8::5 2001:db8::1 "
+                                    "5555 70\r\n/\r\n"),
+                          (('2001:db8::5', 5555), "/\r\n"))
+        self.assertEquals(self.read("PROXY UNKNOWN\r\n/\r\n"),
+                          (None, "/\r\n"))
+        self.assertRaises(deadline.ClientError, self.read, "/\r\n")
+        self.assertRaises(deadline.ClientError, self.read,
+                          "PROXY TCP4 192.0.2.5\r\n")
+
+    def testproxyv2(self):
+        addresses = socket.inet_aton('192.0.2.5') + \
+                    socket.inet_aton('192.0.2.1') + struct.pack('>HH', 5555, 70)
+        header = listeners.proxyv2signature + '\x21\x11' + \
+                 struct.pack('>H', len(addresses)) + addresses
+        self.assertEquals(self.read(header + "/\r\n"),
+                          (('192.0.2.5', 5555), "/\r\n"))
+        addresses = socket.inet_pton(socket.AF_INET6, '2001:db8::5') + \
+                    socket.inet_pton(socket.AF_INET6, '2001:db8::1') + \
+                    struct.pack('>HH', 5555, 70)
+        header = listeners.proxyv2signature + '\x21\x21' + \
+                 struct.pack('>H', len(addresses)) + addresses
+        self.assertEquals(self.read(header + "/\r\n"),
+                          (('2001:db8::5', 5555), "/\r\n"))
+        local = listeners.proxyv2signature + '\x20\x00\x00\x00'
+        self.assertEquals(self.read(local + "/\r\n"), (None, "/\r\n"))
+        self.assertRaises(deadline.ClientError, self.read,
+                          listeners.proxyv2signature + '\x21\x11\x00\x0c')
+
+class MultipleListenersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.unixpath = os.path.join(self.dir, '.gopher')
+        fd = open(os.path.join(self.dir, 'README'), 'w')
+        fd.write('Read me\n')
+        fd.close()
+        config = testutil.getconfig()
+        config.set("pygopherd", "root", self.dir)
+        base.rootpath = self.dir
+        config.set("pygopherd", "servertype", "ThreadingTCPServer")
+        config.set("pygopherd", "interface", "127.0.0.1")
+        config.set("pygopherd", "port", "0")
+        config.set("logger", "logmethod", "none")
+        config.add_section("listener.web")
+        config.set("listener.web", "address", "[::1]:0")
+        config.set("listener.web", "protocols", "[http.HTTPProtocol]")
+        config.add_section("listener.proxy")
+        config.set("listener.proxy", "address", "unix:" + self.unixpath)
+        config.set("listener.proxy", "protocols", "[rfc1436.GopherProtocol]")
+        config.set("listener.proxy", "proxyprotocol", "yes")
+        config.set("listener.proxy", "advertisedport", "70")
+        config.set("handlers.stats.StatsHandler", "allowfrom", "192.0.2.5")
+        config.set("admission", "maxperaddress", "16")
+        initialization.initlogger(config, 'TESTING')
+        self.server = initialization.getserverobject(config)
+        self.thread = threading.Thread(target = self.server.serve_forever,
+                                       args = (0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        for server in self.server.listeners:
+            server.server_close()
+        base.rootpath = None
+        shutil.rmtree(self.dir)
+
+    def request(self, listener, data):
+        server = self.server.listeners[listener]
+        sock = socket.socket(server.address_family, socket.SOCK_STREAM)
+        sock.connect(server.socket.getsockname())
+        sock.sendall(data)
+        retval = ''
+        while 1:
+            try:
+                chunk = sock.recv(4096)
+            except socket.error:
+                # Dropped without reading what was sent.
+                break
+            if not chunk:
+                break
+            retval += chunk
+        sock.close()
+        return retval
+
+    def testlisteners(self):
+        main, proxy, web = self.server.listeners
+        self.assertEquals((main.server_port, proxy.server_port),
+                          (main.socket.getsockname()[1], 70))
+        self.assertEquals(self.request(0, "/README\r\n"), "Read me\n")
+        assert self.request(0, "GET /README HTTP/1.0\r\n\r\n").startswith(
+            "HTTP/1.0 200 OK")
+
+        # Each listener speaks only its own protocols.
+        assert self.request(2, "GET /README HTTP/1.0\r\n\r\n").startswith(
+            "HTTP/1.0 200 OK")
+        self.assertEquals(self.request(2, "/README\r\n"), "")
+        assert self.request(1, "PROXY UNKNOWN\r\nGET / HTTP/1.0\r\n\r\n"). \
+               startswith("3'/GET / HTTP/1.0' does not exist")
+
+        # The client is the one the proxy names, and it must name one.
+        stats = "PROXY TCP4 192.0.2.5 192.0.2.1 5555 70\r\n/server-stats\r\n"
+        assert self.request(1, stats).startswith("Connections per address")
+        self.assertEquals(self.request(1, "/server-stats\r\n"), "")
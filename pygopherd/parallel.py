@@ -0,0 +1,67 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: running independent calls on a few threads
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, Queue
+try:
+    import threading
+except ImportError:
+    threading = None
+
+def parallelmap(func, items, maxthreads):
+    """Like map(func, items), but with up to maxthreads calls of func
+    running at once.  This pays off when func mostly waits on I/O, such as
+    stat() on a network filesystem.
+
+    The results are in the same order as items.  If any call raises an
+    exception, the one for the earliest item is re-raised once all the
+    threads are done.  With maxthreads of 1 or less, or without thread
+    support, this is just map()."""
+    items = list(items)
+    if maxthreads <= 1 or len(items) <= 1 or not threading:
+        return map(func, items)
+
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    pending = Queue.Queue()
+    for i in range(len(items)):
+        pending.put(i)
+
+    def worker():
+        while 1:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(items[i])
+            except:
+                errors[i] = sys.exc_info()
+
+    threads = []
+    for i in range(min(maxthreads, len(items))):
+        thread = threading.Thread(target = worker)
+        thread.setDaemon(1)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    for error in errors:
+        if error:
+            raise error[0], error[1], error[2]
+    return results
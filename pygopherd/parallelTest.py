@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of parallelmap
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, time, random, threading
+from pygopherd import parallel
+
+class ParallelMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.maxrunning = 0
+
+    def slowsquare(self, x):
+        self.lock.acquire()
+        self.running += 1
+        self.maxrunning = max(self.maxrunning, self.running)
+        self.lock.release()
+        # Finish in a different order than we started.
+        time.sleep(random.random() * 0.01)
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+        return x * x
+
+    def testorder(self):
+        items = range(50)
+        self.assertEquals(parallel.parallelmap(self.slowsquare, items, 8),
+                          map(lambda x: x * x, items))
+        assert self.maxrunning > 1
+        assert self.maxrunning <= 8
+
+    def testserial(self):
+        self.assertEquals(parallel.parallelmap(self.slowsquare, range(5), 1),
+                          [0, 1, 4, 9, 16])
+        self.assertEquals(self.maxrunning, 1)
+
+    def testexception(self):
+        def func(x):
+            if x % 10 == 3:
+                raise ValueError, x
+            return x
+        try:
+            parallel.parallelmap(func, range(30), 4)
+        except ValueError, e:
+            self.assertEquals(e.args, (3,))
+        else:
+            self.fail("No exception raised")
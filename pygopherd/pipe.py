@@ -25,15 +25,35 @@ def pipedata_unix(file, args, environ = os.environ,
                   childstdout = None,
                   childstderr = None,
                   pathsearch = 0):
+    readfd = writefd = None
+    if childstdout and not hasattr(childstdout, 'fileno'):
+        # The program needs a real file for its output; pass it on from
+        # a pipe as it comes.
+        readfd, writefd = os.pipe()
+
     pid = os.fork()
     if pid:
         # Parent.
+        if readfd != None:
+            os.close(writefd)
+            try:
+                while 1:
+                    data = os.read(readfd, 4096)
+                    if not len(data):
+                        break
+                    childstdout.write(data)
+            finally:
+                os.close(readfd)
         return os.waitpid(pid, 0)[1]
     else:
         # Child.
         if childstdin:
             os.dup2(childstdin.fileno(), 0)
-        if childstdout:
+        if writefd != None:
+            os.dup2(writefd, 1)
+            os.close(readfd)
+            os.close(writefd)
+        elif childstdout:
             os.dup2(childstdout.fileno(), 1)
         if childstderr:
             os.dup2(childstderr.fileno(), 2)
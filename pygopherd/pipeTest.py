@@ -24,6 +24,21 @@ class PipeTestCase(unittest.TestCase):
         self.assertEquals(retval, 0)
         outputfd.close()
         
+    def testNoFileno(self):
+        # Output to something with no descriptor is passed on as it comes.
+        class Writer:
+            def __init__(self):
+                self.blocks = []
+            def write(self, data):
+                self.blocks.append(data)
+        writer = Writer()
+        retval = pipe.pipedata("/bin/sh", ["/bin/sh", "-c",
+                                           "echo Starting; exit 3"],
+                               childstdout = writer)
+        self.assertEquals(''.join(writer.blocks), "Starting\n")
+        self.assert_(os.WIFEXITED(retval), "WIFEXITED was not true")
+        self.assertEquals(os.WEXITSTATUS(retval), 3)
+
     def testFailingPipe(self):
         outputfd = os.tmpfile()
         
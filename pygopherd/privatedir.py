@@ -0,0 +1,46 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: directories private to the server
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os, stat, errno
+
+def makeprivatedir(path):
+    """Makes the directory path, readable and writable by this user
+    alone, if it doesn't exist.  Raises OSError if it does but is not a
+    real directory, owned by this user, with mode 0700.  Anyone else able
+    to make or change it, as anyone can in /tmp, could plant files there
+    for the server to trust."""
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e[0] != errno.EEXIST:
+            raise
+    statval = os.lstat(path)
+    if not stat.S_ISDIR(statval.st_mode):
+        raise OSError, (errno.ENOTDIR, "%s is not a directory" % path)
+    if statval.st_uid != os.getuid():
+        raise OSError, (errno.EPERM, "%s is owned by uid %d, not %d" % \
+                        (path, statval.st_uid, os.getuid()))
+    if stat.S_IMODE(statval.st_mode) != 0700:
+        raise OSError, (errno.EPERM, "%s has mode %o, not 700" % \
+                        (path, stat.S_IMODE(statval.st_mode)))
+
+def createexclusive(path, mode = 0600):
+    """Opens a new file at path for writing, failing rather than
+    following a symbolic link or reusing a file already there."""
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | \
+                             getattr(os, 'O_NOFOLLOW', 0), mode), 'wb')
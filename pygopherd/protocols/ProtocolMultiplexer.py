@@ -22,7 +22,10 @@ from pygopherd.GopherExceptions import FileNotFound
 import re
 
 def getProtocol(request, server, requesthandler, rfile, wfile, config):
-    p = eval(config.get("protocols.ProtocolMultiplexer", "protocols"))
+    # A listener may have its own list.
+    p = getattr(server, 'protocols', None) or \
+        config.get("protocols.ProtocolMultiplexer", "protocols")
+    p = eval(p)
 
     for protocol in p:
         ptry = protocol(request, server, requesthandler, rfile, wfile, config)
@@ -20,7 +20,7 @@
 import SocketServer
 import re, binascii
 import os, stat, os.path, mimetypes, urllib, time
-from pygopherd import handlers, protocols, GopherExceptions
+from pygopherd import handlers, protocols, GopherExceptions, deadline
 from pygopherd.protocols.base import BaseGopherProtocol
 import pygopherd.version
 import cgi
@@ -39,6 +39,11 @@ class HTTPProtocol(BaseGopherProtocol):
             return
         # Slurp up remaining lines.
         self.httpheaders = {}
+        maxheaders = 100
+        if self.config.has_option("protocols.http.HTTPProtocol", "maxheaders"):
+            maxheaders = self.config.getint("protocols.http.HTTPProtocol",
+                                            "maxheaders")
+        count = 0
         while 1:
             line = self.rfile.readline()
             if not len(line):
@@ -46,6 +51,10 @@ class HTTPProtocol(BaseGopherProtocol):
             line = line.strip()
             if not len(line):
                 break
+            count += 1
+            if count > maxheaders:
+                raise deadline.RequestTooLarge, \
+                      "more than %d headers" % maxheaders
             splitline = line.split(':', 1)
             if len(splitline) == 2:
                 self.httpheaders[splitline[0].lower()] = splitline[1]
@@ -0,0 +1,350 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: persistent script workers
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Persistent script workers.
+
+Instead of being run once per request, a script can stay running and
+answer many requests.  The server talks to it with SCGI over a Unix
+socket: each request is a netstring of NUL-separated header names and
+values (CONTENT_LENGTH, SCGI, then SELECTOR, REQUEST, ARGS and the rest of
+the variables a script would get in its environment), and the response is
+whatever the script writes before closing the connection -- the document
+itself, with no headers.
+
+For each script, a supervisor process listens on the socket and keeps
+the configured number of copies of the script running.  Each copy is
+started with the listening socket as its standard input, as with
+FastCGI, and should accept connections on it; serve() does this for
+scripts written in Python.  Copies that exit are restarted, and all are
+restarted if the script changes.  The supervisor stays in the server's
+process group, so it goes away with the server.
+
+A script that serves requests this way gets PYGOPHERD_WORKER=1 in its
+environment, and the request timeout in PYGOPHERD_TIMEOUT."""
+
+import os, sys, socket, signal, time, errno, fcntl, hashlib, traceback
+from pygopherd import privatedir
+from stat import *
+
+###########################################################################
+# The wire protocol
+###########################################################################
+
+def encoderequest(environ):
+    headers = ['CONTENT_LENGTH', '0', 'SCGI', '1']
+    for key, value in environ.items():
+        if key in ('CONTENT_LENGTH', 'SCGI'):
+            continue
+        headers.extend([key, str(value)])
+    data = '\0'.join(headers) + '\0'
+    return '%d:%s,' % (len(data), data)
+
+def readrequest(rfile):
+    """Reads a request from rfile; returns its headers as a dict."""
+    length = ''
+    while 1:
+        char = rfile.read(1)
+        if char == ':':
+            break
+        if not char.isdigit() or len(length) > 10:
+            raise ValueError, "Malformed SCGI request"
+        length += char
+    data = rfile.read(int(length))
+    if len(data) != int(length) or rfile.read(1) != ',':
+        raise ValueError, "Malformed SCGI request"
+    items = data.split('\0')[:-1]
+    environ = {}
+    for i in range(0, len(items) - 1, 2):
+        environ[items[i]] = items[i + 1]
+    bodylength = int(environ.get('CONTENT_LENGTH', '0'))
+    if bodylength:
+        rfile.read(bodylength)
+    return environ
+
+###########################################################################
+# The script's side
+###########################################################################
+
+def serve(func, listenfd = 0):
+    """Answers requests forever, for a script running as a persistent
+    worker.  func(environ, wfile) is called for each; what it writes to
+    wfile is sent to the client.  A request that runs longer than the
+    server's timeout ends this process, and the supervisor starts a new
+    one."""
+    listener = socket.fromfd(listenfd, socket.AF_UNIX, socket.SOCK_STREAM)
+    timeout = int(os.environ.get('PYGOPHERD_TIMEOUT', '0'))
+    while 1:
+        conn, address = listener.accept()
+        rfile = conn.makefile('rb')
+        wfile = conn.makefile('wb')
+        try:
+            environ = readrequest(rfile)
+            if timeout:
+                signal.alarm(timeout)
+            func(environ, wfile)
+            signal.alarm(0)
+            wfile.flush()
+        except (socket.error, ValueError):
+            pass
+        except:
+            signal.alarm(0)
+            traceback.print_exc()
+        # The connection stays open until all of these are closed.
+        for fd in (wfile, rfile, conn):
+            try:
+                fd.close()
+            except socket.error:
+                pass
+
+###########################################################################
+# The server's side
+###########################################################################
+
+def getsocketname(workerdir, script):
+    return os.path.join(workerdir, hashlib.md5(script).hexdigest() + '.sock')
+
+def connectto(sockname, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if timeout:
+            sock.settimeout(timeout)
+        sock.connect(sockname)
+    except:
+        sock.close()
+        raise
+    return sock
+
+def connect(script, count, timeout, workerdir, masterpid = None):
+    """Returns a socket connected to a worker for script, starting the
+    workers if they aren't running.  If masterpid is given, the workers
+    stop when that process does."""
+    sockname = getsocketname(workerdir, script)
+    try:
+        return connectto(sockname, timeout)
+    except socket.error:
+        pass
+
+    # Whoever can write to workerdir could answer for the workers.
+    try:
+        privatedir.makeprivatedir(workerdir)
+    except OSError, e:
+        raise IOError, (e[0], "script workers unavailable: %s" % e[1])
+    # Only one request starts the workers.
+    lockfd = open(sockname + '.lock', 'w')
+    try:
+        fcntl.flock(lockfd.fileno(), fcntl.LOCK_EX)
+        try:
+            return connectto(sockname, timeout)
+        except socket.error:
+            pass
+        startsupervisor(script, sockname, count, timeout, masterpid)
+        deadline = time.time() + 10
+        while 1:
+            try:
+                return connectto(sockname, timeout)
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.02)
+    finally:
+        lockfd.close()
+
+def request(script, count, timeout, workerdir, environ, wfile,
+            masterpid = None):
+    """Has a worker for script answer the request described by environ,
+    copying the response to wfile.  Raises socket.timeout if the whole
+    response takes longer than timeout seconds, however steadily it
+    trickles in."""
+    if timeout:
+        deadline = time.time() + timeout
+    sock = connect(script, count, timeout, workerdir, masterpid)
+    try:
+        sock.sendall(encoderequest(environ))
+        while 1:
+            if timeout:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout, \
+                          "script took longer than %d seconds" % timeout
+                sock.settimeout(remaining)
+            data = sock.recv(8192)
+            if not data:
+                break
+            wfile.write(data)
+    finally:
+        sock.close()
+
+def stopworkers(script, workerdir):
+    """Stops the supervisor and workers for script, if running."""
+    sockname = getsocketname(workerdir, script)
+    try:
+        fd = open(sockname + '.pid')
+        pid = int(fd.read())
+        fd.close()
+        os.kill(pid, signal.SIGTERM)
+    except (IOError, OSError, ValueError):
+        return
+    # It removes its pid file once its workers have stopped.
+    for i in range(250):
+        if not os.path.exists(sockname + '.pid'):
+            return
+        time.sleep(0.02)
+
+def startsupervisor(script, sockname, count, timeout, masterpid = None):
+    """Starts a supervisor process, detached from this one, that listens
+    on sockname and keeps count copies of script running."""
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        if os.fork():
+            os._exit(0)
+        # Don't hold on to the client's connection, or anything else.
+        devnull = os.open('/dev/null', os.O_RDWR)
+        os.dup2(devnull, 0)
+        os.dup2(devnull, 1)
+        try:
+            maxfd = os.sysconf('SC_OPEN_MAX')
+        except (AttributeError, ValueError):
+            maxfd = 256
+        os.closerange(3, maxfd)
+        Supervisor(script, sockname, count, timeout, masterpid).run()
+    except:
+        traceback.print_exc()
+    os._exit(0)
+
+class Supervisor:
+    # How often to look for exited workers and a changed script.
+    interval = 0.2
+    # Workers that exit sooner than this after starting are restarted
+    # only after this long, so a broken script can't spin.
+    minlifetime = 1
+
+    def __init__(self, script, sockname, count, timeout, masterpid = None):
+        self.script = script
+        self.sockname = sockname
+        self.count = count
+        self.timeout = timeout
+        self.masterpid = masterpid
+        self.workers = {}               # pid -> time started
+        self.running = 1
+
+    def getscriptkey(self):
+        try:
+            statval = os.stat(self.script)
+            return (statval[ST_MTIME], statval[ST_SIZE], statval[ST_INO])
+        except OSError:
+            return None
+
+    def listen(self):
+        try:
+            os.unlink(self.sockname)
+        except OSError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.sockname)
+        self.listener.listen(socket.SOMAXCONN)
+        fd = open(self.sockname + '.pid', 'w')
+        fd.write("%d\n" % os.getpid())
+        fd.close()
+
+    def stop(self, signum = None, frame = None):
+        self.running = 0
+
+    def ismasterrunning(self):
+        if not self.masterpid:
+            return 1
+        try:
+            os.kill(self.masterpid, 0)
+        except OSError, e:
+            return e[0] == errno.EPERM
+        return 1
+
+    def startworker(self):
+        environ = os.environ.copy()
+        environ['PYGOPHERD_WORKER'] = '1'
+        environ['PYGOPHERD_TIMEOUT'] = str(self.timeout or 0)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return
+        try:
+            os.dup2(self.listener.fileno(), 0)
+            self.listener.close()
+            for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGALRM):
+                signal.signal(signum, signal.SIG_DFL)
+            os.execve(self.script, [self.script], environ)
+        except:
+            traceback.print_exc()
+        os._exit(255)
+
+    def reap(self):
+        """Forgets workers that have exited.  Returns how long to wait
+        before starting new ones."""
+        delay = 0
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if not pid:
+                break
+            if self.workers.has_key(pid):
+                if time.time() - self.workers[pid] < self.minlifetime:
+                    delay = self.minlifetime
+                del self.workers[pid]
+        return delay
+
+    def stopworkers(self):
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.workers.keys():
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.workers = {}
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.stop)
+        self.listen()
+        scriptkey = self.getscriptkey()
+        try:
+            while self.running:
+                delay = self.reap()
+                if delay:
+                    time.sleep(delay)
+                while len(self.workers) < self.count:
+                    self.startworker()
+                time.sleep(self.interval)
+                if self.getscriptkey() != scriptkey or \
+                   not self.ismasterrunning():
+                    # Changed or gone; the next request starts over.
+                    break
+        finally:
+            self.stopworkers()
+            for name in (self.sockname, self.sockname + '.pid'):
+                try:
+                    os.unlink(name)
+                except OSError:
+                    pass
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of persistent script workers
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, sys, tempfile, shutil, time, socket
+from StringIO import StringIO
+from pygopherd import scriptworkers, testutil
+from pygopherd.handlers import base, scriptexec
+
+workersource = """#!%s
+import sys, os, time
+sys.path.insert(0, %r)
+from pygopherd import scriptworkers
+
+def answer(environ, wfile):
+    if environ['ARGS'] == 'crash':
+        os._exit(1)
+    if environ['ARGS'] == 'hang':
+        time.sleep(60)
+    if environ['ARGS'] == 'trickle':
+        for i in range(100):
+            wfile.write('.')
+            wfile.flush()
+            time.sleep(0.1)
+    wfile.write("%%s %%s %%d\\n" %% (environ['REQUEST'], environ['ARGS'],
+                                  os.getpid()))
+
+scriptworkers.serve(answer)
+"""
+
+class ScriptWorkersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.workerdir = os.path.join(self.root, 'workers')
+        self.script = os.path.join(self.root, 'worker.py')
+        fd = open(self.script, 'w')
+        fd.write(workersource % (sys.executable, os.path.abspath('.')))
+        fd.close()
+        os.chmod(self.script, 0755)
+
+    def tearDown(self):
+        scriptworkers.stopworkers(self.script, self.workerdir)
+        shutil.rmtree(self.root)
+
+    def request(self, args, timeout = 10):
+        wfile = StringIO()
+        scriptworkers.request(self.script, 1, timeout, self.workerdir,
+                              {'REQUEST': '/worker.py', 'ARGS': args}, wfile)
+        return wfile.getvalue().split()
+
+    def testprotocol(self):
+        environ = {'SELECTOR': '/a|b', 'EMPTY': ''}
+        data = scriptworkers.encoderequest(environ)
+        assert data.startswith('%d:CONTENT_LENGTH\0' % (len(data) - 4))
+        self.assertEquals(scriptworkers.readrequest(StringIO(data + 'x')),
+                          {'SELECTOR': '/a|b', 'EMPTY': '',
+                           'CONTENT_LENGTH': '0', 'SCGI': '1'})
+        self.assertRaises(ValueError, scriptworkers.readrequest,
+                          StringIO('12:short,'))
+
+    def testpersistent(self):
+        first = self.request('one')
+        self.assertEquals(first[0:2], ['/worker.py', 'one'])
+        # The same process answers again.
+        self.assertEquals(self.request('two')[2], first[2])
+
+        # A worker that dies is replaced.
+        self.assertEquals(self.request('crash'), [])
+        second = self.request('three')
+        self.assertEquals(second[1], 'three')
+        assert second[2] != first[2]
+
+    def testtimeout(self):
+        # Workers are ended after 2 seconds; the client gives up first.
+        self.request('start', 2)
+        self.assertRaises(socket.timeout, self.request, 'hang', 1)
+        # The worker was ended; a new one answers.
+        self.assertEquals(self.request('after')[1], 'after')
+
+    def testdeadline(self):
+        # A response that keeps coming is still cut off in time.
+        self.request('start', 10)
+        start = time.time()
+        self.assertRaises(socket.timeout, self.request, 'trickle', 1)
+        assert time.time() - start < 2
+
+    def testprivate(self):
+        self.assertEquals(self.request('one')[1], 'one')
+        self.assertEquals(os.stat(self.workerdir).st_mode & 0777, 0700)
+        scriptworkers.stopworkers(self.script, self.workerdir)
+        # Others could answer in the workers' place.
+        os.chmod(self.workerdir, 0777)
+        self.assertRaises(IOError, self.request, 'two')
+        os.chmod(self.workerdir, 0700)
+        os.rename(self.workerdir, self.workerdir + '.real')
+        os.symlink(self.workerdir + '.real', self.workerdir)
+        self.assertRaises(IOError, self.request, 'three')
+
+    def testexechandler(self):
+        config = testutil.getconfig()
+        config.set("pygopherd", "root", self.root)
+        config.set("handlers.scriptexec.ExecHandler", "persistent",
+                   "{'/worker.py$': 1}")
+        config.set("handlers.scriptexec.ExecHandler", "workerdir",
+                   self.workerdir)
+        base.rootpath = self.root
+        scriptexec.persistent = None
+        try:
+            protocol = testutil.gettestingprotocol("/worker.py|x y\n", config)
+            handler = scriptexec.ExecHandler('/worker.py|x y', '', protocol,
+                                             config, None)
+            assert handler.canhandlerequest()
+            wfile = StringIO()
+            handler.write(wfile)
+            self.assertEquals(wfile.getvalue().split()[0:3],
+                              ['/worker.py', 'x', 'y'])
+        finally:
+            base.rootpath = None
+            scriptexec.persistent = None
@@ -0,0 +1,426 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: full-text search index
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Inverted indexes of words, for searching.
+
+An index file holds, for each word, the documents it appears in and how
+much weight it has in each.  It is laid out so that it can be searched
+through mmap without reading it in:
+
+    header:     magic, then document count, word count, and the offsets
+                of the word table and document table
+    words:      the words themselves, sorted, one after another
+    postings:   for each word, (document number, weight) pairs
+    word table: for each word, in order, the offset and length of the
+                word, and the offset and count of its postings
+    doc table:  document count + 1 offsets of the documents
+    documents:  each document's description, marshalled
+
+Indexer keeps the index of the documents under the server root up to
+date, reading again only the files that changed since the last update."""
+
+from pygopherd import GopherExceptions, gopherentry, zipfile
+from stat import *
+import os, re, struct, mmap, marshal, math
+
+magic = 'PYGIDX01'
+headerformat = '>8sIIII'
+wordformat = '>IHII'
+postingformat = '>II'
+
+wordpatt = re.compile('[a-z0-9]{2,40}')
+
+def getwords(text):
+    """Returns the words of text, lowercased."""
+    return wordpatt.findall(text.lower())
+
+def addwords(words, text, weight):
+    """Adds weight to words, a dictionary, for each word in text."""
+    for word in getwords(text):
+        words[word] = words.get(word, 0) + weight
+
+def writeindex(filename, docs):
+    """Writes an index of docs, a list of (description, words), to
+    filename.  Each description is any marshallable object.  words maps
+    each word in the document to its weight there."""
+    postings = {}
+    for docid in range(len(docs)):
+        for word, weight in docs[docid][1].items():
+            if not postings.has_key(word):
+                postings[word] = []
+            postings[word].append(struct.pack(postingformat, docid, weight))
+    words = postings.keys()
+    words.sort()
+
+    headersize = struct.calcsize(headerformat)
+    wordtext = ''.join(words)
+    offset = headersize + len(wordtext)
+    wordtable = []
+    postingdata = []
+    wordoffset = headersize
+    for word in words:
+        wordtable.append(struct.pack(wordformat, wordoffset, len(word),
+                                     offset, len(postings[word])))
+        wordoffset += len(word)
+        data = ''.join(postings[word])
+        postingdata.append(data)
+        offset += len(data)
+
+    wordtableoffset = offset
+    doctableoffset = wordtableoffset + \
+                     len(words) * struct.calcsize(wordformat)
+    docdata = [marshal.dumps(doc[0]) for doc in docs]
+    offset = doctableoffset + (len(docs) + 1) * 4
+    doctable = []
+    for data in docdata:
+        doctable.append(struct.pack('>I', offset))
+        offset += len(data)
+    doctable.append(struct.pack('>I', offset))
+
+    # Write and rename, so readers never see half a file.
+    tempname = filename + '.%d' % os.getpid()
+    fd = open(tempname, 'wb')
+    try:
+        fd.write(struct.pack(headerformat, magic, len(docs), len(words),
+                             wordtableoffset, doctableoffset))
+        fd.write(wordtext)
+        fd.writelines(postingdata)
+        fd.writelines(wordtable)
+        fd.writelines(doctable)
+        fd.writelines(docdata)
+    finally:
+        fd.close()
+    os.rename(tempname, filename)
+
+class Index:
+    """Base class for indexes.  Subclasses set doccount and supply
+    getpostings and getdoc."""
+
+    def search(self, query, maxresults = None):
+        """Returns the descriptions of the documents that have every word
+        of query, best match first.  Matches score the weight of each
+        word in them, counting rarer words for more."""
+        scores = None
+        words = getwords(query)
+        for word in dict.fromkeys(words).keys():
+            postings = self.getpostings(word)
+            if not postings:
+                return []
+            rarity = math.log(1.0 + float(self.doccount) / len(postings))
+            if scores == None:
+                scores = {}
+                for docid, weight in postings.items():
+                    scores[docid] = weight * rarity
+            else:
+                for docid in scores.keys():
+                    if postings.has_key(docid):
+                        scores[docid] += postings[docid] * rarity
+                    else:
+                        del scores[docid]
+        if not scores:
+            return []
+        ranked = [(-score, docid) for docid, score in scores.items()]
+        ranked.sort()
+        if maxresults:
+            ranked = ranked[:maxresults]
+        return [self.getdoc(docid) for score, docid in ranked]
+
+class MemoryIndex(Index):
+    """An index of docs, as given to writeindex, kept in memory; for when
+    there is nowhere to write an index file."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.doccount = len(docs)
+        self.postings = {}
+        for docid in range(len(docs)):
+            for word, weight in docs[docid][1].items():
+                if not self.postings.has_key(word):
+                    self.postings[word] = {}
+                self.postings[word][docid] = weight
+
+    def getpostings(self, word):
+        return self.postings.get(word, {})
+
+    def getdoc(self, docid):
+        return self.docs[docid][0]
+
+class IndexReader(Index):
+    """Searches an index file written by writeindex, through mmap."""
+
+    def __init__(self, filename):
+        fd = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        (filemagic, self.doccount, self.wordcount, self.wordtableoffset,
+         self.doctableoffset) = struct.unpack_from(headerformat, self.map)
+        if filemagic != magic:
+            self.map.close()
+            raise ValueError, "%s is not an index file" % filename
+        self.wordsize = struct.calcsize(wordformat)
+
+    def close(self):
+        self.map.close()
+
+    def findword(self, word):
+        """Returns (offset, count) of the postings of word, or None if it
+        is in no document."""
+        low = 0
+        high = self.wordcount
+        while low < high:
+            middle = (low + high) / 2
+            (wordoffset, wordlen, offset, count) = struct.unpack_from(
+                wordformat, self.map,
+                self.wordtableoffset + middle * self.wordsize)
+            found = self.map[wordoffset:wordoffset + wordlen]
+            if found == word:
+                return (offset, count)
+            if found < word:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def getpostings(self, word):
+        """Returns a dictionary mapping the number of each document with
+        word to its weight there."""
+        found = self.findword(word)
+        if not found:
+            return {}
+        (offset, count) = found
+        values = struct.unpack_from('>%dI' % (count * 2), self.map, offset)
+        postings = {}
+        for i in range(0, len(values), 2):
+            postings[values[i]] = values[i + 1]
+        return postings
+
+    def getdoc(self, docid):
+        (start, end) = struct.unpack_from('>II', self.map,
+                                          self.doctableoffset + docid * 4)
+        return marshal.loads(self.map[start:end])
+
+# Open index files, by filename: (key, reader).  A reader is kept until
+# its file is replaced by a newer index.
+readers = {}
+
+def getreader(filename):
+    """Returns an IndexReader for filename, or None if there is no
+    index there."""
+    try:
+        statval = os.stat(filename)
+    except OSError:
+        return None
+    key = (statval[ST_INO], statval[ST_MTIME], statval[ST_SIZE])
+    if readers.has_key(filename):
+        if readers[filename][0] == key:
+            return readers[filename][1]
+        readers[filename][1].close()
+        del readers[filename]
+    try:
+        reader = IndexReader(filename)
+    except (EnvironmentError, ValueError), e:
+        GopherExceptions.log(e)
+        return None
+    readers[filename] = (key, reader)
+    return reader
+
+# Weight of a word in each part of a document.
+nameweight = 10
+keywordsweight = 6
+abstractweight = 3
+textweight = 1
+
+class Indexer:
+    """Indexes the names, abstracts, keywords and text of the documents
+    under the server root, including the contents of ZIP files if the
+    ZIP handler is enabled.  Files the server would run rather than
+    send -- scripts, PYG modules and Python source -- are left out.
+    Each document is described by (selector, type, name, mimetype)."""
+
+    version = 1
+
+    def __init__(self, config, filename, maxfilesize = 1048576):
+        self.config = config
+        self.filename = filename
+        self.statename = filename + '.state'
+        self.maxfilesize = maxfilesize
+        self.ignorepatt = config.get("handlers.dir.DirHandler", "ignorepatt")
+        self.eaexts = eval(config.get("GopherEntry", "eaexts")).keys()
+        self.zippatt = None
+        if config.has_section("handlers.ZIP.ZIPHandler") and \
+           config.getboolean("handlers.ZIP.ZIPHandler", "enabled"):
+            self.zippatt = re.compile(config.get("handlers.ZIP.ZIPHandler",
+                                                 "pattern"))
+
+    def load(self):
+        """Returns what the last update learned: a dictionary mapping
+        each selector to (key, description, words)."""
+        try:
+            fd = open(self.statename, 'rb')
+            try:
+                data = marshal.load(fd)
+            finally:
+                fd.close()
+            if data['version'] == self.version:
+                return data['docs']
+        except (IOError, EOFError, ValueError, TypeError, KeyError):
+            pass
+        return {}
+
+    def save(self):
+        tempname = self.statename + '.%d' % os.getpid()
+        fd = open(tempname, 'wb')
+        try:
+            marshal.dump({'version': self.version, 'docs': self.docs}, fd)
+        finally:
+            fd.close()
+        os.rename(tempname, self.statename)
+
+    def update(self, vfs = None):
+        """Brings the index up to date.  Returns how many documents had
+        to be read."""
+        if vfs == None:
+            from pygopherd.handlers.base import VFS_Real
+            vfs = VFS_Real(self.config)
+        self.olddocs = self.load()
+        self.docs = {}
+        self.reread = 0
+        self.visited = {}
+        try:
+            self.firstvisit(vfs.stat('/'))
+        except OSError:
+            pass
+        self.walk(vfs, '/')
+        del self.visited
+        selectors = self.docs.keys()
+        selectors.sort()
+        writeindex(self.filename, [self.docs[selector][1:] \
+                                   for selector in selectors])
+        self.save()
+        del self.olddocs
+        return self.reread
+
+    def getkey(self, vfs, selector, statval, easelectors):
+        """Returns what, if unchanged, means selector needn't be read
+        again: its size and mtime and those of its extended attribute
+        files."""
+        key = [(statval[ST_MTIME], statval[ST_SIZE])]
+        for easelector in easelectors:
+            try:
+                eastat = vfs.stat(easelector)
+            except OSError:
+                continue
+            key.append((easelector, eastat[ST_MTIME], eastat[ST_SIZE]))
+        return key
+
+    def iszip(self, vfs, selector):
+        from pygopherd.handlers.base import VFS_Real
+        return self.zippatt and vfs.__class__ == VFS_Real and \
+               self.zippatt.search(selector) and \
+               zipfile.is_zipfile(vfs.getfspath(selector))
+
+    def isprogram(self, vfs, selector, statval):
+        """Returns true if selector is a program, as the scriptexec and
+        PYG handlers would run it, or Python source, whose text must not
+        turn up in search results."""
+        from pygopherd.handlers.base import VFS_Real
+        if not S_ISREG(statval[ST_MODE]):
+            return 0
+        if selector.endswith('.pyg') or selector.endswith('.py'):
+            return 1
+        return vfs.__class__ == VFS_Real and \
+               S_IMODE(statval[ST_MODE]) & S_IXOTH
+
+    def firstvisit(self, statval):
+        """Returns true the first time it is given a directory, so that
+        each is read once however many symbolic links lead to it, and a
+        link to a parent doesn't loop forever.  Those in ZIP files have no
+        inode, but can't loop."""
+        if not statval[ST_INO]:
+            return 1
+        dirid = (statval[ST_DEV], statval[ST_INO])
+        if self.visited.has_key(dirid):
+            return 0
+        self.visited[dirid] = 1
+        return 1
+
+    def walk(self, vfs, selector):
+        try:
+            names = vfs.listdir(selector)
+        except OSError:
+            return
+        present = {}
+        for name in names:
+            present[name] = 1
+        for name in names:
+            childselector = selector.rstrip('/') + '/' + name
+            if re.search(self.ignorepatt, childselector):
+                continue
+            try:
+                statval = vfs.stat(childselector)
+            except OSError:
+                continue
+            if self.isprogram(vfs, childselector, statval):
+                continue
+            if S_ISDIR(statval[ST_MODE]):
+                easelectors = [childselector + '/' + ext \
+                               for ext in self.eaexts]
+            else:
+                easelectors = [childselector + ext for ext in self.eaexts \
+                               if present.has_key(name + ext)]
+            self.adddoc(vfs, childselector, statval,
+                        self.getkey(vfs, childselector, statval, easelectors))
+            if S_ISDIR(statval[ST_MODE]):
+                if self.firstvisit(statval):
+                    self.walk(vfs, childselector)
+            elif self.iszip(vfs, childselector):
+                try:
+                    from pygopherd.handlers.ZIP import VFS_Zip
+                    self.walk(VFS_Zip(self.config, vfs, childselector),
+                              childselector)
+                except Exception, e:
+                    GopherExceptions.log(e)
+
+    def adddoc(self, vfs, selector, statval, key):
+        old = self.olddocs.get(selector)
+        if old and old[0] == key:
+            self.docs[selector] = old
+            return
+        self.reread += 1
+        entry = gopherentry.GopherEntry(selector, self.config)
+        entry.populatefromvfs(vfs, selector)
+        words = {}
+        addwords(words, entry.getname(''), nameweight)
+        addwords(words, entry.getea('KEYWORDS', ''), keywordsweight)
+        addwords(words, entry.getea('ABSTRACT', ''), abstractweight)
+        if S_ISREG(statval[ST_MODE]) and not entry.getencoding() and \
+           entry.getmimetype('').startswith('text/') and \
+           entry.getmimetype() != 'text/x-python':
+            try:
+                fd = vfs.open(selector, 'rb')
+                try:
+                    addwords(words, fd.read(self.maxfilesize), textweight)
+                finally:
+                    fd.close()
+            except IOError:
+                pass
+        self.docs[selector] = (key, (selector, entry.gettype(),
+                                     entry.getname(), entry.getmimetype()),
+                               words)
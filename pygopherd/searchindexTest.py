@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the search index
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, tempfile, shutil, time
+from pygopherd import testutil, searchindex
+from pygopherd.handlers import base
+
+class IndexFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testsearch(self):
+        docs = []
+        for i in range(50):
+            words = {'common': 1, 'doc%d' % i: 1}
+            if i % 10 == 0:
+                words['tens'] = 1 + i
+            docs.append((('/doc%d' % i, i), words))
+        searchindex.writeindex(self.filename, docs)
+        reader = searchindex.IndexReader(self.filename)
+        self.assertEquals(reader.search('doc7'), [('/doc7', 7)])
+        self.assertEquals(reader.search('Doc7 COMMON'), [('/doc7', 7)])
+        self.assertEquals(reader.search('doc7 tens'), [])
+        self.assertEquals(reader.search('missing'), [])
+        self.assertEquals(reader.search('?!'), [])
+        # Heavier matches come first.
+        self.assertEquals(reader.search('tens', 3),
+                          [('/doc40', 40), ('/doc30', 30), ('/doc20', 20)])
+        self.assertEquals(len(reader.search('common')), 50)
+        reader.close()
+
+    def testempty(self):
+        searchindex.writeindex(self.filename, [])
+        reader = searchindex.IndexReader(self.filename)
+        self.assertEquals(reader.search('anything'), [])
+        reader.close()
+
+class IndexerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        base.rootpath = self.root
+        self.filename = os.path.join(self.root, '.cache.pygopherd.search')
+        os.mkdir(os.path.join(self.root, 'docs'))
+        self.write('docs/gophers.txt', 'Gophers dig burrows in meadows.\n')
+        self.write('docs/moles.txt', 'Moles dig too.\n')
+        self.write('docs/moles.txt.abstract', 'All about the meadow mole\n')
+        self.write('docs/picture.jpg', 'gophers')
+        self.write('docs/.abstract', 'Animal documents\n')
+
+    def tearDown(self):
+        base.rootpath = None
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        filename = os.path.join(self.root, name)
+        fd = open(filename, 'wb')
+        fd.write(data)
+        fd.close()
+        when = time.time() - 60
+        os.utime(filename, (when, when))
+
+    def search(self, query):
+        reader = searchindex.IndexReader(self.filename)
+        try:
+            return [doc[0] for doc in reader.search(query)]
+        finally:
+            reader.close()
+
+    def testupdate(self):
+        indexer = searchindex.Indexer(self.config, self.filename)
+        self.assertEquals(indexer.update(), 4)
+        self.assertEquals(self.search('dig'), ['/docs/gophers.txt',
+                                               '/docs/moles.txt'])
+        # Names count for more than text; binary files aren't read.
+        self.assertEquals(self.search('gophers'), ['/docs/gophers.txt'])
+        self.assertEquals(self.search('mole'), ['/docs/moles.txt'])
+        self.assertEquals(self.search('animal'), ['/docs'])
+        self.assertEquals(self.search('abstract'), [])
+
+        # Only what changed is read again.
+        self.assertEquals(indexer.update(), 0)
+        self.write('docs/moles.txt.abstract', 'Moles, not voles\n')
+        self.write('docs/voles.txt', 'Voles\n')
+        os.unlink(os.path.join(self.root, 'docs/gophers.txt'))
+        when = time.time() - 30
+        os.utime(os.path.join(self.root, 'docs'), (when, when))
+        self.assertEquals(indexer.update(), 3)
+        self.assertEquals(self.search('voles'), ['/docs/voles.txt',
+                                                 '/docs/moles.txt'])
+        self.assertEquals(self.search('dig'), ['/docs/moles.txt'])
+
+    def testprograms(self):
+        # Nothing the server would run is indexed.
+        self.write('docs/dig.pyg', 'password = "gophers dig"\n')
+        self.write('docs/dig.py', 'password = "gophers dig"\n')
+        self.write('docs/dig.sh', 'echo gophers dig\n')
+        os.chmod(os.path.join(self.root, 'docs/dig.sh'), 0755)
+        indexer = searchindex.Indexer(self.config, self.filename)
+        self.assertEquals(indexer.update(), 4)
+        self.assertEquals(self.search('dig'), ['/docs/gophers.txt',
+                                               '/docs/moles.txt'])
+        self.assertEquals(self.search('password'), [])
+
+    def testsymlinkloop(self):
+        os.symlink('..', os.path.join(self.root, 'docs', 'up'))
+        indexer = searchindex.Indexer(self.config, self.filename)
+        self.assertEquals(indexer.update(), 5)
+        self.assertEquals(self.search('dig'), ['/docs/gophers.txt',
+                                               '/docs/moles.txt'])
@@ -22,6 +22,7 @@ from pygopherd import logger
 
 pgrp = None
 pid = None
+reloadfunc = None
 
 def huphandler(signum, frame):
     logger.log("SIGHUP (%d) received; terminating process" % signum)
@@ -54,3 +55,20 @@ def setsigtermhandler(newpgrp):
     signal.signal(signal.SIGTERM, termhandler)
 
 
+
+def reloadhandler(signum, frame):
+    if os.getpid() != pid:              # Only the master reloads.
+        return
+    logger.log("SIGUSR1 (%d) received in master; reloading" % signum)
+    reloadfunc()
+
+def setsigreloadhandler(func):
+    """Calls func on SIGUSR1 in the master; if func is None, the signal
+    is ignored."""
+    global reloadfunc
+    if 'SIGUSR1' in signal.__dict__:
+        reloadfunc = func
+        if func:
+            signal.signal(signal.SIGUSR1, reloadhandler)
+        else:
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
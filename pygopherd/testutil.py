@@ -22,14 +22,62 @@
 
 from pygopherd import initialization, logger
 from pygopherd.protocols import ProtocolMultiplexer
+from pygopherd.handlers.base import VFS_Real
 from StringIO import StringIO
-import os
+import os, time, threading
 
 def getconfig():
     config = initialization.initconffile('conf/pygopherd.conf')
     config.set("pygopherd", "root", os.path.abspath('./testdata'))
     return config
 
+class VFS_Slow(VFS_Real):
+    """A real filesystem that takes latency seconds to answer each call
+    that would go to the server on a network filesystem.  Counts the calls
+    and the most that were ever waiting at once."""
+    def __init__(self, config, latency, chain = None):
+        VFS_Real.__init__(self, config, chain)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.waiting = 0
+        self.maxwaiting = 0
+
+    def delay(self):
+        self.lock.acquire()
+        self.calls += 1
+        self.waiting += 1
+        self.maxwaiting = max(self.maxwaiting, self.waiting)
+        self.lock.release()
+        time.sleep(self.latency)
+        self.lock.acquire()
+        self.waiting -= 1
+        self.lock.release()
+
+    def stat(self, selector):
+        self.delay()
+        return VFS_Real.stat(self, selector)
+
+    def isdir(self, selector):
+        self.delay()
+        return VFS_Real.isdir(self, selector)
+
+    def isfile(self, selector):
+        self.delay()
+        return VFS_Real.isfile(self, selector)
+
+    def exists(self, selector):
+        self.delay()
+        return VFS_Real.exists(self, selector)
+
+    def open(self, selector, *args, **kwargs):
+        self.delay()
+        return apply(VFS_Real.open, (self, selector) + args, kwargs)
+
+    def listdir(self, selector):
+        self.delay()
+        return VFS_Real.listdir(self, selector)
+
 def getstringlogger():
     config = getconfig()
     config.set('logger', 'logmethod', 'file')
@@ -0,0 +1,87 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: TLS for listeners
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import socket
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+# The protocol versions, oldest first, with the option that disables each.
+versions = [('SSLv3', 'OP_NO_SSLv3'), ('TLSv1', 'OP_NO_TLSv1'),
+            ('TLSv1.1', 'OP_NO_TLSv1_1'), ('TLSv1.2', 'OP_NO_TLSv1_2'),
+            ('TLSv1.3', 'OP_NO_TLSv1_3')]
+
+def getcontext(config, section):
+    """Returns an SSLContext for a listener, set up from its section of
+    the config file.
+
+    The context is made once, in the process that accepts connections,
+    before it forks any workers or gives up its privileges.  So workers
+    can read the keys however the files are protected, and all of them
+    share its session ticket keys: a client returning with a ticket from
+    one worker can resume its session with any other."""
+    if not ssl or not hasattr(ssl, 'SSLContext'):
+        raise Exception, \
+              "TLS listeners need the ssl module of Python 2.7.9 or later"
+
+    def getoption(name, default = None):
+        if config.has_option(section, name):
+            return config.get(section, name)
+        return default
+
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    options = ssl.OP_NO_SSLv2 | getattr(ssl, 'OP_NO_COMPRESSION', 0) | \
+              getattr(ssl, 'OP_CIPHER_SERVER_PREFERENCE', 0) | \
+              getattr(ssl, 'OP_SINGLE_DH_USE', 0) | \
+              getattr(ssl, 'OP_SINGLE_ECDH_USE', 0)
+    minprotocol = getoption('minprotocol', 'TLSv1.2')
+    names = [name for name, option in versions]
+    if not minprotocol in names:
+        raise ValueError, "minprotocol must be one of %s" % ', '.join(names)
+    for name, option in versions[:names.index(minprotocol)]:
+        options |= getattr(ssl, option, 0)
+    if config.has_option(section, 'sessiontickets') and \
+       not config.getboolean(section, 'sessiontickets'):
+        # Python 2's ssl module lacks the name for OpenSSL's option.
+        options |= getattr(ssl, 'OP_NO_TICKET', 0x4000)
+    context.options |= options
+
+    if getoption('ciphers'):
+        context.set_ciphers(getoption('ciphers'))
+    context.load_cert_chain(getoption('certfile'), getoption('keyfile'))
+    return context
+
+def wrap(context, sock, timeout):
+    """Makes the TLS handshake with the client on sock, giving up if any
+    step of it takes more than timeout seconds, and returns the
+    resulting socket.  Like sock, it blocks."""
+    if timeout > 0:
+        sock.settimeout(timeout)
+    tlssock = context.wrap_socket(sock, server_side = 1)
+    tlssock.settimeout(None)
+    return tlssock
+
+def closenotify(sock):
+    """Tells the client the response is complete, so that it can tell
+    it wasn't cut short, without waiting for it to say so as well."""
+    try:
+        sock.settimeout(0.0)
+        sock.unwrap()
+    except (socket.error, ValueError, AttributeError):
+        pass
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of TLS listeners
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, socket, ssl, threading, tempfile, shutil, os
+from pygopherd import tls, initialization, testutil
+from pygopherd.handlers import base
+
+def makecert(dir):
+    """Makes a self-signed certificate and key in dir with the openssl
+    program.  Returns the certificate's file name, or None if it can't."""
+    certfile = os.path.join(dir, 'cert.pem')
+    status = os.system("openssl req -x509 -newkey rsa:2048 -nodes -days 1 "
+                       "-subj /CN=localhost -keyout %s -out %s "
+                       ">/dev/null 2>&1" % (certfile, certfile))
+    if status or not os.path.exists(certfile):
+        return None
+    return certfile
+
+class TLSTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.certfile = makecert(self.dir)
+        if not self.certfile:
+            self.server = None
+            return
+        fd = open(os.path.join(self.dir, 'README'), 'w')
+        fd.write('Read me\n')
+        fd.close()
+        config = testutil.getconfig()
+        config.set("pygopherd", "root", self.dir)
+        base.rootpath = self.dir
+        config.set("pygopherd", "servertype", "ThreadingTCPServer")
+        config.set("pygopherd", "interface", "127.0.0.1")
+        config.set("pygopherd", "port", "0")
+        config.set("logger", "logmethod", "none")
+        for name, proxyprotocol in [('secure', 'no'), ('proxied', 'yes')]:
+            section = 'listener.' + name
+            config.add_section(section)
+            config.set(section, "address", "127.0.0.1:0")
+            config.set(section, "tls", "yes")
+            config.set(section, "certfile", self.certfile)
+            config.set(section, "proxyprotocol", proxyprotocol)
+        self.config = config
+        initialization.initlogger(config, 'TESTING')
+        self.server = initialization.getserverobject(config)
+        self.thread = threading.Thread(target = self.server.serve_forever,
+                                       args = (0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.thread.join()
+            for server in self.server.listeners:
+                server.server_close()
+        base.rootpath = None
+        shutil.rmtree(self.dir)
+
+    def request(self, listener, data, proxyheader = ''):
+        server = self.server.listeners[listener]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(server.socket.getsockname())
+        sock.sendall(proxyheader)
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        sock = context.wrap_socket(sock)
+        sock.sendall(data)
+        retval = ''
+        while 1:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            retval += chunk
+        sock.close()
+        return retval
+
+    def testtls(self):
+        if not self.server:
+            return                      # No openssl program to make a cert
+        main, proxied, secure = self.server.listeners
+        self.assertEquals(self.request(2, "/README\r\n"), "Read me\n")
+        assert self.request(2, "GET /README HTTP/1.0\r\n\r\n").endswith(
+            "\r\n\r\nRead me\n")
+        self.assertEquals(self.request(1, "/README\r\n",
+                                       "PROXY TCP4 192.0.2.5 192.0.2.1 "
+                                       "5555 70\r\n"), "Read me\n")
+        # The main listener is not encrypted.
+        self.assertRaises(ssl.SSLError, self.request, 0, "/README\r\n")
+
+    def testcontext(self):
+        if not self.server:
+            return
+        self.config.set("listener.secure", "minprotocol", "TLSv1.3")
+        context = tls.getcontext(self.config, "listener.secure")
+        assert context.options & ssl.OP_NO_TLSv1_2
+        assert not context.options & 0x4000     # OP_NO_TICKET
+        self.config.set("listener.secure", "sessiontickets", "no")
+        assert tls.getcontext(self.config, "listener.secure").options & 0x4000
+        self.config.set("listener.secure", "minprotocol", "TLSv9")
+        self.assertRaises(ValueError, tls.getcontext, self.config,
+                          "listener.secure")
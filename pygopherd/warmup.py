@@ -0,0 +1,154 @@
+# pygopherd -- Gopher-based protocol server in Python
+# module: warming the caches before serving
+# Copyright (C) 2003 John Goerzen
+# <jgoerzen@complete.org>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Fills the caches of a server that has just started, before it takes
+its first request: directory listings and their cache files, compiled
+gophermaps, HTML titles, ZIP indexes and the content cache.
+
+What to warm comes from the log of the server that ran before, whose
+most requested selectors are warmed first, or else, if walk is on,
+from walking the tree from the root.  Either way, warming stops after timelimit seconds.
+
+Only handlers with warmable set are used, so no script or application
+is run.  Under the forking server, what is kept in memory is warmed in
+the server process, and so is there for every request it forks for."""
+
+import re, time
+from pygopherd import logger, contentcache, GopherExceptions
+from pygopherd.handlers import base, HandlerMultiplexer
+
+section = "warmup"
+
+# Read no more than this many bytes from the end of the log.
+maxlogread = 16777216
+
+# A request as logged by protocols.base.BaseGopherProtocol.log().
+logpattern = re.compile(r'\[[^/\]]+/[^\]]+\]: (/.*)$')
+
+def getoption(config, name, default):
+    if config.has_option(section, name):
+        return config.get(section, name)
+    return default
+
+def gettimelimit(config):
+    return float(getoption(config, "timelimit", "30"))
+
+def readaccesslog(config):
+    """Returns the most requested selectors in the log named by the
+    accesslog option, most requested first; None if there is no log.
+    Called before the server chroots or gives up its privileges, so the
+    log can be anywhere the server can read at startup."""
+    filename = getoption(config, "accesslog", None)
+    top = int(getoption(config, "top", "500"))
+    if not filename or top <= 0:
+        return None
+    try:
+        fd = open(filename, 'rt')
+    except IOError, e:
+        logger.log("Warm-up: can't read log %s: %s" % (filename, e))
+        return None
+    try:
+        fd.seek(0, 2)
+        if fd.tell() > maxlogread:
+            fd.seek(-maxlogread, 2)
+            fd.readline()               # Part of a line
+        else:
+            fd.seek(0)
+        counts = {}
+        for line in fd:
+            match = logpattern.search(line.rstrip('\r\n'))
+            if match:
+                selector = match.group(1)
+                counts[selector] = counts.get(selector, 0) + 1
+    finally:
+        fd.close()
+    ranked = [(-count, selector) for selector, count in counts.items()]
+    ranked.sort()
+    return [selector for count, selector in ranked[:top]]
+
+def warmselector(config, selector, loadcontent = 0):
+    """Prepares selector as a request for it would.  Returns the handler
+    used and, for a directory, the listing it made, or None if there is
+    no handler that may be warmed."""
+    try:
+        handler = HandlerMultiplexer.getHandler(selector, None, None, config)
+        if not handler.warmable:
+            return None
+        handler.getentry()
+        handler.prepare()
+        dirlist = None
+        if handler.isdir():
+            dirlist = handler.getdirlist()
+        elif loadcontent and handler.vfs.contentcacheable:
+            cache = contentcache.getcache(config)
+            if cache:
+                cache.preload(handler.vfs.getfspath(handler.getselector()))
+        return (handler, dirlist)
+    finally:
+        base.finishrequest()
+
+def warm(config, selectors = None):
+    """Warms the caches for selectors, as returned by readaccesslog(), or
+    if that is None and walk is on, for the directories found from the
+    root down, for up to timelimit seconds.  Returns the number of selectors warmed."""
+    timelimit = gettimelimit(config)
+    walk = 0
+    if config.has_option(section, "walk"):
+        walk = config.getboolean(section, "walk")
+    if timelimit <= 0 or (selectors == None and not walk):
+        return 0
+    start = time.time()
+    deadline = start + timelimit
+    warmed = 0
+
+    if selectors != None:
+        for selector in selectors:
+            if time.time() >= deadline:
+                break
+            try:
+                if warmselector(config, selector, 1):
+                    warmed += 1
+            except GopherExceptions.FileNotFound:
+                pass
+            except Exception, e:
+                GopherExceptions.log(e)
+    else:
+        queue = ['/']
+        seen = {'/': 1}
+        while queue and time.time() < deadline:
+            selector = queue.pop(0)
+            try:
+                warmedselector = warmselector(config, selector)
+            except GopherExceptions.FileNotFound:
+                continue
+            except Exception, e:
+                GopherExceptions.log(e)
+                continue
+            if not warmedselector:
+                continue
+            warmed += 1
+            for entry in warmedselector[1] or []:
+                if entry.gettype() == '1' and not entry.gethost() and \
+                   entry.getselector() and \
+                   not seen.has_key(entry.getselector()):
+                    seen[entry.getselector()] = 1
+                    queue.append(entry.getselector())
+
+    logger.log("Warm-up: %d selectors warmed in %.1f seconds" % \
+               (warmed, time.time() - start))
+    return warmed
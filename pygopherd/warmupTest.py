@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of cache warming
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, tempfile, shutil, os
+from pygopherd import warmup, contentcache, initialization, testutil
+from pygopherd.handlers import base, dir, HandlerMultiplexer
+
+# An application that notes when it is run.
+pygsource = """from pygopherd.handlers.pyg import PYGBase
+
+class PYGMain(PYGBase):
+    def canhandlerequest(self):
+        return 1
+
+    def prepare(self):
+        open(%r, 'w').close()
+"""
+
+class WarmupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ['a/b', 'map']:
+            os.makedirs(os.path.join(self.root, name))
+        self.write('c.txt', 'Some text\n')
+        self.write('a/b/d.txt', 'More text\n')
+        self.write('map/gophermap', 'iWelcome\tfake\t(NULL)\t0\n')
+        self.write('run.pyg', pygsource % os.path.join(self.root, 'ran'))
+        os.chmod(os.path.join(self.root, 'run.pyg'), 0755)
+        self.config = testutil.getconfig()
+        self.config.set("pygopherd", "root", self.root)
+        self.config.set("logger", "logmethod", "none")
+        self.config.set("handlers.dir.DirHandler", "cachetime", "180")
+        self.config.set("contentcache", "maxsize", "1000")
+        initialization.initlogger(self.config, 'TESTING')
+        # The directory handler keeps its settings once read; start
+        # afresh, and leave them as they were for other tests.
+        self.saved = (dir.cachetime, dir.cachefile, dir.entrycache,
+                      dir.metadatathreads, HandlerMultiplexer.handlers)
+        dir.cachetime = None
+        base.rootpath = self.root
+        contentcache.cache = None
+
+    def tearDown(self):
+        dir.cachetime, dir.cachefile, dir.entrycache, dir.metadatathreads, \
+                       HandlerMultiplexer.handlers = self.saved
+        base.rootpath = None
+        contentcache.cache = None
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        fd = open(os.path.join(self.root, name), 'w')
+        fd.write(data)
+        fd.close()
+
+    def iscached(self, name):
+        return os.path.exists(os.path.join(self.root, name,
+                                           '.cache.pygopherd.dir'))
+
+    def testreadaccesslog(self):
+        self.assertEquals(warmup.readaccesslog(self.config), None)
+        self.write('log',
+                   "10.0.0.1 [GopherProtocol/DirHandler]: /\n"
+                   "Jan  6 12:00:00 host pygopherd[42]: 10.0.0.2 "
+                   "[HTTPProtocol/FileHandler]: /c.txt\n"
+                   "Pygopherd starting, using configuration file x\n"
+                   "10.0.0.1 [GopherProtocol/FileHandler]: /c.txt\n"
+                   "10.0.0.3 [GopherProtocol/DirHandler]: /a dir/b\n"
+                   "10.0.0.3 [GopherProtocol/DirHandler]: /a dir/b\n"
+                   "10.0.0.3 [GopherProtocol/DirHandler]: /a dir/b\n")
+        self.config.set("warmup", "accesslog",
+                        os.path.join(self.root, 'log'))
+        self.config.set("warmup", "top", "2")
+        self.assertEquals(warmup.readaccesslog(self.config),
+                          ['/a dir/b', '/c.txt'])
+        self.config.set("warmup", "top", "0")
+        self.assertEquals(warmup.readaccesslog(self.config), None)
+
+    def testwalk(self):
+        self.config.remove_option("warmup", "walk")
+        self.assertEquals(warmup.warm(self.config), 0)
+        self.config.set("warmup", "walk", "yes")
+        self.assertEquals(warmup.warm(self.config), 4)
+        for name in ['', 'a', 'a/b']:
+            assert self.iscached(name), name
+        # Gophermaps are compiled instead.
+        assert not self.iscached('map')
+
+        self.config.set("warmup", "walk", "no")
+        self.assertEquals(warmup.warm(self.config), 0)
+        self.config.set("warmup", "walk", "yes")
+        self.config.set("warmup", "timelimit", "0")
+        self.assertEquals(warmup.warm(self.config), 0)
+
+    def testselectors(self):
+        self.config.set("handlers.HandlerMultiplexer", "handlers",
+                        "[gophermap.BuckGophermapHandler, UMN.UMNDirHandler, "
+                        "pyg.PYGHandler, file.FileHandler]")
+        HandlerMultiplexer.handlers = None
+        selectors = ['/c.txt', '/a/b', '/run.pyg', '/missing', '/map']
+        self.assertEquals(warmup.warm(self.config, selectors), 3)
+        assert self.iscached('a/b')
+        assert not self.iscached('')
+        assert not os.path.exists(os.path.join(self.root, 'ran'))
+        cache = contentcache.cache
+        assert cache.protected.has_key(os.path.join(self.root, 'c.txt'))
+        # Served from memory from the first request on.
+        self.assertEquals(cache.get(os.path.join(self.root, 'c.txt')),
+                          'Some text\n')
+        self.assertEquals(cache.hits, 1)
+
+    def testpreload(self):
+        cache = contentcache.ContentCache(100, 100, 0)
+        paths = []
+        for i in range(4):
+            paths.append(os.path.join(self.root, 'f%d' % i))
+            self.write('f%d' % i, 'x' * 30)
+        self.assertEquals(map(cache.preload, paths), [1, 1, 1, 0])
+        # What doesn't fit in the protected segment goes on probation;
+        # nothing is pushed out to make room.
+        self.assertEquals((cache.protectedsize, cache.probationsize), (60, 30))
+        self.assertEquals(cache.preload(self.root), 0)
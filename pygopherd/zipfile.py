@@ -7,6 +7,11 @@ import binascii
 from StringIO import StringIO
 from socket import _fileobject as BaseFileSimulator
 
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
 _STRING_TYPES = (types.StringType,)
 if hasattr(types, "UnicodeType"):
     _STRING_TYPES = _STRING_TYPES + (types.UnicodeType,)
@@ -29,13 +34,23 @@ ZIP_DEFLATED = 8
 # Other ZIP compression methods not supported
 
 # Here are some struct module formats for reading headers
-structEndArchive = "<4s4H2lH"     # 9 items, end of archive, 22 bytes
+structEndArchive = "<4s4H2LH"     # 9 items, end of archive, 22 bytes
 stringEndArchive = "PK\005\006"   # magic number for end of archive record
-structCentralDir = "<4s4B4H3l5HLl"# 19 items, central directory, 46 bytes
+structCentralDir = "<4s4B4Hl2L5H2L"# 19 items, central directory, 46 bytes
 stringCentralDir = "PK\001\002"   # magic number for central directory
-structFileHeader = "<4s2B4H3l2H"  # 12 items, file header record, 30 bytes
+structFileHeader = "<4s2B4Hl2L2H"  # 12 items, file header record, 30 bytes
 stringFileHeader = "PK\003\004"   # magic number for file header
 
+# ZIP64 records, used when a count, size or offset does not fit in the
+# classic fields above.  Those fields then hold 0xFFFF or 0xFFFFFFFF.
+structEndArchive64Locator = "<4sLQL" # 4 items, locator, 20 bytes
+stringEndArchive64Locator = "PK\006\007"
+structEndArchive64 = "<4sQ2H2L4Q"  # 10 items, zip64 end of archive, 56 bytes
+stringEndArchive64 = "PK\006\006"
+ZIP64_EXTRA_ID = 0x0001            # Header ID of the zip64 extra field
+ZIP64_LIMIT = 0xFFFFFFFFL
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
 # indexes of entries in the central directory structure
 _CD_SIGNATURE = 0
 _CD_CREATE_VERSION = 1
@@ -83,11 +98,58 @@ def is_zipfile(filename):
         pass
     return False
 
+def _EndRecData64(fpin, offset, endrec):
+    """Replace the values in endrec with those from the ZIP64 "End of
+    Central Directory" record, if the archive has one.
+
+    offset is the file offset of the classic record.  The ZIP64 locator
+    immediately precedes it, and gives the offset of the ZIP64 record."""
+    if offset < 20:
+        return endrec
+    fpin.seek(offset - 20, 0)
+    data = fpin.read(20)
+    if len(data) != 20 or data[0:4] != stringEndArchive64Locator:
+        return endrec
+    sig, diskno, reloff, disks = struct.unpack(structEndArchive64Locator,
+                                               data)
+    if diskno != 0 or disks > 1:
+        raise BadZipfile, "zipfiles that span multiple disks are not supported"
+
+    # The record may be followed by an extensible data sector, so it is
+    # found where the locator says.  That offset is from the start of
+    # the archive; if something has been prepended to it, the record is
+    # looked for just before the locator instead, as it usually is.
+    for recoffset in [reloff, offset - 20 - 56]:
+        if recoffset < 0:
+            continue
+        fpin.seek(recoffset, 0)
+        data = fpin.read(56)
+        if len(data) == 56 and data[0:4] == stringEndArchive64:
+            break
+    else:
+        raise BadZipfile, "Bad magic number for ZIP64 end of central directory"
+    (sig, sz, create_version, read_version, disk_num, disk_dir,
+     dircount, dircount2, dirsize, diroffset) = \
+        struct.unpack(structEndArchive64, data)
+
+    endrec[1] = disk_num
+    endrec[2] = disk_dir
+    endrec[3] = dircount
+    endrec[4] = dircount2
+    endrec[5] = dirsize
+    endrec[6] = diroffset
+    # The central directory ends where the ZIP64 record starts; this keeps
+    # the concatenation arithmetic in the readers valid.
+    endrec[9] = recoffset
+    return endrec
+
 def _EndRecData(fpin):
     """Return data from the "End of Central Directory" record, or None.
 
     The data is a list of the nine items in the ZIP "End of central dir"
-    record followed by a tenth item, the file seek offset of this record."""
+    record followed by a tenth item, the file seek offset of this record.
+    For ZIP64 archives, the counts, sizes and offsets come from the ZIP64
+    record and the tenth item is the offset of that record."""
     fpin.seek(-22, 2)               # Assume no archive comment.
     filesize = fpin.tell() + 22     # Get file size
     data = fpin.read()
@@ -96,7 +158,7 @@ def _EndRecData(fpin):
         endrec = list(endrec)
         endrec.append("")               # Append the archive comment
         endrec.append(filesize - 22)    # Append the record start offset
-        return endrec
+        return _EndRecData64(fpin, filesize - 22, endrec)
     # Search the last END_BLOCK bytes of the file for the record signature.
     # The comment is appended to the ZIP file and has a 16 bit length.
     # So the comment may be up to 64K long.  We limit the search for the
@@ -114,9 +176,34 @@ def _EndRecData(fpin):
             # Append the archive comment and start offset
             endrec.append(comment)
             endrec.append(filesize - END_BLOCK + start)
-            return endrec
+            return _EndRecData64(fpin, filesize - END_BLOCK + start, endrec)
     return      # Error, return None
 
+def _decodezip64extra(zinfo, extra):
+    """Apply the ZIP64 extended information extra field, if present in
+    extra, to zinfo.  Only the fields whose 32-bit values overflowed
+    appear in it, in a fixed order."""
+    while len(extra) >= 4:
+        tp, ln = struct.unpack('<2H', extra[:4])
+        if tp == ZIP64_EXTRA_ID:
+            data = extra[4:4+ln]
+            fields = []
+            while len(data) >= 8:
+                fields.append(struct.unpack('<Q', data[:8])[0])
+                data = data[8:]
+            try:
+                if zinfo.file_size == ZIP64_LIMIT:
+                    zinfo.file_size = fields.pop(0)
+                if zinfo.compress_size == ZIP64_LIMIT:
+                    zinfo.compress_size = fields.pop(0)
+                if zinfo.header_offset == ZIP64_LIMIT:
+                    zinfo.header_offset = fields.pop(0)
+            except IndexError:
+                raise BadZipfile, "Corrupt ZIP64 extra field for %s" % \
+                      zinfo.filename
+            return
+        extra = extra[4+ln:]
+
 
 class ZipInfo:
     """Class with attributes describing each file in the ZIP archive."""
@@ -178,20 +265,26 @@ class FileSimulator(BaseFileSimulator):
         pass
 
 class ZipDecompressor:
-    def __init__(self, fd, zinfo):
-        self.fp = fd
+    """Streams one member out of a ZipReader.  Every read is positional,
+    so any number of decompressors may share one archive."""
+
+    def __init__(self, zip, zinfo):
+        self.zip = zip
         self.zinfo = zinfo
         self.buffer = ''
         self.bytesread = 0
         self.byteswritten = 0           # Used for deflation only
         self.crc = binascii.crc32("")
-        self.filepos = self.fp.tell()
 
         if zinfo.compress_type == ZIP_STORED:
             self.read = self.read_stored
         elif zinfo.compress_type == ZIP_DEFLATED:
             self.read = self.read_deflated
             self.dc = zlib.decompressobj(-15)
+        else:
+            raise BadZipfile, \
+                  "Unsupported compression method %d for file %s" % \
+                  (zinfo.compress_type, zinfo.filename)
         self.recv = self.read
 
     def copyto(self, destfd, size = -1):
@@ -207,6 +300,15 @@ class ZipDecompressor:
         if self.crc != self.zinfo.CRC:
             raise BadZipfile, "Bad CRC-32 for file %s" % self.zinfo.filename
 
+    def _readraw(self, count):
+        """Read the next count compressed bytes of this member."""
+        data = self.zip._pread(self.zinfo.file_offset + self.bytesread, count)
+        if not len(data):
+            raise BadZipfile, "Truncated data for file %s" % \
+                  self.zinfo.filename
+        self.bytesread += len(data)
+        return data
+
     def flush(self):
         while self.byteswritten < self.zinfo.file_size:
             self.read(min(4096, self.zinfo.file_size - self.byteswritten))
@@ -222,12 +324,9 @@ class ZipDecompressor:
             return ''
 
         count = count + self.bytesread
-        self.fp.seek(self.zinfo.file_offset + self.bytesread)
         retval = ''
         while self.bytesread < count:
-            data = self.fp.read(min(4096, count - self.bytesread))
-            retval += data
-            self.bytesread += len(data)
+            retval += self._readraw(min(4096, count - self.bytesread))
         self.byteswritten = self.bytesread
         self.crc = binascii.crc32(retval, self.crc)
         if self.bytesread == self.zinfo.compress_size:
@@ -240,13 +339,9 @@ class ZipDecompressor:
         if count < 1:
             return ''
 
-        count = count
-        self.fp.seek(self.zinfo.file_offset + self.bytesread)
-
         # First, fill up the buffer.
         while len(self.buffer) < count:
-            bytes = self.fp.read(min(self.zinfo.compress_size - self.bytesread, 4096))
-            self.bytesread += len(bytes)
+            bytes = self._readraw(min(self.zinfo.compress_size - self.bytesread, 4096))
             result = self.dc.decompress(bytes)
             if len(result):
                 self.buffer += result
@@ -277,14 +372,19 @@ class ZipReader:
 
     file: Either the path to the file, or a file-like object.
           If it is a path, the file will be opened and closed by ZipFile.
+
+    All reads are positional (see _pread), so one ZipReader may be shared
+    by any number of threads streaming members at the same time.
     """
 
     fp = None                   # Set here since __del__ checks it
+    fd = None
 
     def __init__(self, file):
         """Open the ZIP file with mode read "r", write "w" or append "a"."""
         self.debug = 0  # Level of printing: 0 through 3
         self.locationmap = {} 
+        self.lock = threading.Lock()
 
         # Check if we were passed a file-like object
         if type(file) in _STRING_TYPES:
@@ -295,6 +395,10 @@ class ZipReader:
             self._filePassed = 1
             self.fp = file
             self.filename = getattr(file, 'name', None)
+        try:
+            self.fd = self.fp.fileno()
+        except (AttributeError, IOError, ValueError):
+            self.fd = None
         try:
             self._InitZip()
         except BadZipfile:
@@ -303,6 +407,30 @@ class ZipReader:
                 self.fp = None
             raise
 
+    def _pread(self, offset, count):
+        """Return up to count bytes starting at offset.  Does not depend on
+        or disturb any shared file position.  Uses os.pread() on the
+        descriptor when the platform has it; otherwise the seek and read
+        are done together under self.lock."""
+        if self.fp is None:
+            raise RuntimeError, \
+                  "Attempt to read ZIP archive that was already closed"
+        if self.fd is not None and hasattr(os, 'pread'):
+            retval = ''
+            while len(retval) < count:
+                data = os.pread(self.fd, count - len(retval),
+                                offset + len(retval))
+                if not len(data):
+                    break
+                retval += data
+            return retval
+        self.lock.acquire()
+        try:
+            self.fp.seek(offset, 0)
+            return self.fp.read(count)
+        finally:
+            self.lock.release()
+
     def GetContents(self):
         """Read the directory, making sure we close the file if the format
         is bad.
@@ -313,8 +441,11 @@ class ZipReader:
         self._RealGetContents()
 
     def _InitZip(self):
-        fp = self.fp
-        endrec = _EndRecData(fp)
+        self.lock.acquire()
+        try:
+            endrec = _EndRecData(self.fp)
+        finally:
+            self.lock.release()
         if not endrec:
             raise BadZipfile, "File is not a zip file"
         if self.debug > 1:
@@ -328,25 +459,53 @@ class ZipReader:
         concat = x - self.offset_cd
         self.concat = concat
         if self.debug > 2:
-            print "given, inferred, offset", offset_cd, x, concat
+            print "given, inferred, offset", self.offset_cd, x, concat
         # self.start_dir:  Position of start of central directory
         self.start_dir = self.offset_cd + concat
 
     def _RealGetContents(self):
-        """Read in the table of contents for the ZIP file."""
-        fp = self.fp
-        fp.seek(self.start_dir, 0)
+        """Read in the table of contents for the ZIP file.
+
+        The central directory is read in blocks of at most CDBLOCKSIZE
+        bytes, so only the name-to-location map grows with the number of
+        members, however large the archive is."""
         total = 0
+        buffer = ''
+        bufstart = 0                    # Offset of buffer within the dir
         while total < self.size_cd:
-            centdir = self._getcentdir() # Reads 46 bytes
-            filename = fp.read(centdir[_CD_FILENAME_LENGTH])
+            if total - bufstart + 46 > len(buffer):
+                buffer = self._fillcdbuffer(total, 46)
+                bufstart = total
+            offset = total - bufstart
+            if buffer[offset:offset+4] != stringCentralDir:
+                raise BadZipfile, "Bad magic number for central directory"
+            centdir = struct.unpack(structCentralDir,
+                                    buffer[offset:offset+46])
+            recordlen = (46 + centdir[_CD_FILENAME_LENGTH]
+                         + centdir[_CD_EXTRA_FIELD_LENGTH]
+                         + centdir[_CD_COMMENT_LENGTH])
+            if offset + 46 + centdir[_CD_FILENAME_LENGTH] > len(buffer):
+                buffer = self._fillcdbuffer(total, recordlen)
+                bufstart = total
+                offset = 0
+            filename = buffer[offset+46:offset+46+centdir[_CD_FILENAME_LENGTH]]
 
             self.locationmap[filename] = self.start_dir + total
             # Skip past the other stuff.
-            total = (total + 46 + centdir[_CD_FILENAME_LENGTH]
-                     + centdir[_CD_EXTRA_FIELD_LENGTH]
-                     + centdir[_CD_COMMENT_LENGTH])
-            fp.seek(self.start_dir + total, 0)
+            total = total + recordlen
+
+    CDBLOCKSIZE = 65536
+
+    def _fillcdbuffer(self, total, needed):
+        """Return a buffer of central directory data starting at offset
+        total within the directory and holding at least needed bytes, if
+        the directory has that many left."""
+        count = max(needed, self.CDBLOCKSIZE)
+        count = min(count, self.size_cd - total)
+        data = self._pread(self.start_dir + total, count)
+        if len(data) < min(needed, self.size_cd - total):
+            raise BadZipfile, "Truncated central directory"
+        return data
 
     def namelist(self):
         """Return a list of file names in the archive."""
@@ -383,9 +542,9 @@ class ZipReader:
         """Return the instance of ZipInfo given 'name'."""
         return self.getinfofrompos(self.locationmap[name])
 
-    def _getcentdir(self):
-        """Read central directory info from an ALREADY-SEEKED fp!"""
-        centdir = self.fp.read(46)
+    def _getcentdir(self, location):
+        """Read the central directory record at location."""
+        centdir = self._pread(location, 46)
         if centdir[0:4] != stringCentralDir:
             raise BadZipfile, "Bad magic number for central directory"
         centdir = struct.unpack(structCentralDir, centdir)
@@ -396,20 +555,23 @@ class ZipReader:
     def getinfofrompos(self, location):
         if location < 0:
             raise KeyError, "Attempt to get information from non-file"
-        fp = self.fp
-        fp.seek(location, 0)
-        centdir = self._getcentdir()
-        filename = fp.read(centdir[_CD_FILENAME_LENGTH])
+        centdir = self._getcentdir(location)
+        pos = location + 46
+        filename = self._pread(pos, centdir[_CD_FILENAME_LENGTH])
+        pos += centdir[_CD_FILENAME_LENGTH]
         # Create ZipInfo instance to store file information
         x = ZipInfo(filename)
-        x.extra = fp.read(centdir[_CD_EXTRA_FIELD_LENGTH])
-        x.comment = fp.read(centdir[_CD_COMMENT_LENGTH])
-        x.header_offset = centdir[_CD_LOCAL_HEADER_OFFSET] + self.concat
+        x.extra = self._pread(pos, centdir[_CD_EXTRA_FIELD_LENGTH])
+        pos += centdir[_CD_EXTRA_FIELD_LENGTH]
+        x.comment = self._pread(pos, centdir[_CD_COMMENT_LENGTH])
+        x.header_offset = centdir[_CD_LOCAL_HEADER_OFFSET]
         # file_offset must be computed below...
         (x.create_version, x.create_system, x.extract_version, x.reserved,
             x.flag_bits, x.compress_type, t, d,
             x.CRC, x.compress_size, x.file_size) = centdir[1:12]
         x.volume, x.internal_attr, x.external_attr = centdir[15:18]
+        _decodezip64extra(x, x.extra)
+        x.header_offset = x.header_offset + self.concat
         # Convert date/time code to (year, month, day, hour, min, sec)
         x.date_time = ( (d>>9)+1980, (d>>5)&0xF, d&0x1F,
                                  t>>11, (t>>5)&0x3F, (t&0x1F) * 2 )
@@ -417,8 +579,7 @@ class ZipReader:
         # And now, read the info from the file's header.
 
         data = x
-        fp.seek(data.header_offset, 0)
-        fheader = fp.read(30)
+        fheader = self._pread(data.header_offset, 30)
         if fheader[0:4] != stringFileHeader:
             raise BadZipfile, "Bad magic number for file header"
         fheader = struct.unpack(structFileHeader, fheader)
@@ -429,7 +590,8 @@ class ZipReader:
         data.file_offset = (data.header_offset + 30
                             + fheader[_FH_FILENAME_LENGTH]
                             + fheader[_FH_EXTRA_FIELD_LENGTH])
-        fname = fp.read(fheader[_FH_FILENAME_LENGTH])
+        fname = self._pread(data.header_offset + 30,
+                            fheader[_FH_FILENAME_LENGTH])
         if fname != data.filename:
             raise RuntimeError, \
                   'File name in directory "%s" and header "%s" differ.' % (
@@ -446,7 +608,7 @@ class ZipReader:
         if not self.fp:
             raise RuntimeError, \
                   "Attempt to read ZIP archive that was already closed"
-        return FileSimulator(ZipDecompressor(self.fp, zi), None, -1)
+        return FileSimulator(ZipDecompressor(self, zi), None, -1)
         
     def open(self, name):
         return self.open_zinfo(self.getinfo(name))
@@ -470,6 +632,7 @@ class ZipReader:
         if not self._filePassed:
             self.fp.close()
         self.fp = None
+        self.fd = None
 
 
 ###########################################################################
@@ -583,12 +746,14 @@ class ZipFile:
             total = (total + centdir[_CD_FILENAME_LENGTH]
                      + centdir[_CD_EXTRA_FIELD_LENGTH]
                      + centdir[_CD_COMMENT_LENGTH])
-            x.header_offset = centdir[_CD_LOCAL_HEADER_OFFSET] + concat
+            x.header_offset = centdir[_CD_LOCAL_HEADER_OFFSET]
             # file_offset must be computed below...
             (x.create_version, x.create_system, x.extract_version, x.reserved,
                 x.flag_bits, x.compress_type, t, d,
                 x.CRC, x.compress_size, x.file_size) = centdir[1:12]
             x.volume, x.internal_attr, x.external_attr = centdir[15:18]
+            _decodezip64extra(x, x.extra)
+            x.header_offset = x.header_offset + concat
             # Convert date/time code to (year, month, day, hour, min, sec)
             x.date_time = ( (d>>9)+1980, (d>>5)&0xF, d&0x1F,
                                      t>>11, (t>>5)&0x3F, (t&0x1F) * 2 )
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+# Python-based gopher server
+# Module: test of the ZIP reader
+# COPYRIGHT #
+# Copyright (C) 2003 John Goerzen
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; version 2 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+# END OF COPYRIGHT #
+
+import unittest, os, random, binascii, tempfile, threading, struct
+from StringIO import StringIO
+from pygopherd import zipfile
+
+class ZipReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.zipfilename = tempfile.mktemp('.zip')
+        self.contents = {}
+        rand = random.Random(1436)
+        z = zipfile.ZipFile(self.zipfilename, 'w')
+        for i in range(12):
+            name = 'member%02d.txt' % i
+            # Long enough that every member takes many 4K reads.
+            data = ''.join(["%d:%f\n" % (i, rand.random()) \
+                            for x in range(rand.randint(2000, 8000))])
+            info = zipfile.ZipInfo(name, (2003, 1, 1, 0, 0, 0))
+            if i % 2:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            z.writestr(info, data)
+            self.contents[name] = data
+        z.close()
+        self.zip = zipfile.ZipReader(self.zipfilename)
+        self.zip.GetContents()
+
+    def tearDown(self):
+        self.zip.close()
+        os.unlink(self.zipfilename)
+
+    def testread(self):
+        names = self.zip.namelist()
+        names.sort()
+        keys = self.contents.keys()
+        keys.sort()
+        self.assertEquals(names, keys)
+        for name, data in self.contents.items():
+            self.assertEquals(self.zip.read(name), data)
+            zinfo = self.zip.getinfo(name)
+            self.assertEquals(zinfo.file_size, len(data))
+            self.assertEquals(zinfo.CRC, binascii.crc32(data))
+
+    def testinterleaved(self):
+        """Members opened from one reader must not share a position."""
+        names = self.contents.keys()
+        names.sort()
+        files = [self.zip.open(name) for name in names]
+        outputs = [StringIO() for name in names]
+        active = range(len(names))
+        while active:
+            for i in active[:]:
+                data = files[i].read(1000)
+                if not len(data):
+                    active.remove(i)
+                outputs[i].write(data)
+        for i in range(len(names)):
+            self.assertEquals(outputs[i].getvalue(), self.contents[names[i]])
+
+    def testthreadedstress(self):
+        names = self.contents.keys()
+        locations = [self.zip.locationmap[name] for name in names]
+        errors = []
+
+        def worker(seed):
+            rand = random.Random(seed)
+            try:
+                for i in range(25):
+                    x = rand.randrange(len(names))
+                    fd = self.zip.open_pos(locations[x])
+                    data = ''
+                    while 1:
+                        chunk = fd.read(rand.randint(1, 8192))
+                        if not len(chunk):
+                            break
+                        data += chunk
+                    if binascii.crc32(data) != \
+                       binascii.crc32(self.contents[names[x]]):
+                        errors.append("CRC mismatch for %s" % names[x])
+            except Exception, e:
+                errors.append("%s: %s" % (e.__class__.__name__, str(e)))
+
+        threads = [threading.Thread(target = worker, args = (seed,)) \
+                   for seed in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+
+    def testclosed(self):
+        fd = self.zip.open(self.contents.keys()[0])
+        self.zip.close()
+        self.assertRaises(RuntimeError, fd.read)
+
+def writezip64(filename, members, prefix = '', extensible = ''):
+    """Write a stored-only archive that uses ZIP64 records for every size,
+    offset and count, even though none of them need it.  Python's own
+    zipfile only does that past 4 GB.  extensible is put in the ZIP64
+    record's extensible data sector."""
+    fd = open(filename, 'wb')
+    fd.write(prefix)
+    centdirs = []
+    for name, data in members:
+        offset = fd.tell() - len(prefix)
+        crc = binascii.crc32(data)
+        extra = struct.pack('<2H2Q', 1, 16, len(data), len(data))
+        fd.write(struct.pack(zipfile.structFileHeader,
+                             zipfile.stringFileHeader, 45, 0, 0,
+                             zipfile.ZIP_STORED, 0, 0x2e21, crc,
+                             0xFFFFFFFFL, 0xFFFFFFFFL,
+                             len(name), len(extra)))
+        fd.write(name + extra + data)
+        extra = struct.pack('<2H3Q', 1, 24, len(data), len(data), offset)
+        centdirs.append(struct.pack(zipfile.structCentralDir,
+                                    zipfile.stringCentralDir, 45, 3, 45, 0,
+                                    0, zipfile.ZIP_STORED, 0, 0x2e21, crc,
+                                    0xFFFFFFFFL, 0xFFFFFFFFL,
+                                    len(name), len(extra), 0, 0, 0,
+                                    0100644L << 16, 0xFFFFFFFFL) + \
+                        name + extra)
+    cdoffset = fd.tell() - len(prefix)
+    centdir = ''.join(centdirs)
+    fd.write(centdir)
+    eocd64offset = fd.tell() - len(prefix)
+    fd.write(struct.pack(zipfile.structEndArchive64,
+                         zipfile.stringEndArchive64,
+                         44 + len(extensible), 45, 45, 0, 0,
+                         len(members), len(members), len(centdir), cdoffset))
+    fd.write(extensible)
+    fd.write(struct.pack(zipfile.structEndArchive64Locator,
+                         zipfile.stringEndArchive64Locator, 0,
+                         eocd64offset, 1))
+    fd.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive,
+                         0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFFL, 0xFFFFFFFFL, 0))
+    fd.close()
+
+class ZIP64TestCase(unittest.TestCase):
+    def setUp(self):
+        self.zipfilename = tempfile.mktemp('.zip')
+        self.members = [('dir/file%03d.txt' % i, "Contents of %d\n" % i * i) \
+                        for i in range(1, 60)]
+
+    def tearDown(self):
+        os.unlink(self.zipfilename)
+
+    def checkarchive(self, prefix, extensible = ''):
+        writezip64(self.zipfilename, self.members, prefix, extensible)
+        assert zipfile.is_zipfile(self.zipfilename)
+        z = zipfile.ZipReader(self.zipfilename)
+        # Force many refills of the central directory buffer.
+        z.CDBLOCKSIZE = 100
+        z.GetContents()
+        self.assertEquals(len(z.namelist()), len(self.members))
+        for name, data in self.members:
+            zinfo = z.getinfo(name)
+            self.assertEquals(zinfo.file_size, len(data))
+            self.assertEquals(zinfo.compress_size, len(data))
+            self.assertEquals(z.read(name), data)
+            self.assertEquals(z.open_pos(z.locationmap[name]).read(), data)
+        z.close()
+
+    def testzip64(self):
+        self.checkarchive('')
+
+    def testzip64concatenated(self):
+        self.checkarchive('#!/bin/sh\nexit 0\n')
+
+    def testzip64extensible(self):
+        # The ZIP64 record isn't always right before the locator.
+        self.checkarchive('', '\x01\x00\x04\x00data')
@@ -29,14 +29,42 @@ import pygopherd.protocols.baseTest
 import pygopherd.protocols.rfc1436Test
 import pygopherd.protocols
 import pygopherd.handlers.ZIP
+import pygopherd.handlers.mboxTest
+import pygopherd.handlers.htmlTest
+import pygopherd.handlers.dirTest
+import pygopherd.handlers.UMNTest
+import pygopherd.handlers.gophermapTest
+import pygopherd.handlers.pygTest
+import pygopherd.handlers.talTest
+import pygopherd.handlers.responsecacheTest
+import pygopherd.handlers.searchTest
 
 def suite():
     tests = [initializationTest,
+             admissionTest,
+             deadlineTest,
+             listenersTest,
+             tlsTest,
+             contentcacheTest,
+             warmupTest,
              GopherExceptionsTest,
              fileextTest,
              gopherentryTest,
              loggerTest,
              pipeTest,
+             parallelTest,
+             scriptworkersTest,
+             searchindexTest,
+             zipfileTest,
+             pygopherd.handlers.mboxTest,
+             pygopherd.handlers.htmlTest,
+             pygopherd.handlers.dirTest,
+             pygopherd.handlers.UMNTest,
+             pygopherd.handlers.gophermapTest,
+             pygopherd.handlers.pygTest,
+             pygopherd.handlers.talTest,
+             pygopherd.handlers.responsecacheTest,
+             pygopherd.handlers.searchTest,
              pygopherd.protocols.ProtocolMultiplexerTest,
              pygopherd.protocols.baseTest,
              pygopherd.protocols.rfc1436Test,